@@ -23,7 +23,6 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from __future__ import unicode_literals
-from re import match
 from datetime import datetime
 
 from django.db.models.aggregates import Sum
@@ -39,8 +38,8 @@ from lucterios.framework.editors import LucteriosEditor
 from lucterios.framework.xfercomponents import XferCompLabelForm, XferCompSelect, XferCompButton, XferCompGrid, XferCompEdit, XferCompFloat
 from lucterios.framework.tools import FORMTYPE_REFRESH, CLOSE_NO, ActionsManage, SELECT_SINGLE, SELECT_MULTI, CLOSE_YES
 from lucterios.framework.xferadvance import TITLE_MODIFY
-from lucterios.CORE.parameters import Params
 
+from diacamma.accounting.tools import FinancialParams
 from diacamma.accounting.models import current_system_account, FiscalYear, EntryLineAccount, EntryAccount, get_amount_sum, Third, CostAccounting
 from lucterios.framework import signal_and_lock
 from lucterios.contacts.models import CustomField
@@ -81,7 +80,7 @@ class AccountThirdEditor(LucteriosEditor):
     def edit(self, xfer):
         old_account = xfer.get_components("code")
         try:
-            chart_accouts = FiscalYear.get_current().chartsaccount_set.all().filter(code__regex=current_system_account().get_third_mask())
+            chart_accouts = FiscalYear.get_current().chartsaccount_set.all().filter(is_third_code=True)
             xfer.remove_component("code")
             sel_code = XferCompSelect("code")
             sel_code.set_location(old_account.col, old_account.row, old_account.colspan + 1, old_account.rowspan)
@@ -241,8 +240,7 @@ class EntryAccountEditor(LucteriosEditor):
         grid_lines = xfer.get_components('entrylineaccount')
         grid_lines.actions = []
         if self.item.has_third:
-            sum_customer = get_amount_sum(self.item.entrylineaccount_set.filter(
-                account__code__regex=current_system_account().get_third_mask()).aggregate(Sum('amount')))
+            sum_customer = get_amount_sum(self.item.entrylineaccount_set.filter(account__is_third_code=True).aggregate(Sum('amount')))
             if ((sum_customer < 0) and not self.item.has_cash) or ((sum_customer > 0) and self.item.has_cash):
                 lbl = XferCompLabelForm('asset_warning')
                 lbl.set_location(0, last_row + 3, 6)
@@ -409,7 +407,7 @@ class EntryLineAccountEditor(LucteriosEditor):
             pass
 
     def edit_creditdebit_for_line(self, xfer, column, row):
-        currency_decimal = Params.getvalue("accounting-devise-prec")
+        currency_decimal = FinancialParams.getvalue("accounting-devise-prec")
         edt = XferCompFloat('debit_val', -10000000, 10000000, currency_decimal)
         edt.set_location(column, row, 2)
         edt.set_value(self.item.get_debit())
@@ -450,7 +448,7 @@ class ModelLineEntryEditor(EntryLineAccountEditor):
         code = xfer.get_components('code')
         code.mask = current_system_account().get_general_mask()
         code.set_action(xfer.request, xfer.get_action(), modal=FORMTYPE_REFRESH, close=CLOSE_NO)
-        if match(current_system_account().get_third_mask(), self.item.code) is not None:
+        if current_system_account().match_mask(current_system_account().get_third_mask(), self.item.code):
             edit_third_for_line(xfer, 1, xfer.get_max_row() + 1, self.item.code, None, False)
         self.edit_creditdebit_for_line(xfer, 1, xfer.get_max_row() + 1)
 
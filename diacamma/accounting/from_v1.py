@@ -33,6 +33,7 @@ import sys
 import datetime
 from lucterios.CORE.parameters import Params
 from django.db.utils import IntegrityError
+from diacamma.accounting.tools import refresh_link_letters
 
 
 def decode_html(data):
@@ -243,6 +244,7 @@ class AccountingMigrate(MigrateAbstract):
                     self.entrylineaccount_list[
                         entrylineaccountid].third = self.third_list[tiers]
                     self.entrylineaccount_list[entrylineaccountid].save()
+        refresh_link_letters(apps.get_model("accounting", "AccountLink"), entryaccount_mdl)
 
     def _model(self):
         model_mdl = apps.get_model("accounting", "ModelEntry")
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models.aggregates import Sum
+import django.db.models.deletion
+
+
+def fill_balances(apps, schema_editor):
+    entrylineaccount = apps.get_model("accounting", "EntryLineAccount")
+    chartsaccountbalance = apps.get_model("accounting", "ChartsAccountBalance")
+    balances = {}
+    for data_line in entrylineaccount.objects.values('account', 'third', 'entry__journal', 'entry__close').annotate(data_sum=Sum('amount')):
+        key = (data_line['account'], data_line['third'], data_line['entry__journal'] == 1, data_line['entry__close'])
+        balances[key] = balances.get(key, 0) + data_line['data_sum']
+    chartsaccountbalance.objects.bulk_create([chartsaccountbalance(account_id=key[0], third_id=key[1], is_lastyear=key[2], is_close=key[3], amount=value)
+                                              for key, value in balances.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0008_thirdcustomfield'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChartsAccountBalance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_lastyear', models.BooleanField(default=False, verbose_name='last year')),
+                ('is_close', models.BooleanField(default=False, verbose_name='close')),
+                ('amount', models.FloatField(default=0, verbose_name='amount')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='accounting.ChartsAccount', verbose_name='account')),
+                ('third', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='accounting.Third', verbose_name='third')),
+            ],
+            options={
+                'verbose_name': 'balance of account',
+                'verbose_name_plural': 'balances of account',
+                'default_permissions': [],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='chartsaccountbalance',
+            unique_together=set([('account', 'third', 'is_lastyear', 'is_close')]),
+        ),
+        migrations.RunPython(fill_balances),
+    ]
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+
+from django.db import migrations, models
+
+FRENCH_THIRD_MASK = r'^40[0-9][0-9a-zA-Z]*$|^41[0-9][0-9a-zA-Z]*$|^42[0-9][0-9a-zA-Z]*$|^45[0-9][0-9a-zA-Z]*$'
+BELGIUM_THIRD_MASK = r'^44[0-9][0-9a-zA-Z]*$|^40[0-9][0-9a-zA-Z]*$|^455[0-9][0-9a-zA-Z]*$|^47[0-9][0-9a-zA-Z]*|410[0-9a-zA-Z]*$'
+
+SYSTEM_MASKS = {
+    'diacamma.accounting.system.french.FrenchSystemAcounting': {'is_cash_code': r'^5[0-9][0-9][0-9a-zA-Z]*$', 'is_third_code': FRENCH_THIRD_MASK,
+                                                                'is_customer_code': r'^41[0-9][0-9a-zA-Z]*$', 'is_revenue_code': r'^7[0-9][0-9][0-9a-zA-Z]*$',
+                                                                'is_expense_code': r'^6[0-9][0-9][0-9a-zA-Z]*$', 'is_annexe_code': r'^8[0-9][0-9][0-9a-zA-Z]*$'},
+    'diacamma.accounting.system.belgium.BelgiumSystemAcounting': {'is_cash_code': r'^5[0-9][0-9][0-9a-zA-Z]*$', 'is_third_code': BELGIUM_THIRD_MASK,
+                                                                  'is_customer_code': r'^40[0-9][0-9a-zA-Z]*$', 'is_revenue_code': r'^7[0-9][0-9][0-9a-zA-Z]*$',
+                                                                  'is_expense_code': r'^6[0-9][0-9][0-9a-zA-Z]*$', 'is_annexe_code': r'X'},
+}
+
+
+def refresh_code_classes(masks, model, fields):
+    codes_by_classes = {}
+    for code in model.objects.order_by('code').values_list('code', flat=True).distinct():
+        code_classes = tuple(sorted([(field_name, re.match(masks.get(field_name, ''), code) is not None) for field_name in fields]))
+        if code_classes not in codes_by_classes.keys():
+            codes_by_classes[code_classes] = []
+        codes_by_classes[code_classes].append(code)
+    for code_classes, codes in codes_by_classes.items():
+        for code_idx in range(0, len(codes), 500):
+            model.objects.filter(code__in=codes[code_idx:code_idx + 500]).update(**dict(code_classes))
+
+
+def fill_code_classes(apps, schema_editor):
+    parameter = apps.get_model("CORE", "Parameter")
+    system_name = ''
+    for value in parameter.objects.filter(name='accounting-system').values_list('value', flat=True):
+        system_name = value
+    masks = SYSTEM_MASKS.get(system_name, {})
+    refresh_code_classes(masks, apps.get_model("accounting", "ChartsAccount"),
+                         ('is_cash_code', 'is_third_code', 'is_customer_code', 'is_revenue_code', 'is_expense_code', 'is_annexe_code'))
+    refresh_code_classes(masks, apps.get_model("accounting", "Budget"), ('is_revenue_code', 'is_expense_code', 'is_annexe_code'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CORE', '0001_initial'),
+        ('accounting', '0011_chartsaccountmonthbalance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='budget',
+            name='is_revenue_code',
+            field=models.BooleanField(db_index=True, default=False, editable=False, verbose_name='revenue code'),
+        ),
+        migrations.AddField(
+            model_name='budget',
+            name='is_expense_code',
+            field=models.BooleanField(db_index=True, default=False, editable=False, verbose_name='expense code'),
+        ),
+        migrations.AddField(
+            model_name='budget',
+            name='is_annexe_code',
+            field=models.BooleanField(db_index=True, default=False, editable=False, verbose_name='annexe code'),
+        ),
+        migrations.AddField(
+            model_name='chartsaccount',
+            name='is_cash_code',
+            field=models.BooleanField(db_index=True, default=False, editable=False, verbose_name='cash code'),
+        ),
+        migrations.AddField(
+            model_name='chartsaccount',
+            name='is_third_code',
+            field=models.BooleanField(db_index=True, default=False, editable=False, verbose_name='third code'),
+        ),
+        migrations.AddField(
+            model_name='chartsaccount',
+            name='is_customer_code',
+            field=models.BooleanField(db_index=True, default=False, editable=False, verbose_name='customer code'),
+        ),
+        migrations.AddField(
+            model_name='chartsaccount',
+            name='is_revenue_code',
+            field=models.BooleanField(db_index=True, default=False, editable=False, verbose_name='revenue code'),
+        ),
+        migrations.AddField(
+            model_name='chartsaccount',
+            name='is_expense_code',
+            field=models.BooleanField(db_index=True, default=False, editable=False, verbose_name='expense code'),
+        ),
+        migrations.AddField(
+            model_name='chartsaccount',
+            name='is_annexe_code',
+            field=models.BooleanField(db_index=True, default=False, editable=False, verbose_name='annexe code'),
+        ),
+        migrations.RunPython(fill_code_classes),
+    ]
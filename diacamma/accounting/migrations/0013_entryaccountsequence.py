@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models.aggregates import Max
+import django.db.models.deletion
+
+
+def fill_sequences(apps, schema_editor):
+    fiscalyear = apps.get_model("accounting", "FiscalYear")
+    entryaccount = apps.get_model("accounting", "EntryAccount")
+    entryaccountsequence = apps.get_model("accounting", "EntryAccountSequence")
+    last_nums = dict([(data_line['year'], data_line['num_max'])
+                      for data_line in entryaccount.objects.filter(num__isnull=False).order_by().values('year').annotate(num_max=Max('num'))])
+    entryaccountsequence.objects.bulk_create([entryaccountsequence(year_id=year_id, last_num=last_nums.get(year_id, 0))
+                                              for year_id in fiscalyear.objects.values_list('id', flat=True)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0012_code_classes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntryAccountSequence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_num', models.IntegerField(default=0, verbose_name='last numeros')),
+                ('year', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='accounting.FiscalYear', verbose_name='fiscal year')),
+            ],
+            options={
+                'verbose_name': 'sequence of entries',
+                'verbose_name_plural': 'sequences of entries',
+                'default_permissions': [],
+            },
+        ),
+        migrations.RunPython(fill_sequences),
+    ]
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Case, When, Value
+
+LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def convert_to_letter(index):
+    res = ''
+    while index >= 26:
+        div, mod = divmod(index, 26)
+        res = LETTERS[mod] + res
+        index = int(div) - 1
+    return LETTERS[index] + res
+
+
+def update_letters(model, letters):
+    items = list(letters.items())
+    for item_idx in range(0, len(items), 250):
+        sub_items = items[item_idx:item_idx + 250]
+        model.objects.filter(id__in=[item_id for item_id, _letter in sub_items]).update(letter=Case(*[When(id=item_id, then=Value(letter)) for item_id, letter in sub_items],
+                                                                                                     output_field=models.CharField()))
+
+
+def fill_letters(apps, schema_editor):
+    fiscalyear_mdl = apps.get_model("accounting", "FiscalYear")
+    update_letters(fiscalyear_mdl, {year_id: convert_to_letter(year_idx) for year_idx, year_id in enumerate(fiscalyear_mdl.objects.order_by('id').values_list('id', flat=True))})
+    letters = {}
+    nb_previous = {}
+    for link_id, year_id in apps.get_model("accounting", "EntryAccount").objects.filter(link__isnull=False).order_by('link_id').values_list('link_id', 'year_id'):
+        if link_id not in letters.keys():
+            letters[link_id] = convert_to_letter(nb_previous.get(year_id, 0))
+        nb_previous[year_id] = nb_previous.get(year_id, 0) + 1
+    update_letters(apps.get_model("accounting", "AccountLink"), letters)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0013_entryaccountsequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fiscalyear',
+            name='letter',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=10, verbose_name='letter'),
+        ),
+        migrations.AddField(
+            model_name='accountlink',
+            name='letter',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=10, verbose_name='letter'),
+        ),
+        migrations.RunPython(fill_letters),
+    ]
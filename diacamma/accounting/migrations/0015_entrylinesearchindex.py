@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+
+from django.db import migrations, models, transaction, DatabaseError
+import django.db.models.deletion
+
+import diacamma.accounting.tools
+
+SEARCH_BACKEND_SQL = {
+    'sqlite': ["CREATE VIRTUAL TABLE %(fts)s USING fts5(content, content='%(table)s', content_rowid='line_id', tokenize='trigram')",
+               "CREATE TRIGGER %(fts)s_ai AFTER INSERT ON %(table)s BEGIN INSERT INTO %(fts)s(rowid, content) VALUES (new.line_id, new.content); END",
+               "CREATE TRIGGER %(fts)s_ad AFTER DELETE ON %(table)s BEGIN INSERT INTO %(fts)s(%(fts)s, rowid, content) VALUES ('delete', old.line_id, old.content); END",
+               "CREATE TRIGGER %(fts)s_au AFTER UPDATE ON %(table)s BEGIN INSERT INTO %(fts)s(%(fts)s, rowid, content) VALUES ('delete', old.line_id, old.content); "
+               "INSERT INTO %(fts)s(rowid, content) VALUES (new.line_id, new.content); END"],
+    # no custom lookup on PostgreSQL: icontains compiles to UPPER("content"::text) LIKE UPPER(%s), the
+    # expression of this index, which the planner can use for patterns of 3 characters or more
+    'postgresql': ["CREATE EXTENSION IF NOT EXISTS pg_trgm",
+                   'CREATE INDEX %(table)s_content_trgm ON %(table)s USING gin (UPPER("content"::text) gin_trgm_ops)'],
+}
+
+
+def add_search_backend(apps, schema_editor):
+    schema_editor.connection.accounting_search_fts = None
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            for sql_text in SEARCH_BACKEND_SQL.get(schema_editor.connection.vendor, []):
+                schema_editor.execute(sql_text % {'fts': 'accounting_entrylinesearch_fts', 'table': 'accounting_entrylinesearchindex'})
+    except DatabaseError as db_error:
+        logging.getLogger('diacamma.accounting').warning("search backend for entry lines not created (%s): searches will use a plain LIKE scan", db_error)
+
+
+def fill_search_index(apps, schema_editor):
+    third_mdl = apps.get_model("accounting", "Third")
+    line_mdl = apps.get_model("accounting", "EntryLineAccount")
+    index_mdl = apps.get_model("accounting", "EntryLineSearchIndex")
+    third_names = {}
+    for third_id, legal_name, lastname, firstname in third_mdl.objects.values_list('id', 'contact__legalentity__name', 'contact__individual__lastname', 'contact__individual__firstname'):
+        if legal_name is not None:
+            third_names[third_id] = legal_name
+        elif lastname is not None:
+            third_names[third_id] = '%s %s' % (lastname, firstname)
+    new_indexes = []
+    for line_id, designation, reference, third_id, amount in line_mdl.objects.order_by('id').values_list('id', 'entry__designation', 'reference', 'third_id', 'amount').iterator():
+        new_indexes.append(index_mdl(line_id=line_id, content="\n".join([designation, reference if reference is not None else '', third_names.get(third_id, '')]), abs_amount=abs(amount)))
+        if len(new_indexes) >= 1000:
+            index_mdl.objects.bulk_create(new_indexes)
+            new_indexes = []
+    index_mdl.objects.bulk_create(new_indexes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0014_letter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntryLineSearchIndex',
+            fields=[
+                ('line', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='searchindex',
+                                              serialize=False, to='accounting.EntryLineAccount', verbose_name='entry line of account')),
+                ('content', diacamma.accounting.tools.SearchTextField(default='', verbose_name='text')),
+                ('abs_amount', models.FloatField(db_index=True, verbose_name='amount')),
+            ],
+            options={
+                'verbose_name': 'search index of entry line',
+                'verbose_name_plural': 'search indexes of entry lines',
+                'default_permissions': [],
+            },
+        ),
+        migrations.RunPython(add_search_backend),
+        migrations.RunPython(fill_search_index),
+    ]
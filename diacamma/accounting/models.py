@@ -23,32 +23,39 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import unicode_literals
 
-from datetime import date, timedelta
+from datetime import date, timedelta, datetime
 from os.path import join, isfile
-from re import match
-from csv import DictReader
+from contextlib import contextmanager
+from itertools import chain
+from io import StringIO
+from xml.sax.saxutils import escape
+import logging
+import threading
+from csv import DictReader, writer
 from _csv import QUOTE_NONE
 
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction, connection, IntegrityError
+from django.db.models import Q, F, Value, Case, When, FloatField, IntegerField, Prefetch
+from django.db.models.functions import Coalesce
 from django.db.models.query import QuerySet
 from django.db.models.aggregates import Sum, Max
-from django.template import engines
 from django.core.exceptions import ObjectDoesNotExist
-from django.utils.translation import ugettext_lazy as _
+from django.core.cache import cache
+from django.utils.translation import ugettext_lazy as _, get_language
 from django.utils import six
-from django.db.models.signals import pre_save
+from django.db.models.signals import pre_save, post_init, post_save, post_delete
 from django_fsm import FSMIntegerField, transition
 
 from lucterios.framework.models import LucteriosModel, get_value_converted, get_value_if_choices
 from lucterios.framework.error import LucteriosException, IMPORTANT, GRAVE
-from lucterios.framework.filetools import read_file, xml_validator, save_file, get_user_path
+from lucterios.framework.filetools import get_user_path
 from lucterios.framework.signal_and_lock import RecordLocker, Signal
 from lucterios.CORE.models import Parameter
 from lucterios.contacts.models import AbstractContact, CustomField,\
-    CustomizeObject
+    CustomizeObject, LegalEntity, Individual
 
-from diacamma.accounting.tools import get_amount_sum, format_devise, current_system_account, currency_round, correct_accounting_code
+from diacamma.accounting.tools import get_amount_sum, format_devise, current_system_account, currency_round, correct_accounting_code,\
+    get_code_classes, FinancialParams, get_next_letter, xml_file_validator, SearchTextField
 
 
 class ThirdCustomField(LucteriosModel):
@@ -109,20 +116,46 @@ class Third(LucteriosModel, CustomizeObject):
         result.extend(["status", "accountthird_set.code"])
         return result
 
-    def get_total(self, current_date=None, strict=True):
-        current_filter = Q(third=self)
-        if current_date is not None:
+    @classmethod
+    def get_total_expression(cls):
+        return Coalesce(Sum(Case(When(chartsaccountbalance__account__type_of_account=0, then=Value(-1) * F('chartsaccountbalance__amount')),
+                                 default=F('chartsaccountbalance__amount'), output_field=FloatField())), Value(0), output_field=FloatField())
+
+    @classmethod
+    def get_totals(cls, thirds, current_date=None, strict=True):
+        if current_date is None:
+            items = ChartsAccountBalance.objects.filter(third__in=thirds)
+        else:
+            items = EntryLineAccount.objects.filter(third__in=thirds)
             if strict:
-                current_filter &= Q(entry__date_value__lte=current_date)
+                items = items.filter(entry__date_value__lte=current_date)
             else:
-                current_filter &= Q(entry__date_value__lt=current_date)
-        active_sum = get_amount_sum(EntryLineAccount.objects.filter(
-            current_filter & Q(account__type_of_account=0)).aggregate(Sum('amount')))
-        passive_sum = get_amount_sum(EntryLineAccount.objects.filter(
-            current_filter & Q(account__type_of_account=1)).aggregate(Sum('amount')))
-        other_sum = get_amount_sum(EntryLineAccount.objects.filter(
-            current_filter & Q(account__type_of_account__gt=1)).aggregate(Sum('amount')))
-        return passive_sum - active_sum + other_sum
+                items = items.filter(entry__date_value__lt=current_date)
+        totals = {}
+        for data_item in items.order_by().values('third', 'account__type_of_account').annotate(data_sum=Sum('amount')):
+            if data_item['account__type_of_account'] == 0:
+                data_item['data_sum'] = -1 * data_item['data_sum']
+            totals[data_item['third']] = totals.get(data_item['third'], 0) + data_item['data_sum']
+        return totals
+
+    @classmethod
+    def get_names(cls, third_ids):
+        third_ids = list(set(third_ids))
+        names = {}
+        for third_idx in range(0, len(third_ids), 500):
+            for third_id, legal_name, lastname, firstname in cls.objects.filter(id__in=third_ids[third_idx:third_idx + 500]).values_list('id', 'contact__legalentity__name', 'contact__individual__lastname', 'contact__individual__firstname'):
+                if legal_name is not None:
+                    names[third_id] = legal_name
+                elif lastname is not None:
+                    names[third_id] = '%s %s' % (lastname, firstname)
+                else:
+                    names[third_id] = six.text_type(cls.objects.get(id=third_id))
+        return names
+
+    def get_total(self, current_date=None, strict=True):
+        if (current_date is None) and hasattr(self, 'balance_total'):
+            return self.balance_total
+        return self.get_totals([self.id], current_date, strict).get(self.id, 0)
 
     @property
     def total(self):
@@ -130,6 +163,8 @@ class Third(LucteriosModel, CustomizeObject):
 
     def merge_objects(self, alias_objects=[]):
         LucteriosModel.merge_objects(self, alias_objects=alias_objects)
+        ChartsAccountBalance.refresh(ChartsAccount.objects.filter(entrylineaccount__third=self).distinct())
+        EntryLineSearchIndex.refresh(EntryLineAccount.objects.filter(third=self))
         last_code = []
         for sub_account in self.accountthird_set.all():
             if sub_account.code in last_code:
@@ -137,6 +172,18 @@ class Third(LucteriosModel, CustomizeObject):
             else:
                 last_code.append(sub_account.code)
 
+    @classmethod
+    def _get_thirds_with_activity(cls, limit_date):
+        return EntryLineAccount.objects.filter(entry__date_value__gt=limit_date, third__isnull=False).values('third')
+
+    @classmethod
+    def get_inactive_thirds(cls, limit_date):
+        return cls.objects.filter(status=0).exclude(id__in=cls._get_thirds_with_activity(limit_date))
+
+    @classmethod
+    def get_reactivated_thirds(cls, limit_date):
+        return cls.objects.filter(status=1, id__in=cls._get_thirds_with_activity(limit_date))
+
     transitionname__disabled = _('Disabled')
 
     @transition(field=status, source=0, target=1)
@@ -204,7 +251,7 @@ class AccountThird(LucteriosModel):
 
     @property
     def total(self):
-        return get_amount_sum(EntryLineAccount.objects.filter(third=self.third, account__code=self.code).aggregate(Sum('amount')))
+        return ChartsAccountBalance.get_total(Q(third=self.third) & Q(account__code=self.code))
 
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
         self.code = correct_accounting_code(self.code)
@@ -225,6 +272,8 @@ class FiscalYear(LucteriosModel):
     is_actif = models.BooleanField(verbose_name=_('actif'), default=False, db_index=True)
     last_fiscalyear = models.ForeignKey('FiscalYear', verbose_name=_(
         'last fiscal year'), related_name='next_fiscalyear', null=True, on_delete=models.SET_NULL)
+    write_version = models.IntegerField(verbose_name=_('write version'), default=0, editable=False)
+    letter = models.CharField(_('letter'), max_length=10, default='', db_index=True, editable=False)
 
     def init_dates(self):
         fiscal_years = FiscalYear.objects.order_by('end')
@@ -268,38 +317,95 @@ class FiscalYear(LucteriosModel):
     def get_edit_fields(cls):
         return ['status', 'begin', 'end']
 
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        is_new = self.id is None
+        if not is_new:
+            self.write_version = self.get_write_version()
+        elif self.letter == '':
+            self.letter = get_next_letter(FiscalYear.objects.all(), FiscalYear.objects.count())
+        res = LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        if is_new:
+            EntryAccountSequence.objects.create(year_id=self.id)
+        return res
+
+    @classmethod
+    def increase_write_version(cls, query):
+        cls.objects.filter(query).update(write_version=F('write_version') + 1)
+
+    @classmethod
+    def increase_write_version_on_commit(cls, year_ids):
+        year_ids = set(year_ids)
+        if not connection.in_atomic_block:
+            cls.increase_write_version(Q(id__in=year_ids))
+            return
+        pending = getattr(connection, 'accounting_write_versions', None)
+        if pending is None:
+            pending = set()
+            connection.accounting_write_versions = pending
+        pending.update(year_ids)
+        transaction.on_commit(cls.flush_write_versions)
+
+    @classmethod
+    def flush_write_versions(cls, year_ids=None):
+        pending = getattr(connection, 'accounting_write_versions', None)
+        if not pending:
+            return
+        flushed = set(pending) if year_ids is None else (pending & set(year_ids))
+        if len(flushed) > 0:
+            pending.difference_update(flushed)
+            cls.increase_write_version(Q(id__in=list(flushed)))
+
+    @classmethod
+    def get_write_versions(cls):
+        cls.flush_write_versions()
+        return list(cls.objects.order_by('id').values_list('id', 'write_version'))
+
+    def get_write_version(self):
+        FiscalYear.flush_write_versions([self.id])
+        for write_version in FiscalYear.objects.filter(id=self.id).values_list('write_version', flat=True):
+            return write_version
+        return 0
+
+    def get_summary(self):
+        cache_key = 'diacamma.accounting.summary_%s_%d_%s_%s' % (self.id, self.get_write_version(), self.begin, self.end)
+        summary = cache.get(cache_key)
+        if summary is None:
+            summary = EntryLineAccount.objects.filter(account__year=self, entry__date_value__gte=self.begin, entry__date_value__lte=self.end).aggregate(
+                revenue=Sum(Case(When(account__type_of_account=3, then=F('amount')), default=Value(0), output_field=FloatField())),
+                expense=Sum(Case(When(account__type_of_account=4, then=F('amount')), default=Value(0), output_field=FloatField())),
+                cash=Sum(Case(When(account__is_cash_code=True, then=F('amount')), default=Value(0), output_field=FloatField())),
+                closed=Sum(Case(When(Q(account__is_cash_code=True) & Q(entry__close=True), then=F('amount')), default=Value(0), output_field=FloatField())))
+            for key in summary.keys():
+                if summary[key] is None:
+                    summary[key] = 0
+            cache.set(cache_key, summary)
+        return summary
+
     @property
     def total_revenue(self):
-        return get_amount_sum(EntryLineAccount.objects.filter(account__type_of_account=3, account__year=self,
-                                                              entry__date_value__gte=self.begin, entry__date_value__lte=self.end).aggregate(Sum('amount')))
+        return self.get_summary()['revenue']
 
     @property
     def total_expense(self):
-
-        return get_amount_sum(EntryLineAccount.objects.filter(account__type_of_account=4, account__year=self,
-                                                              entry__date_value__gte=self.begin, entry__date_value__lte=self.end).aggregate(Sum('amount')))
+        return self.get_summary()['expense']
 
     @property
     def total_cash(self):
-
-        return get_amount_sum(EntryLineAccount.objects.filter(account__code__regex=current_system_account().get_cash_mask(),
-                                                              account__year=self, entry__date_value__gte=self.begin, entry__date_value__lte=self.end).aggregate(Sum('amount')))
+        return self.get_summary()['cash']
 
     @property
     def total_cash_close(self):
-
-        return get_amount_sum(EntryLineAccount.objects.filter(entry__close=True, account__code__regex=current_system_account().get_cash_mask(),
-                                                              account__year=self, entry__date_value__gte=self.begin, entry__date_value__lte=self.end).aggregate(Sum('amount')))
+        return self.get_summary()['closed']
 
     @property
     def total_result_text(self):
+        summary = self.get_summary()
         value = {}
-        value['revenue'] = format_devise(self.total_revenue, 5)
-        value['expense'] = format_devise(self.total_expense, 5)
-        value['result'] = format_devise(
-            self.total_revenue - self.total_expense, 5)
-        value['cash'] = format_devise(self.total_cash, 5)
-        value['closed'] = format_devise(self.total_cash_close, 5)
+        value['revenue'] = format_devise(summary['revenue'], 5)
+        value['expense'] = format_devise(summary['expense'], 5)
+        value['result'] = format_devise(summary['revenue'] - summary['expense'], 5)
+        value['cash'] = format_devise(summary['cash'], 5)
+        value['closed'] = format_devise(summary['closed'], 5)
         res_text = _(
             '{[b]}Revenue:{[/b]} %(revenue)s - {[b]}Expense:{[/b]} %(expense)s = {[b]}Result:{[/b]} %(result)s | {[b]}Cash:{[/b]} %(cash)s - {[b]}Closed:{[/b]} %(closed)s')
         return res_text % value
@@ -316,13 +422,7 @@ class FiscalYear(LucteriosModel):
                 IMPORTANT, _("This fiscal year has not a last fiscal year!"))
         if self.status == 2:
             raise LucteriosException(IMPORTANT, _('Fiscal year finished!'))
-        for last_charts_account in self.last_fiscalyear.chartsaccount_set.all():
-            try:
-                self.chartsaccount_set.get(
-                    code=correct_accounting_code(last_charts_account.code))
-            except ObjectDoesNotExist:
-                ChartsAccount.objects.create(year=self, code=last_charts_account.code, name=last_charts_account.name,
-                                             type_of_account=last_charts_account.type_of_account)
+        self.getorcreate_chartaccounts(list(self.last_fiscalyear.chartsaccount_set.values_list('code', 'name', 'type_of_account')))
 
     def run_report_lastyear(self, import_result):
         if self.last_fiscalyear is None:
@@ -342,24 +442,49 @@ class FiscalYear(LucteriosModel):
                 name = descript
             return ChartsAccount.objects.create(year=self, code=code, name=name, type_of_account=typeaccount)
 
+    def getorcreate_chartaccounts(self, accounts):
+        account_ids = dict(self.chartsaccount_set.values_list('code', 'id'))
+        new_accounts = {}
+        for account in accounts:
+            code, name = account[:2]
+            new_code = correct_accounting_code(code)
+            if (new_code not in account_ids.keys()) and (new_code not in new_accounts.keys()):
+                descript, typeaccount = current_system_account().new_charts_account(new_code)
+                if len(account) > 2:
+                    typeaccount = account[2]
+                new_account = ChartsAccount(year=self, code=new_code, name=name if name is not None else descript, type_of_account=typeaccount)
+                for field_name, field_value in get_code_classes(new_code, ChartsAccount.code_class_fields).items():
+                    setattr(new_account, field_name, field_value)
+                new_accounts[new_code] = new_account
+        if len(new_accounts) > 0:
+            ChartsAccount.objects.bulk_create(list(new_accounts.values()))
+            account_ids = dict(self.chartsaccount_set.values_list('code', 'id'))
+            FiscalYear.increase_write_version(Q(id=self.id))
+        return dict([(account[0], account_ids[correct_accounting_code(account[0])]) for account in accounts])
+
     def move_entry_noclose(self):
         if self.status == 1:
-            next_ficalyear = None
-            for entry_noclose in EntryAccount.objects.filter(close=False, entrylineaccount__account__year=self).distinct():
-                if next_ficalyear is None:
-                    try:
-                        next_ficalyear = FiscalYear.objects.get(
-                            last_fiscalyear=self)
-                    except:
-                        raise LucteriosException(IMPORTANT, _(
-                            "This fiscal year has entries not closed and not next fiscal year!"))
-                for entryline in entry_noclose.entrylineaccount_set.all():
-                    entryline.account = next_ficalyear.getorcreate_chartaccount(
-                        entryline.account.code, entryline.account.name)
-                    entryline.save()
-                entry_noclose.year = next_ficalyear
-                entry_noclose.date_value = next_ficalyear.begin
-                entry_noclose.save()
+            entries = EntryAccount.objects.filter(close=False, year=self)
+            if not entries.exists():
+                return
+            try:
+                next_ficalyear = FiscalYear.objects.get(last_fiscalyear=self)
+            except ObjectDoesNotExist:
+                raise LucteriosException(IMPORTANT, _("This fiscal year has entries not closed and not next fiscal year!"))
+            lines = EntryLineAccount.objects.filter(entry__close=False, entry__year=self)
+            new_account_ids = next_ficalyear.getorcreate_chartaccounts(list(lines.order_by().values_list('account__code', 'account__name').distinct()))
+            account_map = dict([(account_id, new_account_ids[code]) for account_id, code in self.chartsaccount_set.values_list('id', 'code') if code in new_account_ids.keys()])
+            moves = ChartsAccountBalance.get_entries_moves(entries)
+            account_items = list(account_map.items())
+            for account_idx in range(0, len(account_items), 250):
+                sub_items = account_items[account_idx:account_idx + 250]
+                lines.filter(account_id__in=[account_id for account_id, _new_account_id in sub_items]).update(account_id=Case(*[When(account_id=account_id, then=Value(new_account_id))
+                                                                                                                               for account_id, new_account_id in sub_items], output_field=IntegerField()))
+            entries.update(year=next_ficalyear, date_value=next_ficalyear.begin)
+            for (account_id, third_id, flags), amount in moves.items():
+                ChartsAccountBalance.add_line_amount(account_id, third_id, flags, -1 * amount)
+                ChartsAccountBalance.add_line_amount(account_map[account_id], third_id, (flags[0], flags[1], next_ficalyear.begin.replace(day=1)), amount)
+            FiscalYear.increase_write_version(Q(id__in=[self.id, next_ficalyear.id]))
 
     @classmethod
     def get_current(cls, select_year=None):
@@ -390,28 +515,29 @@ class FiscalYear(LucteriosModel):
 
         return account_list, current_account
 
-    def get_context(self):
-        entries_by_journal = []
-        for journal in Journal.objects.all():
-            entries = self.entryaccount_set.filter(
-                journal=journal, close=True)
-            if len(entries) > 0:
-                entries_by_journal.append((journal, entries))
-        return {'year': self, 'entries_by_journal': entries_by_journal}
-
-    def get_xml_export(self):
+    def get_xml_export(self, progress=None):
         file_name = "fiscalyear_export_%s.xml" % six.text_type(self.id)
-        xmlfiles = current_system_account().get_export_xmlfiles()
-        if xmlfiles is None:
+        xsd_file = current_system_account().get_export_xsdfile()
+        if xsd_file is None:
             raise LucteriosException(
                 IMPORTANT, _('No export for this accounting system!'))
-        xml_file, xsd_file = xmlfiles
-        template = engines['django'].from_string(read_file(xml_file))
-        fiscal_year_xml = six.text_type(template.render(self.get_context()))
-        res_val = xml_validator(fiscal_year_xml, xsd_file)
+        xml_path = get_user_path("accounting", file_name)
+        EntryXmlExport(self, progress).write(xml_path)
+        res_val = xml_file_validator(xml_path, xsd_file)
         if res_val is not None:
             raise LucteriosException(GRAVE, res_val)
-        save_file(get_user_path("accounting", file_name), fiscal_year_xml)
+        return join("accounting", file_name)
+
+    def import_entries(self, csvfile, format_name='fec'):
+        if self.status == 2:
+            raise LucteriosException(IMPORTANT, _("Fiscal year finished!"))
+        return EntryExchange(self, format_name).import_entries(csvfile)
+
+    def get_entries_export(self, format_name='fec'):
+        file_name = "fiscalyear_entries_%s.%s" % (six.text_type(self.id), 'txt' if format_name == 'fec' else 'csv')
+        with open(get_user_path("accounting", file_name), 'w', encoding='utf-8') as export_file:
+            for export_line in EntryExchange(self, format_name).export_entries():
+                export_file.write(export_line)
         return join("accounting", file_name)
 
     def get_identify(self):
@@ -425,21 +551,8 @@ class FiscalYear(LucteriosModel):
             'status'))
         return _("Fiscal year from %(begin)s to %(end)s [%(status)s]") % {'begin': get_value_converted(self.begin), 'end': get_value_converted(self.end), 'status': status}
 
-    @property
-    def letter(self):
-        nb_year = FiscalYear.objects.filter(id__lt=self.id).count()
-        letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
-        res = ''
-        while nb_year >= 26:
-            div, mod = divmod(nb_year, 26)
-            res = letters[mod] + res
-            nb_year = int(div) - 1
-        return letters[nb_year] + res
-
     def _check_annexe(self):
-        total = 0
-        for chart in self.chartsaccount_set.filter(type_of_account=5):
-            total += chart.get_current_total()
+        total = ChartsAccountBalance.get_total(Q(account__year=self) & Q(account__type_of_account=5))
         if abs(total) > 0.0001:
             raise LucteriosException(IMPORTANT, _("The sum of annexe account must be null!"))
 
@@ -453,14 +566,24 @@ class FiscalYear(LucteriosModel):
             raise LucteriosException(IMPORTANT, _("This fiscal year has entries not closed and not next fiscal year!"))
         return nb_entry_noclose
 
-    def closed(self):
-        for cost in CostAccounting.objects.filter(year=self):
-            cost.close()
-        self._check_annexe()
-        self.move_entry_noclose()
-        current_system_account().finalize_year(self)
-        self.status = 2
-        self.save()
+    def set_closing_progress(self, step, text, progress=None):
+        if progress is not None:
+            progress(step, 3, six.text_type(text))
+
+    def closed(self, progress=None):
+        with transaction.atomic():
+            if FiscalYear.objects.select_for_update().get(id=self.id).status == 2:
+                raise LucteriosException(IMPORTANT, _("Fiscal year finished!"))
+            self.set_closing_progress(1, _('close of costs accounting'), progress)
+            for cost in CostAccounting.objects.filter(year=self):
+                cost.close()
+            self._check_annexe()
+            self.set_closing_progress(2, _('move of entries not validated'), progress)
+            self.move_entry_noclose()
+            self.set_closing_progress(3, _('creation of closing entries'), progress)
+            current_system_account().finalize_year(self)
+            self.status = 2
+            self.save()
 
     class Meta(object):
         verbose_name = _('fiscal year')
@@ -570,6 +693,14 @@ class ChartsAccount(LucteriosModel):
                                           choices=((0, _('Asset')), (1, _('Liability')), (2, _('Equity')), (3, _(
                                               'Revenue')), (4, _('Expense')), (5, _('Contra-accounts'))),
                                           null=True, db_index=True)
+    is_cash_code = models.BooleanField(verbose_name=_('cash code'), default=False, db_index=True, editable=False)
+    is_third_code = models.BooleanField(verbose_name=_('third code'), default=False, db_index=True, editable=False)
+    is_customer_code = models.BooleanField(verbose_name=_('customer code'), default=False, db_index=True, editable=False)
+    is_revenue_code = models.BooleanField(verbose_name=_('revenue code'), default=False, db_index=True, editable=False)
+    is_expense_code = models.BooleanField(verbose_name=_('expense code'), default=False, db_index=True, editable=False)
+    is_annexe_code = models.BooleanField(verbose_name=_('annexe code'), default=False, db_index=True, editable=False)
+
+    code_class_fields = ('is_cash_code', 'is_third_code', 'is_customer_code', 'is_revenue_code', 'is_expense_code', 'is_annexe_code')
 
     @classmethod
     def get_default_fields(cls):
@@ -595,14 +726,21 @@ class ChartsAccount(LucteriosModel):
     def get_name(self):
         return "[%s] %s" % (correct_accounting_code(self.code), self.name)
 
+    def _get_balance(self, is_lastyear=None, is_close=None):
+        value = 0
+        for balance in self.chartsaccountbalance_set.all():
+            if ((is_lastyear is None) or (balance.is_lastyear == is_lastyear)) and ((is_close is None) or (balance.is_close == is_close)):
+                value += balance.amount
+        return value
+
     def get_last_year_total(self):
-        return get_amount_sum(self.entrylineaccount_set.filter(entry__journal__id=1).aggregate(Sum('amount')))
+        return self._get_balance(is_lastyear=True)
 
     def get_current_total(self):
-        return get_amount_sum(self.entrylineaccount_set.all().aggregate(Sum('amount')))
+        return self._get_balance()
 
     def get_current_validated(self):
-        return get_amount_sum(self.entrylineaccount_set.filter(entry__close=True).aggregate(Sum('amount')))
+        return self._get_balance(is_close=True)
 
     def credit_debit_way(self):
         if self.type_of_account in [0, 4]:
@@ -624,11 +762,13 @@ class ChartsAccount(LucteriosModel):
 
     @property
     def is_third(self):
-        return match(current_system_account().get_third_mask(), self.code) is not None
+        system_account = current_system_account()
+        return system_account.match_mask(system_account.get_third_mask(), self.code)
 
     @property
     def is_cash(self):
-        return match(current_system_account().get_cash_mask(), self.code) is not None
+        system_account = current_system_account()
+        return system_account.match_mask(system_account.get_cash_mask(), self.code)
 
     @classmethod
     def get_account(cls, code, year):
@@ -649,6 +789,23 @@ class ChartsAccount(LucteriosModel):
             chart = ChartsAccount(year=current_year, code=code, name=descript, type_of_account=typeaccount)
         return chart
 
+    @classmethod
+    def get_chart_accounts(cls, codes):
+        current_year = FiscalYear.get_current()
+        codes = {code: correct_accounting_code(code) for code in codes}
+        charts = {}
+        code_list = list(set(codes.values()))
+        for code_idx in range(0, len(code_list), 500):
+            for chart in current_year.chartsaccount_set.filter(code__in=code_list[code_idx:code_idx + 500]):
+                charts[chart.code] = chart
+        res = {}
+        for code, chart_code in codes.items():
+            if chart_code not in charts.keys():
+                descript, typeaccount = current_system_account().new_charts_account(chart_code)
+                charts[chart_code] = ChartsAccount(year=current_year, code=chart_code, name=descript, type_of_account=typeaccount)
+            res[code] = charts[chart_code]
+        return res
+
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
         try:
             self.code = correct_accounting_code(self.code)
@@ -659,10 +816,19 @@ class ChartsAccount(LucteriosModel):
                     IMPORTANT, _('Account already exists for this fiscal year!'))
         except ObjectDoesNotExist:
             pass
-        return LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        for field_name, field_value in get_code_classes(self.code, self.code_class_fields).items():
+            setattr(self, field_name, field_value)
+        res = LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+        FiscalYear.increase_write_version(Q(id=self.year_id))
+        return res
+
+    def merge_objects(self, alias_objects=[]):
+        LucteriosModel.merge_objects(self, alias_objects=alias_objects)
+        ChartsAccountBalance.refresh([self.id])
 
     @classmethod
     def import_initial(cls, year, account_list):
+        accounts = []
         for account_item in account_list:
             if isfile(account_item):
                 with open(account_item, 'r', encoding='UTF-8') as fcsv:
@@ -670,10 +836,9 @@ class ChartsAccount(LucteriosModel):
                         fcsv, delimiter=';', quotechar='', quoting=QUOTE_NONE)
                     for row in csv_read:
                         new_code = correct_accounting_code(row['code'])
-                        if cls.get_account(new_code, year) is None:
-                            account_desc = current_system_account().new_charts_account(new_code)
-                            if account_desc[1] >= 0:
-                                ChartsAccount.objects.create(year=year, code=new_code, name=row['name'], type_of_account=account_desc[1])
+                        if current_system_account().new_charts_account(new_code)[1] >= 0:
+                            accounts.append((new_code, row['name']))
+        year.getorcreate_chartaccounts(accounts)
 
     class Meta(object):
         verbose_name = _('charts of account')
@@ -709,37 +874,34 @@ class Journal(LucteriosModel):
 class AccountLink(LucteriosModel):
     is_simple_gui = True
 
+    letter = models.CharField(_('letter'), max_length=10, default='', db_index=True, editable=False)
+
     def __str__(self):
         return self.letter
 
-    @property
-    def letter(self):
-        year = self.entryaccount_set.all()[0].year
-        nb_link = AccountLink.objects.filter(entryaccount__year=year, id__lt=self.id).count()
-        letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
-        res = ''
-        while nb_link >= 26:
-            div, mod = divmod(nb_link, 26)
-            res = letters[mod] + res
-            nb_link = int(div) - 1
-        return letters[nb_link] + res
+    @classmethod
+    def get_new_letter(cls, year_id):
+        return get_next_letter(cls.objects.filter(entryaccount__year_id=year_id), EntryAccount.objects.filter(year_id=year_id, link__isnull=False).count())
 
     @classmethod
     def create_link(cls, entries):
-        year = None
-        for entry in entries:
-            entry = EntryAccount.objects.get(id=entry.id)
-            if entry.year.status == 2:
-                raise LucteriosException(IMPORTANT, _("Fiscal year finished!"))
-            if year is None:
-                year = entry.year
-            elif year != entry.year:
-                raise LucteriosException(IMPORTANT, _("This entries are not in same fiscal year!"))
-            entry.unlink()
-        new_link = AccountLink.objects.create()
-        for entry in entries:
-            entry.link = new_link
-            entry.save()
+        entry_items = entries
+        entries = EntryAccount.get_entries_query(entries)
+        year_status = list(entries.order_by().values_list('year_id', 'year__status').distinct())
+        if 2 in [status for _year_id, status in year_status]:
+            raise LucteriosException(IMPORTANT, _("Fiscal year finished!"))
+        if len(year_status) > 1:
+            raise LucteriosException(IMPORTANT, _("This entries are not in same fiscal year!"))
+        if len(year_status) == 0:
+            return
+        with transaction.atomic():
+            EntryAccount.unlink_entries(entries)
+            new_link = AccountLink.objects.create(letter=cls.get_new_letter(year_status[0][0]))
+            entries.update(link=new_link)
+        if not isinstance(entry_items, QuerySet):
+            for entry in entry_items:
+                entry.link = new_link
+        FiscalYear.increase_write_version(Q(id__in=[year_id for year_id, _status in year_status]))
 
     class Meta(object):
 
@@ -781,8 +943,9 @@ class EntryAccount(LucteriosModel):
 
     @classmethod
     def get_search_fields(cls):
-        result = ['year', 'date_value', 'num', 'designation', 'date_entry', 'costaccounting']
-        result.append(('entrylineaccount_set.amount', models.DecimalField(_('amount')), 'entrylineaccount__amount__abs', Q()))
+        result = ['year', 'date_value', 'num', 'designation', 'date_entry', 'costaccounting', 'link.letter']
+        result.append(('entrylineaccount_set.amount', models.DecimalField(_('amount')), 'entrylineaccount__searchindex__abs_amount', Q()))
+        result.append(('entrylineaccount_set.searchindex', models.CharField(_('text')), 'entrylineaccount__searchindex__content', Q()))
         result.extend(['entrylineaccount_set.account.code', 'entrylineaccount_set.account.name',
                        'entrylineaccount_set.account.type_of_account', 'entrylineaccount_set.reference'])
         for fieldname in Third.get_search_fields():
@@ -792,12 +955,105 @@ class EntryAccount(LucteriosModel):
     @classmethod
     def clear_ghost(cls):
         if not RecordLocker.has_item_lock(cls):
-            for entry in cls.objects.filter(close=False):
-                if len(entry.entrylineaccount_set.all()) == 0:
-                    entry.delete()
+            ghost_entries = cls.objects.filter(close=False, entrylineaccount__isnull=True)
+            cls.unlink_entries(ghost_entries)
+            ghost_entries.delete()
+            AccountLink.objects.filter(entryaccount__isnull=True).delete()
+
+    @classmethod
+    def get_entries_query(cls, entries):
+        if isinstance(entries, QuerySet):
+            return entries
+        return cls.objects.filter(id__in=[entry.id for entry in entries])
+
+    @classmethod
+    def check_entries_balance(cls, entries):
+        balance_amount = Case(When(account__type_of_account__in=(0, 4), then=F('amount') * -1), default=F('amount'), output_field=FloatField())
+        for data_line in EntryLineAccount.objects.filter(entry__in=entries).order_by().values('entry').annotate(data_sum=Sum(balance_amount)):
+            if abs(data_line['data_sum']) > 0.0001:
+                raise LucteriosException(GRAVE, "Account entry not balanced: sum credit=%.3f / sum debit=%.3f" % (max(0, data_line['data_sum']), max(0, -1 * data_line['data_sum'])))
+
+    @classmethod
+    def close_entries(cls, entries, check_balance=True):
+        entries = cls.get_entries_query(entries).filter(close=False).exclude(year__status=2)
+        entries_by_year = {}
+        with transaction.atomic():
+            entries = cls.objects.filter(id__in=entries.values('id'), close=False)
+            entry_rows = list(entries.select_for_update().order_by('date_value', 'id').values_list('id', 'year_id'))
+            list(EntryLineAccount.objects.select_for_update().filter(entry__in=entries).values_list('id', flat=True))
+            if check_balance:
+                cls.check_entries_balance(entries)
+            for entry_id, year_id in entry_rows:
+                if year_id not in entries_by_year.keys():
+                    entries_by_year[year_id] = []
+                entries_by_year[year_id].append(entry_id)
+            moves = ChartsAccountBalance.get_entries_moves(entries)
+            for year_id, entry_ids in entries_by_year.items():
+                first_num = EntryAccountSequence.allocate(year_id, len(entry_ids))
+                for entry_idx in range(0, len(entry_ids), 250):
+                    chunk_ids = entry_ids[entry_idx:entry_idx + 250]
+                    new_nums = [When(id=entry_id, then=Value(first_num + entry_idx + chunk_idx)) for chunk_idx, entry_id in enumerate(chunk_ids)]
+                    cls.objects.filter(id__in=chunk_ids).update(close=True, date_entry=date.today(), num=Case(*new_nums, output_field=IntegerField()))
+            for (account_id, third_id, flags), amount in moves.items():
+                ChartsAccountBalance.add_line_amount(account_id, third_id, flags, -1 * amount)
+                ChartsAccountBalance.add_line_amount(account_id, third_id, (flags[0], True, flags[2]), amount)
+        FiscalYear.increase_write_version(Q(id__in=list(entries_by_year.keys())))
+        return sum([len(entry_ids) for entry_ids in entries_by_year.values()])
+
+    @classmethod
+    def unlink_entries(cls, entries):
+        link_ids = list(entries.exclude(year__status=2).filter(link__isnull=False).order_by().values_list('link_id', flat=True).distinct())
+        if len(link_ids) > 0:
+            linked_entries = cls.objects.filter(link_id__in=link_ids)
+            ghost_entries = [entry for entry in linked_entries.filter(entrylineaccount__isnull=True) if not RecordLocker.is_lock(entry)]
+            linked_entries.update(link=None)
+            for entry in ghost_entries:
+                LucteriosModel.delete(entry)
+            AccountLink.objects.filter(id__in=link_ids).delete()
+
+    @classmethod
+    def delete_entries(cls, entries):
+        entries = cls.get_entries_query(entries)
+        if entries.filter(close=True).exists():
+            raise LucteriosException(IMPORTANT, _('entry of account closed!'))
+        year_ids = list(entries.order_by().values_list('year_id', flat=True).distinct())
+        with transaction.atomic():
+            cls.unlink_entries(entries)
+            moves = ChartsAccountBalance.get_entries_moves(entries)
+            with suspend_balance_signals():
+                entries.delete()
+            for (account_id, third_id, flags), amount in moves.items():
+                ChartsAccountBalance.add_line_amount(account_id, third_id, flags, -1 * amount)
+        FiscalYear.increase_write_version(Q(id__in=year_ids))
+
+    @classmethod
+    def set_costaccounting(cls, entries, costaccounting):
+        entries = cls.get_entries_query(entries).filter(Q(costaccounting__isnull=True) | Q(costaccounting__status=0))
+        year_ids = list(entries.order_by().values_list('year_id', flat=True).distinct())
+        if (costaccounting is not None) and (costaccounting.year_id is not None):
+            entries.exclude(year_id=costaccounting.year_id).update(costaccounting=None)
+            entries = entries.filter(year_id=costaccounting.year_id)
+        entries.update(costaccounting=costaccounting)
+        FiscalYear.increase_write_version(Q(id__in=year_ids))
+
+    @classmethod
+    def prefetch_description(cls, items):
+        lines = EntryLineAccount.objects.select_related('account', 'third', 'third__contact', 'third__contact__individual', 'third__contact__legalentity')
+        return items.select_related('year', 'link', 'costaccounting').prefetch_related(Prefetch('entrylineaccount_set', queryset=lines))
 
     @property
     def description(self):
+        if not self.close or (self.id is None):
+            return self.get_description()
+        cache_key = 'diacamma.accounting.entry_description_%d_%s_%s_%s' % (self.id, get_language(), FinancialParams.getvalue("accounting-devise"),
+                                                                            FinancialParams.getvalue("accounting-devise-prec"))
+        res = cache.get(cache_key)
+        if res is None:
+            res = self.get_description()
+            cache.set(cache_key, res, 3600)
+        return res
+
+    def get_description(self):
         res = self.designation
         res += "{[br/]}"
         res += "{[table]}"
@@ -837,7 +1093,7 @@ class EntryAccount(LucteriosModel):
 
     def get_serial(self, entrylines=None):
         if entrylines is None:
-            entrylines = self.entrylineaccount_set.all()
+            return EntryLineDraft.serialize(self.entrylineaccount_set.all().values_list('id', 'account_id', 'third_id', 'amount', 'reference'))
         serial_val = ''
         for line in entrylines:
             if serial_val != '':
@@ -846,68 +1102,33 @@ class EntryAccount(LucteriosModel):
         return serial_val
 
     def get_entrylineaccounts(self, serial_vals):
-        res = QuerySet(model=EntryLineAccount)
-        res._result_cache = []
-        for serial_val in serial_vals.split('\n'):
-            if serial_val != '':
-                new_line = EntryLineAccount.get_entrylineaccount(serial_val)
-                new_line.entry = self
-                res._result_cache.append(
-                    new_line)
-        return res
+        return EntryLineDraft(self, serial_vals).get_entrylineaccounts()
 
     def save_entrylineaccounts(self, serial_vals):
         if not self.close:
-            self.entrylineaccount_set.all().delete(
-            )
-            for line in self.get_entrylineaccounts(serial_vals):
-                if line.id < 0:
-                    line.id = None
-                line.save()
+            EntryLineDraft(self, serial_vals).commit()
 
     def remove_entrylineaccounts(self, serial_vals, entrylineid):
-        lines = self.get_entrylineaccounts(serial_vals)
-        line_idx = -1
-        for idx in range(len(lines)):
-            if lines[idx].id == entrylineid:
-                line_idx = idx
-        del lines._result_cache[line_idx]
-        return self.get_serial(lines)
+        draft = EntryLineDraft(self, serial_vals)
+        draft.remove_line(entrylineid)
+        return draft.get_serial()
 
     def add_new_entryline(self, serial_entry, entrylineaccount, num_cpt, credit_val, debit_val, third, reference):
         if self.journal.id == 1:
             charts = ChartsAccount.objects.get(
                 id=num_cpt)
-            if match(current_system_account().get_revenue_mask(), charts.code) or \
-                    match(current_system_account().get_expence_mask(), charts.code):
+            if charts.is_revenue_code or charts.is_expense_code:
                 raise LucteriosException(
                     IMPORTANT, _('This kind of entry is not allowed for this journal!'))
+        draft = EntryLineDraft(self, serial_entry)
         if entrylineaccount != 0:
-            serial_entry = self.remove_entrylineaccounts(
-                serial_entry, entrylineaccount)
-        if serial_entry != '':
-            serial_entry += '\n'
-        serial_entry += EntryLineAccount.add_serial(
-            num_cpt, debit_val, credit_val, third, reference)
-        return serial_entry
+            draft.remove_line(entrylineaccount)
+        draft.add_new_line(num_cpt, debit_val, credit_val, third, reference)
+        return draft.get_serial()
 
     def serial_control(self, serial_vals):
-        total_credit = 0
-        total_debit = 0
-        serial = self.get_entrylineaccounts(serial_vals)
-        current = self.entrylineaccount_set.all()
-        no_change = len(serial) > 0
-        if len(serial) == len(current):
-            for idx in range(len(serial)):
-                total_credit += serial[idx].get_credit()
-                total_debit += serial[idx].get_debit()
-                no_change = no_change and current[idx].equals(serial[idx])
-        else:
-            no_change = False
-            for idx in range(len(serial)):
-                total_credit += serial[idx].get_credit()
-                total_debit += serial[idx].get_debit()
-        return no_change, max(0, total_credit - total_debit), max(0, total_debit - total_credit)
+        draft = EntryLineDraft(self, serial_vals)
+        return draft.is_unchanged(), draft.debit_rest, draft.credit_rest
 
     def closed(self, check_balance=True):
         if (self.year.status != 2) and not self.close:
@@ -915,15 +1136,11 @@ class EntryAccount(LucteriosModel):
                 _no_change, debit_rest, credit_rest = self.serial_control(self.get_serial())
                 if abs(debit_rest - credit_rest) > 0.0001:
                     raise LucteriosException(GRAVE, "Account entry not balanced: sum credit=%.3f / sum debit=%.3f" % (debit_rest, credit_rest))
-            self.close = True
-            val = self.year.entryaccount_set.all().aggregate(
-                Max('num'))
-            if val['num__max'] is None:
-                self.num = 1
-            else:
-                self.num = val['num__max'] + 1
-            self.date_entry = date.today()
-            self.save()
+            with transaction.atomic():
+                self.close = True
+                self.num = EntryAccountSequence.allocate(self.year_id, 1)
+                self.date_entry = date.today()
+                self.save()
 
     def unlink(self):
         if (self.year.status != 2) and (self.link_id is not None):
@@ -935,7 +1152,7 @@ class EntryAccount(LucteriosModel):
             self.link = None
 
     def delete_if_ghost_entry(self):
-        if (self.id is not None) and (len(self.entrylineaccount_set.all()) == 0) and not RecordLocker.is_lock(self):
+        if (self.id is not None) and not self.entrylineaccount_set.exists() and not RecordLocker.is_lock(self):
             self.delete()
             return True
         else:
@@ -956,6 +1173,18 @@ class EntryAccount(LucteriosModel):
             AccountLink.create_link([self, new_entry])
             return new_entry, serial_val
 
+    def add_entry_lines(self, lines):
+        EntryLineAccount.objects.bulk_create(lines)
+        flags = get_entry_balance_flags(self.id)
+        moves = {}
+        for new_line in lines:
+            key = (new_line.account_id, new_line.third_id)
+            moves[key] = moves.get(key, 0) + new_line.amount
+        for (account_id, third_id), amount in moves.items():
+            ChartsAccountBalance.add_line_amount(account_id, third_id, flags, amount)
+        EntryLineSearchIndex.refresh(EntryLineAccount.objects.filter(entry_id=self.id))
+        FiscalYear.increase_write_version_on_commit([self.year_id])
+
     def add_entry_line(self, amount, code, name=None, third=None):
         if abs(amount) > 0.0001:
             new_entry_line = EntryLineAccount()
@@ -968,15 +1197,15 @@ class EntryAccount(LucteriosModel):
 
     @property
     def has_third(self):
-        return self.entrylineaccount_set.filter(account__code__regex=current_system_account().get_third_mask()).count() > 0
+        return self.entrylineaccount_set.filter(account__is_third_code=True).exists()
 
     @property
     def has_customer(self):
-        return self.entrylineaccount_set.filter(account__code__regex=current_system_account().get_customer_mask()).count() > 0
+        return self.entrylineaccount_set.filter(account__is_customer_code=True).exists()
 
     @property
     def has_cash(self):
-        return self.entrylineaccount_set.filter(account__code__regex=current_system_account().get_cash_mask()).count() > 0
+        return self.entrylineaccount_set.filter(account__is_cash_code=True).exists()
 
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
         if (self.costaccounting is not None) and (self.costaccounting.year_id is not None) and (self.costaccounting.year_id != self.year_id):
@@ -989,6 +1218,460 @@ class EntryAccount(LucteriosModel):
         ordering = ['date_value']
 
 
+class EntryLineDraft(object):
+
+    def __init__(self, entry, serial_vals=''):
+        self.entry = entry
+        self.lines = []
+        self.accounts = {}
+        self.thirds = {}
+        self.balance = 0.0
+        for serial_val in serial_vals.split('\n'):
+            if serial_val != '':
+                serial_items = serial_val.split('|')
+                reference = "".join(serial_items[4:-1])
+                if reference.startswith("None"):
+                    reference = None
+                self.lines.append((int(serial_items[0]), int(serial_items[1]), int(serial_items[2]), float(serial_items[3]), reference))
+        self._load([line[1] for line in self.lines], [line[2] for line in self.lines])
+        for line in self.lines:
+            self.balance += self.accounts[line[1]].credit_debit_way() * line[3]
+
+    def _load(self, account_ids, third_ids):
+        account_ids = set(account_ids) - set(self.accounts.keys())
+        if len(account_ids) > 0:
+            for account in ChartsAccount.objects.filter(id__in=account_ids):
+                self.accounts[account.id] = account
+            if len(account_ids - set(self.accounts.keys())) > 0:
+                raise ChartsAccount.DoesNotExist("ChartsAccount matching query does not exist.")
+        third_ids = set(third_ids) - set(self.thirds.keys()) - set([0])
+        if len(third_ids) > 0:
+            for third in Third.objects.filter(id__in=third_ids).select_related('contact', 'contact__individual', 'contact__legalentity'):
+                self.thirds[third.id] = third
+            if len(third_ids - set(self.thirds.keys())) > 0:
+                raise Third.DoesNotExist("Third matching query does not exist.")
+
+    @property
+    def debit_rest(self):
+        return max(0, self.balance)
+
+    @property
+    def credit_rest(self):
+        return max(0, -1 * self.balance)
+
+    def add_new_line(self, num_cpt, debit_val, credit_val, thirdid=0, reference=None):
+        import time
+        self._load([num_cpt], [thirdid])
+        credit_debit_way = self.accounts[num_cpt].credit_debit_way()
+        if debit_val > 0:
+            amount = -1 * debit_val * credit_debit_way
+        elif credit_val > 0:
+            amount = credit_val * credit_debit_way
+        else:
+            amount = 0
+        if reference == "None":
+            reference = None
+        amount = float("%f" % amount)
+        self.lines.append((-1 * int(time.time() * 60), num_cpt, thirdid, amount, reference))
+        self.balance += credit_debit_way * amount
+
+    def remove_line(self, line_id):
+        line_idx = -1
+        for idx in range(len(self.lines)):
+            if self.lines[idx][0] == line_id:
+                line_idx = idx
+        self.balance -= self.accounts[self.lines[line_idx][1]].credit_debit_way() * self.lines[line_idx][3]
+        del self.lines[line_idx]
+
+    @classmethod
+    def serialize(cls, lines):
+        return '\n'.join(["%d|%d|%d|%f|%s|" % (line[0], line[1], 0 if line[2] is None else line[2], line[3], 'None' if line[4] is None else line[4]) for line in lines])
+
+    def get_serial(self):
+        return self.serialize(self.lines)
+
+    def _new_entryline(self, line):
+        new_line = EntryLineAccount(id=line[0], entry=self.entry, account=self.accounts[line[1]], amount=line[3], reference=line[4])
+        new_line.third = self.thirds[line[2]] if line[2] != 0 else None
+        return new_line
+
+    def get_entrylineaccounts(self):
+        res = QuerySet(model=EntryLineAccount)
+        res._result_cache = [self._new_entryline(line) for line in self.lines]
+        return res
+
+    def is_unchanged(self):
+        if self.entry.id is None:
+            current = []
+        else:
+            current = list(self.entry.entrylineaccount_set.all().values_list('id', 'account_id', 'third_id', 'amount', 'reference'))
+        if (len(self.lines) == 0) or (len(self.lines) != len(current)):
+            return False
+        for line, current_line in zip(self.lines, current):
+            if (line[0] != current_line[0]) or (line[1] != current_line[1]) or (abs(line[3] - current_line[3]) > 0.0001):
+                return False
+            if (line[4] != current_line[4]) or ((line[2] if line[2] != 0 else None) != current_line[2]):
+                return False
+        return True
+
+    def commit(self):
+        new_lines = []
+        for line in self.lines:
+            new_line = self._new_entryline(line)
+            if new_line.id < 0:
+                new_line.id = None
+            new_lines.append(new_line)
+        with transaction.atomic():
+            entries = EntryAccount.objects.filter(id=self.entry.id)
+            moves = ChartsAccountBalance.get_entries_moves(entries)
+            with suspend_balance_signals():
+                self.entry.entrylineaccount_set.all().delete()
+            EntryLineAccount.objects.bulk_create(new_lines)
+            for new_line in new_lines:
+                key = (new_line.account_id, new_line.third_id, None)
+                moves[key] = moves.get(key, 0) - new_line.amount
+            flags = get_entry_balance_flags(self.entry.id)
+            new_moves = {}
+            for (account_id, third_id, move_flags), amount in moves.items():
+                key = (account_id, third_id, flags if move_flags is None else move_flags)
+                new_moves[key] = new_moves.get(key, 0) + amount
+            for (account_id, third_id, move_flags), amount in new_moves.items():
+                ChartsAccountBalance.add_line_amount(account_id, third_id, move_flags, -1 * amount)
+            EntryLineSearchIndex.refresh(EntryLineAccount.objects.filter(entry_id=self.entry.id))
+        FiscalYear.increase_write_version_on_commit([self.entry.year_id])
+
+
+class EntryAccountSequence(LucteriosModel):
+    year = models.OneToOneField('FiscalYear', verbose_name=_('fiscal year'), null=False, on_delete=models.CASCADE)
+    last_num = models.IntegerField(verbose_name=_('last numeros'), default=0)
+
+    @classmethod
+    def _get_locked(cls, year_id):
+        sequences = list(cls.objects.select_for_update().filter(year_id=year_id))
+        if len(sequences) == 0:
+            val = EntryAccount.objects.filter(year_id=year_id).aggregate(Max('num'))
+            try:
+                with transaction.atomic():
+                    cls.objects.create(year_id=year_id, last_num=val['num__max'] if val['num__max'] is not None else 0)
+            except IntegrityError:
+                pass
+            sequences = list(cls.objects.select_for_update().filter(year_id=year_id))
+        return sequences[0]
+
+    @classmethod
+    def allocate(cls, year_id, nb_num):
+        sequence = cls._get_locked(year_id)
+        first_num = sequence.last_num + 1
+        cls.objects.filter(id=sequence.id).update(last_num=first_num + nb_num - 1)
+        return first_num
+
+    class Meta(object):
+        verbose_name = _('sequence of entries')
+        verbose_name_plural = _('sequences of entries')
+        default_permissions = []
+
+
+class EntryExchange(object):
+    FORMATS = {
+        'fec': {'delimiter': '|', 'date': '%Y%m%d', 'decimal': ',',
+                'fields': (('JournalCode', 'journal'), ('JournalLib', 'journal_name'), ('EcritureNum', 'entry'), ('EcritureDate', 'date_value'),
+                           ('CompteNum', 'code'), ('CompteLib', 'name'), ('CompAuxNum', 'third'), ('CompAuxLib', 'third_name'),
+                           ('PieceRef', 'reference'), ('PieceDate', 'date_value'), ('EcritureLib', 'designation'), ('Debit', 'debit'),
+                           ('Credit', 'credit'), ('EcritureLet', 'link'), ('DateLet', None), ('ValidDate', 'date_entry'),
+                           ('Montantdevise', None), ('Idevise', None))},
+        'csv': {'delimiter': ';', 'date': '%Y-%m-%d', 'decimal': '.',
+                'fields': tuple((field_name, field_name) for field_name in ('journal', 'entry', 'date_value', 'date_entry', 'designation', 'code', 'name',
+                                                                            'third', 'third_name', 'reference', 'debit', 'credit', 'link'))},
+    }
+    NEEDED_FIELDS = ('entry', 'date_value', 'code', 'debit', 'credit')
+    BATCH_SIZE = 500
+
+    def __init__(self, year, format_name):
+        self.year = year
+        self.format_name = format_name
+        self.format = self.FORMATS[format_name]
+        self.charts = {}
+        self.journal_ids = {}
+        self.journal_names = {}
+        self.thirds = {}
+        self.links = {}
+        self.entries = []
+        self.lines = []
+        self.entry_balance = 0.0
+        self.nb_entries = 0
+
+    def _load(self):
+        for code, account_id, type_of_account in self.year.chartsaccount_set.values_list('code', 'id', 'type_of_account'):
+            self.charts[code] = (account_id, -1 if type_of_account in [0, 4] else 1)
+        for journal_id, journal_name in Journal.objects.values_list('id', 'name'):
+            self.journal_ids[six.text_type(journal_id)] = journal_id
+            self.journal_names[journal_name] = journal_id
+        third_codes = list(AccountThird.objects.values_list('code', 'third_id'))
+        third_names = Third.get_names([third_id for _code, third_id in third_codes])
+        for code, third_id in third_codes:
+            if code not in self.thirds.keys():
+                self.thirds[code] = []
+            self.thirds[code].append((third_id, third_names.get(third_id, '')))
+
+    def _get_third(self, values):
+        third_code = values.get('third', '')
+        if third_code == '':
+            return None
+        third_ids = [third_id for third_id, _third_name in self.thirds.get(third_code, [])]
+        if len(third_ids) > 1:
+            third_ids = [third_id for third_id, third_name in self.thirds[third_code] if third_name == values.get('third_name', '')]
+        if len(third_ids) != 1:
+            raise LucteriosException(IMPORTANT, _("Unknown third %s!") % ("%s %s" % (third_code, values.get('third_name', ''))).strip())
+        return third_ids[0]
+
+    def _get_account(self, code, name):
+        if code not in self.charts.keys():
+            account = self.year.getorcreate_chartaccount(code, name if name != '' else None)
+            if account.type_of_account < 0:
+                raise LucteriosException(IMPORTANT, _("Invalid account code %s!") % code)
+            self.charts[code] = (account.id, account.credit_debit_way())
+        return self.charts[code]
+
+    def _get_journal(self, values):
+        if values.get('journal', '') in self.journal_ids.keys():
+            return self.journal_ids[values['journal']]
+        journal_name = (values.get('journal_name', '') or values.get('journal', ''))[:50]
+        if journal_name not in self.journal_names.keys():
+            self.journal_names[journal_name] = Journal.objects.create(name=journal_name).id
+        return self.journal_names[journal_name]
+
+    def _convert_date(self, value):
+        try:
+            return datetime.strptime(value, self.format['date']).date()
+        except ValueError:
+            raise LucteriosException(IMPORTANT, _("Invalid date %s!") % value)
+
+    def _convert_amount(self, value):
+        value = value.replace(' ', '').replace(self.format['decimal'], '.')
+        if value == '':
+            return 0.0
+        try:
+            return float(value)
+        except ValueError:
+            raise LucteriosException(IMPORTANT, _("Invalid amount %s!") % value)
+
+    def _get_third_code(self, codes, account_code):
+        if account_code in codes:
+            return account_code
+        return codes[0] if len(codes) > 0 else ''
+
+    def _format_amount(self, value, prec):
+        return ("%.*f" % (prec, value)).replace('.', self.format['decimal'])
+
+    def _check_entry_balance(self, entry_key):
+        if abs(self.entry_balance) > 0.0001:
+            raise LucteriosException(IMPORTANT, _("Entry %s unbalanced!") % entry_key)
+        self.entry_balance = 0.0
+
+    def _add_entry(self, values):
+        journal_id = self._get_journal(values)
+        if journal_id == 1:
+            date_value = self.year.begin
+        else:
+            date_value = self._convert_date(values['date_value'])
+        if (date_value < self.year.begin) or (date_value > self.year.end):
+            raise LucteriosException(IMPORTANT, _("Entry %s out of fiscal year!") % values['entry'])
+        new_entry = EntryAccount(year_id=self.year.id, journal_id=journal_id, date_value=date_value, designation=values.get('designation', '')[:200])
+        if values.get('link', '') != '':
+            if values['link'] not in self.links.keys():
+                self.links[values['link']] = []
+            self.links[values['link']].append(new_entry)
+        self.entries.append(new_entry)
+
+    def _add_line(self, values):
+        account_id, credit_debit_way = self._get_account(values['code'], values.get('name', ''))
+        amount = (self._convert_amount(values['credit']) - self._convert_amount(values['debit'])) * credit_debit_way
+        third_id = self._get_third(values)
+        self.lines.append((len(self.entries) - 1, EntryLineAccount(account_id=account_id, third_id=third_id, amount=amount, reference=values.get('reference', '')[:100] or None)))
+        self.entry_balance += amount * credit_debit_way
+
+    def _create_entries(self):
+        if connection.features.can_return_ids_from_bulk_insert:
+            EntryAccount.objects.bulk_create(self.entries)
+        else:
+            for new_entry in self.entries:
+                new_entry.save()
+
+    def _flush(self):
+        if len(self.entries) == 0:
+            return
+        self._create_entries()
+        for entry_idx, new_line in self.lines:
+            new_line.entry_id = self.entries[entry_idx].id
+        EntryLineAccount.objects.bulk_create([new_line for _entry_idx, new_line in self.lines])
+        new_entries = EntryAccount.objects.filter(id__in=[new_entry.id for new_entry in self.entries])
+        moves = ChartsAccountBalance.get_entries_moves(new_entries)
+        for (account_id, third_id, flags), amount in moves.items():
+            ChartsAccountBalance.add_line_amount(account_id, third_id, flags, amount)
+        EntryLineSearchIndex.refresh(EntryLineAccount.objects.filter(entry__in=new_entries))
+        self.nb_entries += len(self.entries)
+        self.entries = []
+        self.lines = []
+
+    def _read_values(self, csvfile):
+        header = csvfile.readline()
+        reader = DictReader(chain([header], csvfile), delimiter='\t' if '\t' in header else self.format['delimiter'])
+        columns = [(column, field_name) for column, field_name in self.format['fields'] if field_name is not None]
+        if (reader.fieldnames is None) or (len(set(self.NEEDED_FIELDS) - set([field_name for column, field_name in columns if column in reader.fieldnames])) > 0):
+            raise LucteriosException(IMPORTANT, _('CSV file unvalid!'))
+        for row in reader:
+            values = {}
+            for column, field_name in columns:
+                if field_name not in values.keys():
+                    values[field_name] = (row.get(column) or '').strip()
+            yield values
+
+    def import_entries(self, csvfile):
+        with transaction.atomic():
+            self._load()
+            current_key = None
+            for values in self._read_values(csvfile):
+                entry_key = (values.get('journal', ''), values['entry'])
+                if entry_key != current_key:
+                    if current_key is not None:
+                        self._check_entry_balance(current_key[1])
+                    if len(self.entries) >= self.BATCH_SIZE:
+                        self._flush()
+                    self._add_entry(values)
+                    current_key = entry_key
+                self._add_line(values)
+            if current_key is not None:
+                self._check_entry_balance(current_key[1])
+            self._flush()
+            for link_entries in self.links.values():
+                if len(link_entries) > 1:
+                    AccountLink.create_link(link_entries)
+        FiscalYear.increase_write_version(Q(id=self.year.id))
+        return self.nb_entries
+
+    def export_entries(self):
+        export_buffer = StringIO()
+        csv_writer = writer(export_buffer, delimiter=self.format['delimiter'], lineterminator='\n')
+
+        def write_row(values):
+            csv_writer.writerow(values)
+            row = export_buffer.getvalue()
+            export_buffer.seek(0)
+            export_buffer.truncate(0)
+            return row
+        yield write_row([column for column, _field_name in self.format['fields']])
+        prec = FinancialParams.getvalue("accounting-devise-prec")
+        journal_names = dict(Journal.objects.values_list('id', 'name'))
+        third_ids = list(Third.objects.filter(entrylineaccount__account__year=self.year).distinct().values_list('id', flat=True))
+        third_names = Third.get_names(third_ids)
+        third_codes = {}
+        for third_id, code in AccountThird.objects.filter(third__entrylineaccount__account__year=self.year).distinct().order_by('id').values_list('third_id', 'code'):
+            if third_id not in third_codes.keys():
+                third_codes[third_id] = []
+            third_codes[third_id].append(code)
+        lines = EntryLineAccount.objects.filter(account__year=self.year)
+        if self.format_name == 'fec':
+            lines = lines.filter(entry__close=True).order_by('entry__num', 'entry_id', 'id')
+        else:
+            lines = lines.order_by('entry__date_value', 'entry_id', 'id')
+        for line in lines.values('entry__journal_id', 'entry_id', 'entry__num', 'entry__date_value', 'entry__date_entry', 'entry__designation', 'account__code',
+                                 'account__name', 'account__type_of_account', 'third_id', 'reference', 'amount', 'entry__link__letter').iterator():
+            amount = line['amount'] * (-1 if line['account__type_of_account'] in [0, 4] else 1)
+            values = {'journal': line['entry__journal_id'], 'journal_name': journal_names.get(line['entry__journal_id'], ''),
+                      'entry': line['entry__num'] if self.format_name == 'fec' else line['entry_id'],
+                      'date_value': line['entry__date_value'].strftime(self.format['date']),
+                      'date_entry': line['entry__date_entry'].strftime(self.format['date']) if line['entry__date_entry'] is not None else '',
+                      'designation': line['entry__designation'], 'code': line['account__code'], 'name': line['account__name'],
+                      'third': self._get_third_code(third_codes.get(line['third_id'], []), line['account__code']), 'third_name': third_names.get(line['third_id'], ''),
+                      'reference': line['reference'] if line['reference'] is not None else '',
+                      'debit': self._format_amount(max(0, -1 * amount), prec), 'credit': self._format_amount(max(0, amount), prec),
+                      'link': line['entry__link__letter'] if line['entry__link__letter'] is not None else ''}
+            yield write_row([values.get(field_name, '') if field_name is not None else '' for _column, field_name in self.format['fields']])
+
+
+class EntryXmlExport(object):
+    PROGRESS_STEP = 500
+
+    def __init__(self, year, progress=None):
+        self.year = year
+        self.progress = progress
+        self.xml_file = None
+        self.nb_entries = 0
+        self.nb_total = 0
+
+    def _report_progress(self):
+        if self.progress is not None:
+            self.progress(self.nb_entries, self.nb_total)
+        else:
+            logging.getLogger('diacamma.accounting').info("export of %s: %d/%d entries", self.year, self.nb_entries, self.nb_total)
+
+    def _write_tag(self, tag, value):
+        self.xml_file.write("<%s>%s</%s>" % (tag, escape(six.text_type(value)), tag))
+
+    def _write_entry(self, line):
+        self.xml_file.write("<ecriture>")
+        self._write_tag('EcritureNum', line['entry__num'])
+        self._write_tag('EcritureDate', line['entry__date_value'].isoformat())
+        self._write_tag('EcritureLib', line['entry__designation'])
+        self._write_tag('PieceRef', '')
+        self._write_tag('PieceDate', line['entry__date_value'].isoformat())
+        if line['entry__link__letter'] is not None:
+            self._write_tag('EcritureLet', line['entry__link__letter'])
+        date_entry = line['entry__date_entry'].isoformat() if line['entry__date_entry'] is not None else ''
+        self._write_tag('ValidDate', date_entry)
+        self._write_tag('DateRglt', date_entry)
+        self._write_tag('ModeRglt', '')
+
+    def _write_line(self, line, third_names, epsilon):
+        self.xml_file.write("<ligne>")
+        self._write_tag('CompteNum', line['account__code'])
+        self._write_tag('CompteLib', line['account__name'])
+        if line['third_id'] is not None:
+            self._write_tag('CompAuxLib', third_names.get(line['third_id'], ''))
+        amount = line['amount'] * (-1 if line['account__type_of_account'] in [0, 4] else 1)
+        if amount >= epsilon:
+            self._write_tag('Credit', amount)
+        else:
+            self._write_tag('Debit', max(0, -1 * amount))
+        self.xml_file.write("</ligne>")
+
+    def write(self, xml_path):
+        entries = EntryAccount.objects.filter(year=self.year, close=True)
+        self.nb_total = entries.count()
+        self.nb_entries = 0
+        epsilon = pow(10, -1 * FinancialParams.getvalue("accounting-devise-prec") - 1)
+        journal_names = dict(Journal.objects.values_list('id', 'name'))
+        third_names = Third.get_names(EntryLineAccount.objects.filter(entry__in=entries, third__isnull=False).order_by().values_list('third_id', flat=True).distinct())
+        lines = EntryLineAccount.objects.filter(entry__year=self.year, entry__close=True).order_by('entry__journal_id', 'entry__date_value', 'entry_id', 'id')
+        with open(xml_path, 'w', encoding='utf-8') as self.xml_file:
+            self.xml_file.write("<?xml version='1.0' encoding='utf-8'?>\n<comptabilite><exercice>")
+            self._write_tag('DateCloture', self.year.end.isoformat())
+            current_journal = None
+            current_entry = None
+            for line in lines.values('entry__journal_id', 'entry_id', 'entry__num', 'entry__date_value', 'entry__date_entry', 'entry__designation', 'entry__link__letter',
+                                     'account__code', 'account__name', 'account__type_of_account', 'third_id', 'amount').iterator():
+                if line['entry_id'] != current_entry:
+                    if current_entry is not None:
+                        self.xml_file.write("</ecriture>")
+                        self.nb_entries += 1
+                        if (self.nb_entries % self.PROGRESS_STEP) == 0:
+                            self._report_progress()
+                    if line['entry__journal_id'] != current_journal:
+                        if current_journal is not None:
+                            self.xml_file.write("</journal>")
+                        self.xml_file.write("<journal>")
+                        self._write_tag('JournalLib', journal_names.get(line['entry__journal_id'], ''))
+                        current_journal = line['entry__journal_id']
+                    self._write_entry(line)
+                    current_entry = line['entry_id']
+                self._write_line(line, third_names, epsilon)
+            if current_entry is not None:
+                self.xml_file.write("</ecriture></journal>")
+                self.nb_entries += 1
+            self.xml_file.write("</exercice></comptabilite>")
+        self._report_progress()
+
+
 class EntryLineAccount(LucteriosModel):
     is_simple_gui = True
 
@@ -1038,7 +1721,8 @@ class EntryLineAccount(LucteriosModel):
     def get_search_fields(cls):
         result = ['entry.year', 'entry.date_value', 'account.code']
         result.append(
-            ('amount', models.FloatField(_('amount')), 'amount__abs', Q()))
+            ('amount', models.FloatField(_('amount')), 'searchindex__abs_amount', Q()))
+        result.append(('searchindex', models.CharField(_('text')), 'searchindex__content', Q()))
         result.extend(['reference', 'entry.num', 'entry.designation', 'entry.date_entry',
                        'entry.costaccounting', 'account.name', 'account.type_of_account'])
         for fieldname in Third.get_search_fields():
@@ -1179,6 +1863,185 @@ class EntryLineAccount(LucteriosModel):
         default_permissions = []
 
 
+class EntryLineSearchIndex(LucteriosModel):
+    line = models.OneToOneField('EntryLineAccount', verbose_name=_('entry line of account'), primary_key=True, related_name='searchindex', on_delete=models.CASCADE)
+    content = SearchTextField(verbose_name=_('text'), default='')
+    abs_amount = models.FloatField(verbose_name=_('amount'), db_index=True)
+
+    BATCH_SIZE = 1000
+
+    @classmethod
+    def _write_indexes(cls, line_values, third_names):
+        third_names.update(Third.get_names([line_value[3] for line_value in line_values if (line_value[3] is not None) and (line_value[3] not in third_names.keys())]))
+        new_indexes = []
+        changed_indexes = []
+        for line_id, designation, reference, third_id, amount, old_content, old_amount in line_values:
+            content = "\n".join([designation, reference if reference is not None else '', third_names.get(third_id, '')])
+            if old_content is None:
+                new_indexes.append(cls(line_id=line_id, content=content, abs_amount=abs(amount)))
+            elif (old_content != content) or (abs(old_amount - abs(amount)) > 0.0001):
+                changed_indexes.append((line_id, content, abs(amount)))
+        for index_idx in range(0, len(changed_indexes), 250):
+            sub_indexes = changed_indexes[index_idx:index_idx + 250]
+            cls.objects.filter(line_id__in=[line_id for line_id, _content, _amount in sub_indexes]).update(
+                content=Case(*[When(line_id=line_id, then=Value(content)) for line_id, content, _amount in sub_indexes], output_field=models.TextField()),
+                abs_amount=Case(*[When(line_id=line_id, then=Value(amount)) for line_id, _content, amount in sub_indexes], output_field=FloatField()))
+        cls.objects.bulk_create(new_indexes)
+
+    @classmethod
+    def refresh(cls, lines):
+        third_names = {}
+        line_values = []
+        for line_value in lines.order_by().values_list('id', 'entry__designation', 'reference', 'third_id', 'amount', 'searchindex__content', 'searchindex__abs_amount').iterator():
+            line_values.append(line_value)
+            if len(line_values) >= cls.BATCH_SIZE:
+                cls._write_indexes(line_values, third_names)
+                line_values = []
+        cls._write_indexes(line_values, third_names)
+
+    class Meta(object):
+        verbose_name = _('search index of entry line')
+        verbose_name_plural = _('search indexes of entry lines')
+        default_permissions = []
+
+
+def add_balance_amount(balance_model, amount, **balance_keys):
+    if abs(amount) > 0.00001:
+        with transaction.atomic():
+            balances = balance_model.objects.filter(**balance_keys)
+            if balances.update(amount=F('amount') + amount) == 0:
+                list(ChartsAccount.objects.select_for_update().filter(id=balance_keys['account_id']).values_list('id', flat=True))
+                if balances.update(amount=F('amount') + amount) == 0:
+                    balance_model.objects.create(amount=amount, **balance_keys)
+
+
+class ChartsAccountBalance(LucteriosModel):
+    account = models.ForeignKey('ChartsAccount', verbose_name=_('account'), null=False, on_delete=models.CASCADE)
+    third = models.ForeignKey('Third', verbose_name=_('third'), null=True, on_delete=models.CASCADE)
+    is_lastyear = models.BooleanField(verbose_name=_('last year'), default=False)
+    is_close = models.BooleanField(verbose_name=_('close'), default=False)
+    amount = models.FloatField(_('amount'), default=0)
+
+    @classmethod
+    def get_total(cls, query):
+        return get_amount_sum(cls.objects.filter(query).aggregate(Sum('amount')))
+
+    @classmethod
+    def add_amount(cls, account_id, third_id, is_lastyear, is_close, amount):
+        add_balance_amount(cls, amount, account_id=account_id, third_id=third_id, is_lastyear=is_lastyear, is_close=is_close)
+
+    @classmethod
+    def add_line_amount(cls, account_id, third_id, flags, amount):
+        cls.add_amount(account_id, third_id, flags[0], flags[1], amount)
+        ChartsAccountMonthBalance.add_amount(account_id, third_id, flags[2], flags[0], flags[1], amount)
+
+    @classmethod
+    def get_entries_moves(cls, entries):
+        moves = {}
+        for data_line in EntryLineAccount.objects.filter(entry__in=entries).order_by().values('account', 'third', 'entry__journal', 'entry__close', 'entry__date_value').annotate(data_sum=Sum('amount')):
+            key = (data_line['account'], data_line['third'], (data_line['entry__journal'] == 1, data_line['entry__close'], data_line['entry__date_value'].replace(day=1)))
+            moves[key] = moves.get(key, 0) + data_line['data_sum']
+        return moves
+
+    @classmethod
+    def move_entry(cls, entry_id, old_flags, new_flags):
+        for data_line in EntryLineAccount.objects.filter(entry_id=entry_id).values('account', 'third').annotate(data_sum=Sum('amount')):
+            if old_flags[:2] != new_flags[:2]:
+                cls.add_amount(data_line['account'], data_line['third'], old_flags[0], old_flags[1], -1 * data_line['data_sum'])
+                cls.add_amount(data_line['account'], data_line['third'], new_flags[0], new_flags[1], data_line['data_sum'])
+            ChartsAccountMonthBalance.add_amount(data_line['account'], data_line['third'], old_flags[2], old_flags[0], old_flags[1], -1 * data_line['data_sum'])
+            ChartsAccountMonthBalance.add_amount(data_line['account'], data_line['third'], new_flags[2], new_flags[0], new_flags[1], data_line['data_sum'])
+
+    @classmethod
+    def refresh(cls, accounts):
+        cls.objects.filter(account__in=accounts).delete()
+        ChartsAccountMonthBalance.objects.filter(account__in=accounts).delete()
+        balances = {}
+        month_balances = {}
+        for data_line in EntryLineAccount.objects.filter(account__in=accounts).values('account', 'third', 'entry__journal', 'entry__close', 'entry__date_value').annotate(data_sum=Sum('amount')):
+            key = (data_line['account'], data_line['third'], data_line['entry__journal'] == 1, data_line['entry__close'])
+            balances[key] = balances.get(key, 0) + data_line['data_sum']
+            month_key = key + (data_line['entry__date_value'].replace(day=1),)
+            month_balances[month_key] = month_balances.get(month_key, 0) + data_line['data_sum']
+        cls.objects.bulk_create([cls(account_id=key[0], third_id=key[1], is_lastyear=key[2], is_close=key[3], amount=value)
+                                 for key, value in balances.items()])
+        ChartsAccountMonthBalance.objects.bulk_create([ChartsAccountMonthBalance(account_id=key[0], third_id=key[1], is_lastyear=key[2], is_close=key[3], month=key[4], amount=value)
+                                                       for key, value in month_balances.items()])
+        FiscalYear.increase_write_version(Q(chartsaccount__in=accounts))
+
+    @classmethod
+    def rebuild(cls, year=None):
+        if year is None:
+            accounts = ChartsAccount.objects.all()
+        else:
+            accounts = ChartsAccount.objects.filter(year=year)
+        cls.refresh(accounts)
+
+    class Meta(object):
+        verbose_name = _('balance of account')
+        verbose_name_plural = _('balances of account')
+        default_permissions = []
+        unique_together = (('account', 'third', 'is_lastyear', 'is_close'),)
+
+
+class ChartsAccountMonthBalance(LucteriosModel):
+    account = models.ForeignKey('ChartsAccount', verbose_name=_('account'), null=False, on_delete=models.CASCADE)
+    third = models.ForeignKey('Third', verbose_name=_('third'), null=True, on_delete=models.CASCADE)
+    month = models.DateField(verbose_name=_('month'))
+    is_lastyear = models.BooleanField(verbose_name=_('last year'), default=False)
+    is_close = models.BooleanField(verbose_name=_('close'), default=False)
+    amount = models.FloatField(_('amount'), default=0)
+
+    @classmethod
+    def add_amount(cls, account_id, third_id, month, is_lastyear, is_close, amount):
+        add_balance_amount(cls, amount, account_id=account_id, third_id=third_id, month=month, is_lastyear=is_lastyear, is_close=is_close)
+
+    @classmethod
+    def get_sums(cls, year, begin, end, query, fields):
+        month_query = Q(account__year=year) & query
+        line_query = Q(entry__year=year) & query
+        edge_query = None
+        if begin is not None:
+            first_month = begin.replace(day=1)
+            if first_month != begin:
+                first_month = (first_month + timedelta(days=32)).replace(day=1)
+                edge_query = Q(entry__date_value__gte=begin) & Q(entry__date_value__lt=first_month)
+            month_query &= Q(month__gte=first_month)
+        if end is not None:
+            last_month = end.replace(day=1)
+            if (end + timedelta(days=1)).day == 1:
+                last_month = (last_month + timedelta(days=32)).replace(day=1)
+            elif edge_query is None:
+                edge_query = Q(entry__date_value__gte=last_month) & Q(entry__date_value__lte=end)
+            else:
+                edge_query |= Q(entry__date_value__gte=last_month) & Q(entry__date_value__lte=end)
+            month_query &= Q(month__lt=last_month)
+        if (begin is not None) and (end is not None) and (first_month >= last_month):
+            month_query = None
+            edge_query = Q(entry__date_value__gte=begin) & Q(entry__date_value__lte=end)
+        sums = {}
+        data_lines = []
+        if month_query is not None:
+            data_lines.extend(cls.objects.filter(month_query).values(*fields).annotate(data_sum=Sum('amount')))
+        if edge_query is not None:
+            data_lines.extend(EntryLineAccount.objects.filter(line_query & edge_query).values(*fields).annotate(data_sum=Sum('amount')))
+        for data_line in data_lines:
+            key = tuple([data_line[field] for field in fields])
+            sums[key] = sums.get(key, 0) + data_line['data_sum']
+        res = []
+        for key, value in sums.items():
+            data_line = dict(zip(fields, key))
+            data_line['data_sum'] = value
+            res.append(data_line)
+        return res
+
+    class Meta(object):
+        verbose_name = _('balance of account by month')
+        verbose_name_plural = _('balances of account by month')
+        default_permissions = []
+        unique_together = (('account', 'third', 'month', 'is_lastyear', 'is_close'),)
+
+
 class ModelEntry(LucteriosModel):
     is_simple_gui = True
 
@@ -1313,6 +2176,11 @@ class Budget(LucteriosModel):
 
     year = models.ForeignKey('FiscalYear', verbose_name=_('fiscal year'), null=True, default=None, on_delete=models.PROTECT)
     cost_accounting = models.ForeignKey('CostAccounting', verbose_name=_('cost accounting'), null=True, default=None, on_delete=models.PROTECT)
+    is_revenue_code = models.BooleanField(verbose_name=_('revenue code'), default=False, db_index=True, editable=False)
+    is_expense_code = models.BooleanField(verbose_name=_('expense code'), default=False, db_index=True, editable=False)
+    is_annexe_code = models.BooleanField(verbose_name=_('annexe code'), default=False, db_index=True, editable=False)
+
+    code_class_fields = ('is_revenue_code', 'is_expense_code', 'is_annexe_code')
     code = models.CharField(_('account'), max_length=50)
     amount = models.FloatField(_('amount'), default=0)
 
@@ -1372,10 +2240,51 @@ class Budget(LucteriosModel):
             budget_filter &= Q(year_id=year)
         if cost is not None:
             budget_filter &= Q(cost_accounting_id=cost)
-        total_revenue = get_amount_sum(cls.objects.filter(budget_filter & Q(code__regex=current_system_account().get_revenue_mask())).aggregate(Sum('amount')))
-        total_expense = get_amount_sum(cls.objects.filter(budget_filter & Q(code__regex=current_system_account().get_expence_mask())).aggregate(Sum('amount')))
+        total_revenue = get_amount_sum(cls.objects.filter(budget_filter & Q(is_revenue_code=True)).aggregate(Sum('amount')))
+        total_expense = get_amount_sum(cls.objects.filter(budget_filter & Q(is_expense_code=True)).aggregate(Sum('amount')))
         return total_revenue - total_expense
 
+    @classmethod
+    def _import_amounts(cls, budget_filter, amounts, year_id, cost_accounting_id):
+        amounts = {code: value for code, value in amounts.items() if abs(value) > 0.001}
+        kept_codes = set()
+        deleted_ids = []
+        changed_amounts = []
+        for budget_id, code, amount in cls.objects.filter(budget_filter).order_by('id').values_list('id', 'code', 'amount'):
+            if (code in amounts.keys()) and (code not in kept_codes):
+                kept_codes.add(code)
+                if abs(amount - amounts[code]) > 0.0001:
+                    changed_amounts.append((budget_id, amounts[code]))
+            else:
+                deleted_ids.append(budget_id)
+        for budget_idx in range(0, len(deleted_ids), 500):
+            cls.objects.filter(id__in=deleted_ids[budget_idx:budget_idx + 500]).delete()
+        for budget_idx in range(0, len(changed_amounts), 250):
+            sub_amounts = changed_amounts[budget_idx:budget_idx + 250]
+            cls.objects.filter(id__in=[budget_id for budget_id, _amount in sub_amounts]).update(amount=Case(*[When(id=budget_id, then=Value(amount)) for budget_id, amount in sub_amounts],
+                                                                                                           output_field=FloatField()))
+        cls.objects.bulk_create([cls(year_id=year_id, cost_accounting_id=cost_accounting_id, code=code, amount=value, **get_code_classes(code, cls.code_class_fields))
+                                 for code, value in sorted(amounts.items()) if code not in kept_codes])
+        FiscalYear.increase_write_version(Q(id=year_id))
+
+    @classmethod
+    def import_from_year(cls, year_id, source_year_id):
+        amounts = dict([(code, 0.0) for code in ChartsAccount.objects.filter(year_id=source_year_id, type_of_account__in=(3, 4)).values_list('code', flat=True)])
+        for balance in ChartsAccountBalance.objects.filter(account__year_id=source_year_id, account__type_of_account__in=(3, 4)).order_by().values('account__code').annotate(data_sum=Sum('amount')):
+            amounts[balance['account__code']] = balance['data_sum']
+        for budget in cls.objects.filter(year_id=year_id, cost_accounting__isnull=False).order_by().values('code').annotate(data_sum=Sum('amount')):
+            if budget['code'] in amounts.keys():
+                amounts[budget['code']] -= budget['data_sum']
+        cls._import_amounts(Q(year_id=year_id) & Q(cost_accounting__isnull=True), amounts, year_id, None)
+
+    @classmethod
+    def import_from_costaccounting(cls, cost_accounting_id, source_cost_accounting_id):
+        amounts = {}
+        for data_line in EntryLineAccount.objects.filter(account__type_of_account__in=(3, 4), entry__costaccounting_id=source_cost_accounting_id).order_by().values('account__code').annotate(data_sum=Sum('amount')):
+            amounts[data_line['account__code']] = data_line['data_sum']
+        cost_accounting = CostAccounting.objects.get(id=cost_accounting_id)
+        cls._import_amounts(Q(cost_accounting_id=cost_accounting_id), amounts, cost_accounting.year_id, cost_accounting_id)
+
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
         if self.cost_accounting is not None:
             self.year = self.cost_accounting.year
@@ -1389,7 +2298,11 @@ class Budget(LucteriosModel):
             if abs(value) > 0.001:
                 Budget.objects.create(code=chart_code, amount=value, year_id=year)
         else:
-            return LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+            for field_name, field_value in get_code_classes(self.code, self.code_class_fields).items():
+                setattr(self, field_name, field_value)
+            res = LucteriosModel.save(self, force_insert=force_insert, force_update=force_update, using=using, update_fields=update_fields)
+            FiscalYear.increase_write_version(Q(id=self.year_id))
+            return res
 
     def delete(self, using=None):
         if six.text_type(self.id)[0] == 'C':
@@ -1398,6 +2311,7 @@ class Budget(LucteriosModel):
                     budget_line.delete()
         else:
             LucteriosModel.delete(self, using=using)
+            FiscalYear.increase_write_version(Q(id=self.year_id))
 
     class Meta(object):
         verbose_name = _('Budget line')
@@ -1430,7 +2344,109 @@ def accounting_checkparam():
     Parameter.check_and_create(name='accounting-devise-prec', typeparam=1, title=_("accounting-devise-prec"), args="{'Min':0, 'Max':4}", value='2')
     Parameter.check_and_create(name='accounting-system', typeparam=0, title=_("accounting-system"), args="{'Multi':False}", value='')
     Parameter.check_and_create(name='accounting-sizecode', typeparam=1, title=_("accounting-sizecode"), args="{'Min':3, 'Max':50}", value='3')
+    Parameter.check_and_create(name='accounting-params-version', typeparam=0, title=_("accounting-params-version"), args="{'Multi':False}", value='')
     check_accountingcost()
 
 
+BALANCE_SIGNALS = threading.local()
+
+
+@contextmanager
+def suspend_balance_signals():
+    old_suspended = getattr(BALANCE_SIGNALS, 'suspended', False)
+    BALANCE_SIGNALS.suspended = True
+    try:
+        yield
+    finally:
+        BALANCE_SIGNALS.suspended = old_suspended
+
+
+def get_entry_balance_flags(entry_id):
+    for journal_id, close, date_value in EntryAccount.objects.filter(id=entry_id).values_list('journal_id', 'close', 'date_value'):
+        return (journal_id == 1, close, date_value.replace(day=1))
+    return None
+
+
+def post_init_entryline(sender, instance, **kwargs):
+    instance.balance_origin = (instance.__dict__.get('account_id'), instance.__dict__.get('third_id'),
+                               instance.__dict__.get('amount'), instance.__dict__.get('entry_id'))
+    instance.search_origin = (instance.__dict__.get('reference'), instance.__dict__.get('third_id'), instance.__dict__.get('amount'))
+
+
+def post_save_entryline(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created or (getattr(instance, 'search_origin', None) != (instance.reference, instance.third_id, instance.amount)):
+        EntryLineSearchIndex.refresh(EntryLineAccount.objects.filter(id=instance.id))
+    origin = getattr(instance, 'balance_origin', (None, None, None, None))
+    if not created:
+        old_flags = get_entry_balance_flags(origin[3]) if origin[0] is not None else None
+        if old_flags is None:
+            ChartsAccountBalance.refresh([instance.account_id])
+            post_init_entryline(sender, instance)
+            return
+        ChartsAccountBalance.add_line_amount(origin[0], origin[1], old_flags, -1 * origin[2])
+    new_flags = get_entry_balance_flags(instance.entry_id)
+    ChartsAccountBalance.add_line_amount(instance.account_id, instance.third_id, new_flags, instance.amount)
+    FiscalYear.increase_write_version_on_commit(ChartsAccount.objects.filter(id=instance.account_id).values_list('year_id', flat=True))
+    post_init_entryline(sender, instance)
+
+
+def post_delete_entryline(sender, instance, **kwargs):
+    if getattr(BALANCE_SIGNALS, 'suspended', False):
+        return
+    origin = getattr(instance, 'balance_origin', (None, None, None, None))
+    if origin[0] is not None:
+        old_flags = get_entry_balance_flags(origin[3])
+        if old_flags is None:
+            ChartsAccountBalance.refresh([origin[0]])
+        else:
+            ChartsAccountBalance.add_line_amount(origin[0], origin[1], old_flags, -1 * origin[2])
+        FiscalYear.increase_write_version_on_commit(ChartsAccount.objects.filter(id=origin[0]).values_list('year_id', flat=True))
+
+
+def pre_save_entryaccount(sender, instance, raw=False, **kwargs):
+    instance.balance_origin = None
+    instance.designation_origin = None
+    if not raw and (instance.id is not None):
+        for journal_id, close, date_value, designation in EntryAccount.objects.filter(id=instance.id).values_list('journal_id', 'close', 'date_value', 'designation'):
+            instance.balance_origin = (journal_id == 1, close, date_value.replace(day=1))
+            instance.designation_origin = designation
+
+
+def post_save_entryaccount(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_flags = getattr(instance, 'balance_origin', None)
+    if not created and (old_flags is not None):
+        new_flags = get_entry_balance_flags(instance.id)
+        if old_flags != new_flags:
+            ChartsAccountBalance.move_entry(instance.id, old_flags, new_flags)
+        if instance.designation_origin != instance.designation:
+            EntryLineSearchIndex.refresh(EntryLineAccount.objects.filter(entry_id=instance.id))
+    FiscalYear.increase_write_version_on_commit([instance.year_id])
+
+
+def post_save_third(sender, instance, created, raw=False, **kwargs):
+    if not raw and not created:
+        lines = EntryLineAccount.objects.filter(third_id=instance.id)
+        EntryLineSearchIndex.refresh(lines)
+        FiscalYear.increase_write_version_on_commit(lines.order_by().values_list('account__year_id', flat=True).distinct())
+
+
+def post_save_contact(sender, instance, created, raw=False, **kwargs):
+    if not raw and not created:
+        lines = EntryLineAccount.objects.filter(third__contact_id=instance.pk)
+        EntryLineSearchIndex.refresh(lines)
+        FiscalYear.increase_write_version_on_commit(lines.order_by().values_list('account__year_id', flat=True).distinct())
+
+
 pre_save.connect(pre_save_datadb)
+post_init.connect(post_init_entryline, sender=EntryLineAccount)
+post_save.connect(post_save_entryline, sender=EntryLineAccount)
+post_delete.connect(post_delete_entryline, sender=EntryLineAccount)
+pre_save.connect(pre_save_entryaccount, sender=EntryAccount)
+post_save.connect(post_save_entryaccount, sender=EntryAccount)
+post_save.connect(post_save_third, sender=Third)
+post_save.connect(post_save_contact, sender=LegalEntity)
+post_save.connect(post_save_contact, sender=Individual)
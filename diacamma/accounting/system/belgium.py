@@ -19,7 +19,6 @@ You should have received a copy of the GNU General Public License
 along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 from __future__ import unicode_literals
-import re
 
 from django.utils import six
 
@@ -950,13 +949,7 @@ GENERAL_CHARTS_ACCOUNT = [
 
 
 def find_charts(code):
-    current_charts = None
-    for chart_item in GENERAL_CHARTS_ACCOUNT:
-        if code[:len(chart_item[0])] == chart_item[0]:
-            current_charts = chart_item
-        elif current_charts is not None:
-            break
-    return current_charts
+    return BelgiumSystemAcounting().find_charts(code)
 
 
 class BelgiumSystemAcounting(DefaultSystemAccounting):
@@ -967,6 +960,26 @@ class BelgiumSystemAcounting(DefaultSystemAccounting):
     def has_minium_code_size(self):
         return False
 
+    def get_general_charts(self):
+        return GENERAL_CHARTS_ACCOUNT
+
+    def _build_charts_index(self):
+        positions_by_code = {}
+        for chart_idx, chart_item in enumerate(self.get_general_charts()):
+            positions_by_code.setdefault(chart_item[0], []).append(chart_idx)
+        return positions_by_code
+
+    def _search_charts_index(self, charts_index, code):
+        positions = set()
+        for code_size in range(len(code) + 1):
+            positions.update(charts_index.get(code[:code_size], []))
+        if len(positions) == 0:
+            return None
+        chart_idx = min(positions)
+        while (chart_idx + 1) in positions:
+            chart_idx += 1
+        return self.get_general_charts()[chart_idx]
+
     def get_general_mask(self):
         return GENERAL_MASK
 
@@ -1000,16 +1013,5 @@ class BelgiumSystemAcounting(DefaultSystemAccounting):
     def get_annexe_mask(self):
         return r'X'
 
-    def new_charts_account(self, code):
-        code = code.strip()
-        if code == '':
-            return '', -1
-        pattern = re.compile(GENERAL_MASK)
-        if pattern.match(code):
-            current_charts = find_charts(code)
-            if current_charts is not None:
-                return current_charts[1], current_charts[2]
-        return '', -2
-
-    def get_export_xmlfiles(self):
+    def get_export_xsdfile(self):
         return None
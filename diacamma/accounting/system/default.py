@@ -24,6 +24,7 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import unicode_literals
 import re
+from bisect import bisect_right
 
 from django.utils import six
 from django.utils.translation import ugettext_lazy as _
@@ -37,6 +38,10 @@ class DefaultSystemAccounting(object):
     NEGATIF_ACCOUNT = ""
     POSITIF_ACCOUNT = ""
 
+    CHARTS_CACHE_SIZE = 10000
+
+    _compiled_masks = {}
+
     def has_minium_code_size(self):
         return True
 
@@ -73,8 +78,56 @@ class DefaultSystemAccounting(object):
     def get_annexe_mask(self):
         return ''
 
+    def get_general_charts(self):
+        return []
+
+    def match_mask(self, mask, code):
+        if mask not in self._compiled_masks:
+            self._compiled_masks[mask] = re.compile(mask)
+        return self._compiled_masks[mask].match(code) is not None
+
+    def _build_charts_index(self):
+        charts = self.get_general_charts()
+        bounds = sorted(set([chart_item[0] for chart_item in charts] + [chart_item[1] for chart_item in charts]))
+        on_bounds = []
+        after_bounds = []
+        for bound in bounds:
+            on_bounds.append(next((chart_item for chart_item in charts if chart_item[0] <= bound <= chart_item[1]), None))
+            after_bounds.append(next((chart_item for chart_item in charts if chart_item[0] <= bound < chart_item[1]), None))
+        return bounds, on_bounds, after_bounds
+
+    def _search_charts_index(self, charts_index, code):
+        bounds, on_bounds, after_bounds = charts_index
+        bound_idx = bisect_right(bounds, code) - 1
+        if bound_idx < 0:
+            return None
+        if bounds[bound_idx] == code:
+            return on_bounds[bound_idx]
+        return after_bounds[bound_idx]
+
+    def find_charts(self, code):
+        system_class = self.__class__
+        if '_charts_index' not in system_class.__dict__:
+            system_class._charts_index = self._build_charts_index()
+        return self._search_charts_index(system_class._charts_index, code)
+
+    def _new_charts_account(self, code):
+        if self.match_mask(self.get_general_mask(), code):
+            current_charts = self.find_charts(code)
+            if current_charts is not None:
+                return current_charts[-2], current_charts[-1]
+        return '', -2
+
     def new_charts_account(self, code):
-        return ''
+        code = code.strip()
+        if code == '':
+            return '', -1
+        system_class = self.__class__
+        if ('_charts_account_cache' not in system_class.__dict__) or (len(system_class._charts_account_cache) > self.CHARTS_CACHE_SIZE):
+            system_class._charts_account_cache = {}
+        if code not in system_class._charts_account_cache:
+            system_class._charts_account_cache[code] = self._new_charts_account(code)
+        return system_class._charts_account_cache[code]
 
     def _create_custom_for_profit(self, year, custom, val_profit):
         from django.db.models import Q
@@ -179,7 +232,7 @@ class DefaultSystemAccounting(object):
         sum_third = {}
         entry_lines = []
         end_desig = _("Fiscal year closing - Third")
-        for data_line in EntryLineAccount.objects.filter(account__code__regex=self.get_third_mask(), account__year=year).values('account', 'third').annotate(data_sum=Sum('amount')):
+        for data_line in EntryLineAccount.objects.filter(account__is_third_code=True, account__year=year).values('account', 'third').annotate(data_sum=Sum('amount')):
             if abs(data_line['data_sum']) > 0.0001:
                 entry_lines.append((data_line['data_sum'], data_line['account'], data_line['third']))
                 if data_line['account'] not in sum_third.keys():
@@ -187,21 +240,9 @@ class DefaultSystemAccounting(object):
                 sum_third[data_line['account']] += data_line['data_sum']
         if len(sum_third) > 0:
             new_entry = EntryAccount.objects.create(year=year, journal_id=5, designation=end_desig, date_value=year.end)
-            for entry_line in entry_lines:
-                new_line = EntryLineAccount()
-                new_line.entry = new_entry
-                new_line.amount = -1 * entry_line[0]
-                new_line.account_id = entry_line[1]
-                if entry_line[2] is not None:
-                    new_line.third_id = entry_line[2]
-                new_line.save()
-            for account_id, value in sum_third.items():
-                new_line = EntryLineAccount()
-                new_line.entry = new_entry
-                new_line.account_id = account_id
-                new_line.amount = value
-                new_line.third = None
-                new_line.save()
+            new_lines = [EntryLineAccount(entry=new_entry, amount=-1 * amount, account_id=account_id, third_id=third_id) for amount, account_id, third_id in entry_lines]
+            new_lines.extend([EntryLineAccount(entry=new_entry, amount=value, account_id=account_id, third_id=None) for account_id, value in sum_third.items()])
+            new_entry.add_entry_lines(new_lines)
             new_entry.closed()
 
     def finalize_year(self, year):
@@ -210,23 +251,26 @@ class DefaultSystemAccounting(object):
         return
 
     def _create_report_lastyearresult(self, year, import_result):
-        from diacamma.accounting.models import EntryAccount
+        from diacamma.accounting.models import EntryAccount, EntryLineAccount, ChartsAccountBalance
+        from django.db.models.aggregates import Sum
         end_desig = _("Retained earnings - Balance sheet")
         new_entry = EntryAccount.objects.create(year=year, journal_id=1, designation=end_desig, date_value=year.begin)
-        for charts_account in year.last_fiscalyear.chartsaccount_set.filter(type_of_account__in=(0, 1, 2)):
-            code = charts_account.code
-            name = charts_account.name
-            new_entry.add_entry_line(charts_account.get_current_validated(), code, name)
+        balances = [data_line for data_line in ChartsAccountBalance.objects.filter(account__year=year.last_fiscalyear, account__type_of_account__in=(0, 1, 2), is_close=True).order_by('account__code').values('account__code', 'account__name').annotate(data_sum=Sum('amount'))
+                    if abs(data_line['data_sum']) > 0.0001]
+        account_ids = year.getorcreate_chartaccounts([(data_line['account__code'], data_line['account__name']) for data_line in balances])
+        new_entry.add_entry_lines([EntryLineAccount(entry=new_entry, account_id=account_ids[data_line['account__code']], amount=data_line['data_sum']) for data_line in balances])
         new_entry.closed()
 
     def _create_report_third(self, year):
-        from diacamma.accounting.models import EntryAccount
-        last_entry_account = list(year.last_fiscalyear.entryaccount_set.filter(journal__id=5).order_by('num'))[-1]
+        from diacamma.accounting.models import EntryAccount, EntryLineAccount
+        last_entry_account = year.last_fiscalyear.entryaccount_set.filter(journal__id=5).order_by('num').last()
         end_desig = _("Retained earnings - Third party debt")
         new_entry = EntryAccount.objects.create(year=year, journal_id=1, designation=end_desig, date_value=year.begin)
-        for entry_line in last_entry_account.entrylineaccount_set.all():
-            if re.match(self.get_general_mask(), entry_line.account.code):
-                new_entry.add_entry_line(-1 * entry_line.amount, entry_line.account.code, entry_line.account.name, entry_line.third)
+        third_lines = [data_line for data_line in last_entry_account.entrylineaccount_set.order_by('id').values('account__code', 'account__name', 'third_id', 'amount')
+                       if (abs(data_line['amount']) > 0.0001) and self.match_mask(self.get_general_mask(), data_line['account__code'])]
+        account_ids = year.getorcreate_chartaccounts([(data_line['account__code'], data_line['account__name']) for data_line in third_lines])
+        new_entry.add_entry_lines([EntryLineAccount(entry=new_entry, account_id=account_ids[data_line['account__code']], third_id=data_line['third_id'], amount=-1 * data_line['amount'])
+                                   for data_line in third_lines])
         new_entry.closed()
 
     def import_lastyear(self, year, import_result):
@@ -234,5 +278,5 @@ class DefaultSystemAccounting(object):
         self._create_report_third(year)
         return
 
-    def get_export_xmlfiles(self):
+    def get_export_xsdfile(self):
         return None
@@ -18,7 +18,6 @@ You should have received a copy of the GNU General Public License
 along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 from __future__ import unicode_literals
-import re
 
 from diacamma.accounting.system.default import DefaultSystemAccounting
 from os.path import dirname, join
@@ -220,12 +219,7 @@ GENERAL_CHARTS_ACCOUNT = [
 
 
 def find_charts(code):
-    current_charts = None
-    for chart_item in GENERAL_CHARTS_ACCOUNT:
-        if (chart_item[0] <= code) and (code <= chart_item[1]):
-            current_charts = chart_item
-            break
-    return current_charts
+    return FrenchSystemAcounting().find_charts(code)
 
 
 class FrenchSystemAcounting(DefaultSystemAccounting):
@@ -233,6 +227,9 @@ class FrenchSystemAcounting(DefaultSystemAccounting):
     NEGATIF_ACCOUNT = "129"
     POSITIF_ACCOUNT = "120"
 
+    def get_general_charts(self):
+        return GENERAL_CHARTS_ACCOUNT
+
     def get_general_mask(self):
         return GENERAL_MASK
 
@@ -266,17 +263,5 @@ class FrenchSystemAcounting(DefaultSystemAccounting):
     def get_annexe_mask(self):
         return r'^8[0-9][0-9][0-9a-zA-Z]*$'
 
-    def new_charts_account(self, code):
-        code = code.strip()
-        if code == '':
-            return '', -1
-        pattern = re.compile(GENERAL_MASK)
-        if pattern.match(code):
-            current_charts = find_charts(code)
-            if current_charts is not None:
-                return current_charts[2], current_charts[3]
-        return '', -2
-
-    def get_export_xmlfiles(self):
-        file_path = dirname(__file__)
-        return (join(file_path, 'french_accountexport.xml'), join(file_path, 'french_fichedescriptive_6709.xsd'))
+    def get_export_xsdfile(self):
+        return join(dirname(__file__), 'french_fichedescriptive_6709.xsd')
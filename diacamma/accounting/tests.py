@@ -33,7 +33,7 @@ from lucterios.framework.test import LucteriosTest
 from lucterios.framework.filetools import get_user_dir
 from lucterios.CORE.views import StatusMenu
 
-from diacamma.accounting.views import ThirdList, ThirdAdd, ThirdSave, ThirdShow, AccountThirdAddModify, AccountThirdDel, ThirdListing, ThirdDisable,\
+from diacamma.accounting.views import ThirdList, ThirdAdd, ThirdSave, ThirdShow, AccountThirdAddModify, AccountThirdDel, ThirdListing, ThirdDisable, ThirdEnable,\
     ThirdEdit
 from diacamma.accounting.views_admin import Configuration, JournalAddModify, JournalDel, FiscalYearAddModify, FiscalYearActive, FiscalYearDel
 from diacamma.accounting.views_other import ModelEntryList, ModelEntryAddModify, ModelLineEntryAddModify
@@ -482,6 +482,11 @@ class ThirdTest(LucteriosTest):
 
         self.factory.xfer = ThirdDisable()
         self.call('/diacamma.accounting/thirdDisable', {'limit_date': '2015-02-18'}, False)
+        self.assert_observer('core.dialogbox', 'diacamma.accounting', 'thirdDisable')
+        self.assert_xml_equal('TEXT', 'Do you want to disable 3 thirds without activity after this date?')
+
+        self.factory.xfer = ThirdDisable()
+        self.call('/diacamma.accounting/thirdDisable', {'limit_date': '2015-02-18', 'CONFIRME': 'YES'}, False)
         self.assert_observer('core.acknowledge', 'diacamma.accounting', 'thirdDisable')
 
         self.factory.xfer = ThirdList()
@@ -489,6 +494,20 @@ class ThirdTest(LucteriosTest):
         self.assert_observer('core.custom', 'diacamma.accounting', 'thirdListing')
         self.assert_count_equal('COMPONENTS/GRID[@name="third"]/RECORD', 4)
 
+        self.factory.xfer = ThirdEnable()
+        self.call('/diacamma.accounting/thirdEnable', {'limit_date': '2015-02-18'}, False)
+        self.assert_observer('core.dialogbox', 'diacamma.accounting', 'thirdEnable')
+        self.assert_xml_equal('TEXT', 'Do you want to enable 0 disabled thirds with activity after this date?')
+
+        self.factory.xfer = ThirdEnable()
+        self.call('/diacamma.accounting/thirdEnable', {'limit_date': '2015-02-16', 'CONFIRME': 'YES'}, False)
+        self.assert_observer('core.acknowledge', 'diacamma.accounting', 'thirdEnable')
+
+        self.factory.xfer = ThirdList()
+        self.call('/diacamma.accounting/thirdListing', {'show_filter': '1'}, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'thirdListing')
+        self.assert_count_equal('COMPONENTS/GRID[@name="third"]/RECORD', 5)
+
     def test_with_customize(self):
         CustomField.objects.create(modelname='accounting.Third', name='categorie', kind=4, args="{'list':['---','petit','moyen','gros']}")
         CustomField.objects.create(modelname='accounting.Third', name='value', kind=1, args="{'min':0,'max':100}")
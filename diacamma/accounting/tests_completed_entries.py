@@ -30,21 +30,27 @@ from django.utils import six, formats
 from lucterios.framework.test import LucteriosTest
 from lucterios.framework.xfergraphic import XferContainerAcknowledge
 from lucterios.framework.filetools import get_user_dir, get_user_path
+from lucterios.framework.xfercomponents import GRID_PAGE
 
 from diacamma.accounting.views_entries import EntryAccountList, EntryAccountListing, \
     EntryAccountEdit, EntryAccountShow, EntryAccountClose, \
     EntryAccountCostAccounting, EntryAccountSearch
-from diacamma.accounting.test_tools import default_compta, initial_thirds, fill_entries
+from diacamma.accounting.test_tools import default_compta, initial_thirds, fill_entries, add_entry
 from lucterios.CORE.views import StatusMenu
 from base64 import b64decode
 from datetime import date
 from diacamma.accounting.views_other import CostAccountingList, \
     CostAccountingClose, CostAccountingAddModify
 from diacamma.accounting.views_reports import FiscalYearBalanceSheet,\
-    FiscalYearIncomeStatement, FiscalYearLedger, FiscalYearTrialBalance
+    FiscalYearIncomeStatement, FiscalYearLedger, FiscalYearTrialBalance,\
+    CostAccountingIncomeStatement, CostAccountingLedger, CostAccountingTrialBalance,\
+    CostAccountingReportPrint
 from diacamma.accounting.views_admin import FiscalYearExport
-from os.path import exists
-from diacamma.accounting.models import FiscalYear
+from os.path import exists, join
+from io import StringIO
+from django.db.models.aggregates import Sum
+from lucterios.framework.error import LucteriosException
+from diacamma.accounting.models import FiscalYear, EntryLineAccount, EntryAccount, EntryExchange, Third
 
 
 class CompletedEntryTest(LucteriosTest):
@@ -513,6 +519,24 @@ class CompletedEntryTest(LucteriosTest):
         self.assert_observer('core.custom', 'diacamma.accounting', 'fiscalYearLedger')
         self._check_result_with_filter()
 
+    def test_fiscalyear_ledger_paging(self):
+        for third_id, designation in ((7, 'vente 4 a'), (3, 'vente 4 b'), (6, 'vente 4 c'), (4, 'vente 4 d'), (5, 'vente 4 e')):
+            add_entry(1, 3, '2015-02-25', designation, '-1|10|0|5.000000|None|\n-2|1|%d|5.000000|None|' % third_id)
+        designations = []
+        old_lines_by_page = FiscalYearLedger.lines_by_page
+        FiscalYearLedger.lines_by_page = 4
+        try:
+            for page_num in range(3):
+                self.factory.xfer = FiscalYearLedger()
+                self.call('/diacamma.accounting/fiscalYearLedger', {'filtercode': '411', GRID_PAGE + 'report_1': page_num}, False)
+                self.assert_observer('core.custom', 'diacamma.accounting', 'fiscalYearLedger')
+                designations.extend([value.text for value in self.response_xml.xpath('COMPONENTS/GRID[@name="report_1"]/RECORD/VALUE[@name="entry.designation"]')
+                                     if (value.text is not None) and value.text.startswith(('vente', 'regement'))])
+        finally:
+            FiscalYearLedger.lines_by_page = old_lines_by_page
+        self.assertEqual(sorted(designations), ['regement vente 1', 'vente 1', 'vente 2', 'vente 3',
+                                                'vente 4 a', 'vente 4 b', 'vente 4 c', 'vente 4 d', 'vente 4 e'])
+
     def test_fiscalyear_trialbalance(self):
         self.factory.xfer = FiscalYearTrialBalance()
         self.call('/diacamma.accounting/fiscalYearTrialBalance', {}, False)
@@ -525,10 +549,98 @@ class CompletedEntryTest(LucteriosTest):
         self.assert_observer('core.custom', 'diacamma.accounting', 'fiscalYearTrialBalance')
         self._check_result_with_filter()
 
+    def test_costaccounting_reports(self):
+        for report_class, report_name in ((CostAccountingIncomeStatement, 'costAccountingIncomeStatement'),
+                                          (CostAccountingLedger, 'costAccountingLedger'),
+                                          (CostAccountingTrialBalance, 'costAccountingTrialBalance')):
+            for _call_idx in range(2):
+                self.factory.xfer = report_class()
+                self.call('/diacamma.accounting/%s' % report_name, {'costaccounting': '2'}, False)
+                self.assert_observer('core.custom', 'diacamma.accounting', report_name)
+                self.assert_count_equal('COMPONENTS/GRID[@name="report_2"]', 1)
+                self.assert_xml_equal("COMPONENTS/LABELFORM[@name='name']", 'open')
+
+            self.factory.xfer = CostAccountingReportPrint()
+            self.call('/diacamma.accounting/costAccountingReportPrint',
+                      {'costaccounting': '2', 'classname': report_class.__name__, 'PRINT_MODE': 4}, False)
+            self.assert_observer('core.print', 'diacamma.accounting', 'costAccountingReportPrint')
+
+    def test_report_cache_refresh(self):
+        self.factory.xfer = FiscalYearLedger()
+        self.call('/diacamma.accounting/fiscalYearLedger', {'filtercode': '607'}, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'fiscalYearLedger')
+        self.assert_count_equal('COMPONENTS/GRID[@name="report_1"]/RECORD', 0)
+
+        add_entry(1, 2, '2015-02-25', 'depense 4', '-1|13|0|10.000000|None|\n-2|4|1|10.000000|None|')
+        self.factory.xfer = FiscalYearLedger()
+        self.call('/diacamma.accounting/fiscalYearLedger', {'filtercode': '607'}, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'fiscalYearLedger')
+        self.assert_count_equal('COMPONENTS/GRID[@name="report_1"]/RECORD', 4)
+
+        renamed_xpath = 'COMPONENTS/GRID[@name="report_1"]/RECORD/VALUE[@name="entry.designation"][contains(text(), "Renamed")]'
+        self.factory.xfer = FiscalYearLedger()
+        self.call('/diacamma.accounting/fiscalYearLedger', {'filtercode': '401'}, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'fiscalYearLedger')
+        self.assert_count_equal(renamed_xpath, 0)
+
+        contact = Third.objects.get(id=1).contact.get_final_child()
+        if hasattr(contact, 'lastname'):
+            contact.lastname = 'Renamed'
+        else:
+            contact.name = 'Renamed'
+        contact.save()
+        self.factory.xfer = FiscalYearLedger()
+        self.call('/diacamma.accounting/fiscalYearLedger', {'filtercode': '401'}, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'fiscalYearLedger')
+        self.assert_count_equal(renamed_xpath, 1)
+
+    def _get_line_sums(self, year_id, only_closed=False):
+        lines = EntryLineAccount.objects.filter(account__year_id=year_id)
+        if only_closed:
+            lines = lines.filter(entry__close=True)
+        return dict([((data_line['account__code'], data_line['third']), round(data_line['data_sum'], 3))
+                     for data_line in lines.order_by().values('account__code', 'third').annotate(data_sum=Sum('amount'))])
+
+    def test_exchange_entries(self):
+        year_csv = FiscalYear.objects.create(begin='2016-01-01', end='2016-12-31', status=0, last_fiscalyear_id=1)
+        year_fec = FiscalYear.objects.create(begin='2017-01-01', end='2017-12-31', status=0, last_fiscalyear_id=year_csv.id)
+        year = FiscalYear.objects.get(id=1)
+
+        csv_content = "".join(EntryExchange(year, 'csv').export_entries()).replace('2015-', '2016-')
+        self.assertEqual(year_csv.import_entries(StringIO(csv_content), 'csv'), 11)
+        self.assertEqual(self._get_line_sums(year_csv.id), self._get_line_sums(1))
+
+        fec_content = "".join(EntryExchange(year, 'fec').export_entries()).replace('|2015', '|2017')
+        self.assertEqual(year_fec.import_entries(StringIO(fec_content), 'fec'), 7)
+        self.assertEqual(self._get_line_sums(year_fec.id), self._get_line_sums(1, True))
+
+    def test_exchange_entries_errors(self):
+        year = FiscalYear.objects.create(begin='2016-01-01', end='2016-12-31', status=0, last_fiscalyear_id=1)
+        header = "journal;entry;date_value;date_entry;designation;code;name;third;third_name;reference;debit;credit;link\n"
+        for bad_content in ("2;1;2016-02-01;;test;602;602;;;;10.00;0.00;\n2;1;2016-02-01;;test;401;401;401;Minimum;;0.00;12.00;\n",
+                            "2;1;2015-02-01;;test;602;602;;;;10.00;0.00;\n2;1;2015-02-01;;test;401;401;401;Minimum;;0.00;10.00;\n",
+                            "2;1;2016-02-01;;test;602;602;;;;1O.00;0.00;\n2;1;2016-02-01;;test;401;401;401;Minimum;;0.00;10.00;\n",
+                            "2;1;2016-02-01;;test;602;602;;;;10.00;0.00;\n2;1;2016-02-01;;test;401;401;401;Nobody;;0.00;10.00;\n",
+                            "2;1;2016-02-01;;test;602;602;;;;10.00;0.00;\n2;1;2016-02-01;;test;401;401;999;;;0.00;10.00;\n"):
+            with self.assertRaises(LucteriosException):
+                year.import_entries(StringIO(header + bad_content), 'csv')
+            self.assertEqual(EntryAccount.objects.filter(year=year).count(), 0)
+
+        self.assertEqual(year.import_entries(StringIO(header + "2;1;2016-02-01;;test;602;602;;;;10.00;0.00;\n2;1;2016-02-01;;test;401;401;401;Minimum;;0.00;10.00;\n"), 'csv'), 1)
+        self.assertEqual(EntryLineAccount.objects.get(entry__year=year, account__code='401').third_id, 4)
+
     def test_export(self):
         self.assertFalse(
             exists(get_user_path('accounting', 'fiscalyear_export_1.xml')))
         self.factory.xfer = FiscalYearExport()
         self.call('/diacamma.accounting/fiscalYearExport', {}, False)
         self.assert_observer('core.custom', 'diacamma.accounting', 'fiscalYearExport')
+        self.assert_xml_equal('COMPONENTS/LABELFORM[@name="nb_entries"]', '7/7 entries exported')
         self.assertTrue(exists(get_user_path('accounting', 'fiscalyear_export_1.xml')))
+
+    def test_export_zero_line(self):
+        EntryLineAccount.objects.create(entry_id=1, account_id=5, amount=0)
+        self.assertEqual(FiscalYear.objects.get(id=1).get_xml_export(), join('accounting', 'fiscalyear_export_1.xml'))
+        with open(get_user_path('accounting', 'fiscalyear_export_1.xml'), 'r', encoding='utf-8') as xml_file:
+            xml_content = xml_file.read()
+        self.assertTrue('<Debit>0</Debit></ligne>' in xml_content)
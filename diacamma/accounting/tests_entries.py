@@ -27,6 +27,8 @@ from shutil import rmtree
 from datetime import date
 
 from django.utils import formats
+from django.db import connection
+from django.db.models.aggregates import Sum
 
 from lucterios.framework.test import LucteriosTest
 from lucterios.framework.xfergraphic import XferContainerAcknowledge
@@ -37,9 +39,10 @@ from diacamma.accounting.views_entries import EntryAccountList, \
     EntryLineAccountEdit, EntryAccountValidate, EntryAccountClose, \
     EntryAccountReverse, EntryAccountCreateLinked, EntryAccountLink, \
     EntryAccountDel, EntryAccountOpenFromLine, EntryAccountShow, \
-    EntryLineAccountDel, EntryAccountUnlock
-from diacamma.accounting.test_tools import default_compta, initial_thirds
-from diacamma.accounting.models import EntryAccount
+    EntryLineAccountDel, EntryAccountUnlock, EntryAccountSearch
+from diacamma.accounting.test_tools import default_compta, initial_thirds, add_entry
+from diacamma.accounting.models import EntryAccount, EntryLineAccount, ChartsAccountBalance, ChartsAccountMonthBalance, ChartsAccount
+from lucterios.contacts.models import LegalEntity
 
 
 class EntryTest(LucteriosTest):
@@ -823,3 +826,110 @@ class EntryTest(LucteriosTest):
         self.call('/diacamma.accounting/entryLineAccountAdd', {'year': '1', 'journal': '1', 'entryaccount': '1', 'num_cpt_txt': '401',
                                                                'num_cpt': '4', 'third': 0, 'debit_val': '0.0', 'credit_val': '152.34'}, False)
         self.assert_observer('core.acknowledge', 'diacamma.accounting', 'entryLineAccountAdd')
+
+    def _check_search_index(self, text_counts, amount_counts):
+        for use_fts in (None, False):
+            connection.accounting_search_fts = use_fts
+            try:
+                for search_text, nb_lines in text_counts:
+                    self.assertEqual(EntryLineAccount.objects.filter(searchindex__content__icontains=search_text).count(), nb_lines, search_text)
+            finally:
+                connection.accounting_search_fts = None
+        for amount, nb_lines in amount_counts:
+            self.assertEqual(EntryLineAccount.objects.filter(searchindex__abs_amount=amount).count(), nb_lines, amount)
+
+    def test_search_index(self):
+        entry = add_entry(1, 2, '2015-02-14', 'depense cadeau', '-1|12|0|63.940000|None|\n-2|4|4|63.940000|facture 987|')
+        add_entry(1, 2, '2015-02-15', 'depense fleur', '-1|13|0|12.500000|None|\n-2|4|4|12.500000|None|')
+        self._check_search_index([('cadeau', 2), ('CADEAU', 2), ('fleur', 2), ('depense', 4), ('facture 987', 1), ('minimum', 2), ('ca', 2)],
+                                 [(63.94, 2), (12.5, 2)])
+
+        entry.designation = 'depense bouquet'
+        entry.save()
+        self._check_search_index([('cadeau', 0), ('bouquet', 2), ('depense', 4)], [(63.94, 2)])
+
+        line = EntryLineAccount.objects.get(reference='facture 987')
+        line.reference = 'facture 654'
+        line.amount = -50.0
+        line.save()
+        self._check_search_index([('facture 987', 0), ('facture 654', 1), ('bouquet', 2)], [(63.94, 1), (50.0, 1)])
+
+        legal = LegalEntity.objects.get(id=7)
+        legal.name = 'Medium'
+        legal.save()
+        self._check_search_index([('minimum', 0), ('medium', 2)], [])
+
+        line.delete()
+        self._check_search_index([('facture 654', 0), ('bouquet', 1), ('medium', 1)], [(50.0, 0), (63.94, 1)])
+
+        self.factory.xfer = EntryAccountSearch()
+        self.call('/diacamma.accounting/entryAccountSearch',
+                  {'year': '1', 'journal': '-1', 'filter': '0', 'CRITERIA': 'year||8||1//entrylineaccount_set.searchindex||5||bouquet'}, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'entryAccountSearch')
+        self.assert_count_equal('COMPONENTS/GRID[@name="entryaccount"]/RECORD', 1)
+
+        self.factory.xfer = EntryAccountSearch()
+        self.call('/diacamma.accounting/entryAccountSearch',
+                  {'year': '1', 'journal': '-1', 'filter': '0', 'CRITERIA': 'year||8||1//entrylineaccount_set.amount||4||20'}, False)
+        self.assert_observer('core.custom', 'diacamma.accounting', 'entryAccountSearch')
+        self.assert_count_equal('COMPONENTS/GRID[@name="entryaccount"]/RECORD', 1)
+
+    def _check_balances(self):
+        expected_balances = {}
+        expected_months = {}
+        for data_line in EntryLineAccount.objects.order_by().values('account', 'third', 'entry__journal', 'entry__close', 'entry__date_value').annotate(data_sum=Sum('amount')):
+            key = (data_line['account'], data_line['third'], data_line['entry__journal'] == 1, data_line['entry__close'])
+            expected_balances[key] = expected_balances.get(key, 0) + data_line['data_sum']
+            month_key = key + (data_line['entry__date_value'].replace(day=1),)
+            expected_months[month_key] = expected_months.get(month_key, 0) + data_line['data_sum']
+        current_balances = {}
+        for balance in ChartsAccountBalance.objects.all():
+            key = (balance.account_id, balance.third_id, balance.is_lastyear, balance.is_close)
+            self.assertNotIn(key, current_balances.keys())
+            current_balances[key] = balance.amount
+        current_months = {}
+        for balance in ChartsAccountMonthBalance.objects.all():
+            key = (balance.account_id, balance.third_id, balance.is_lastyear, balance.is_close, balance.month)
+            self.assertNotIn(key, current_months.keys())
+            current_months[key] = balance.amount
+        for expected, current in ((expected_balances, current_balances), (expected_months, current_months)):
+            for key in set(expected.keys()) | set(current.keys()):
+                self.assertAlmostEqual(expected.get(key, 0), current.get(key, 0), 4, key)
+
+    def test_balance_tables(self):
+        self._check_balances()
+        entry = add_entry(1, 2, '2015-02-14', 'depense 1', '-1|12|0|63.940000|None|\n-2|4|4|63.940000|None|')
+        add_entry(1, 1, '2015-01-01', 'report', '-1|5|0|-100.000000|None|\n-2|2|0|100.000000|None|')
+        add_entry(1, 2, '2015-03-10', 'depense 2', '-1|13|0|12.500000|None|\n-2|4|4|12.500000|None|')
+        self.assertEqual(ChartsAccountBalance.objects.filter(account__code='401', third_id=4).count(), 1)
+        self._check_balances()
+
+        line = EntryLineAccount.objects.get(entry=entry, account__code='602')
+        line.amount = 80.0
+        line.save()
+        self._check_balances()
+
+        line.account = ChartsAccount.objects.get(year_id=1, code='604')
+        line.save()
+        self._check_balances()
+
+        third_line = EntryLineAccount.objects.get(entry=entry, account__code='401')
+        third_line.third_id = 2
+        third_line.amount = 80.0
+        third_line.save()
+        self._check_balances()
+
+        entry.closed()
+        self._check_balances()
+
+        EntryLineAccount.objects.get(entry__designation='depense 2', account__code='604').delete()
+        self._check_balances()
+
+        entry.date_value = '2015-04-20'
+        entry.save()
+        self._check_balances()
+
+        ChartsAccountMonthBalance.objects.all().delete()
+        ChartsAccountBalance.objects.update(amount=0)
+        ChartsAccountBalance.rebuild()
+        self._check_balances()
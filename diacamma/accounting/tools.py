@@ -23,19 +23,119 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from __future__ import unicode_literals
+from uuid import uuid4
+import threading
+import logging
 
-from django.utils.translation import ugettext_lazy as _
+from lxml import etree
+from django.core.signals import request_started, request_finished
+from django.db import models
+from django.db.models import Case, When, Value, CharField
+from django.db.models.lookups import IContains
+from django.db.models.functions import Length
+from django.utils.translation import ugettext_lazy as _, get_language
+from django.utils import six
 
+from lucterios.CORE.models import Parameter
 from lucterios.CORE.parameters import Params
 
 from diacamma.accounting.system import get_accounting_system
 
 
+class FinancialParams(object):
+
+    VERSION_PARAM = 'accounting-params-version'
+
+    PARAM_NAMES = ('accounting-devise', 'accounting-devise-prec', 'accounting-sizecode', 'accounting-system', 'invoice-vat-mode')
+
+    _process_version = None
+
+    _snapshot = threading.local()
+
+    _finlock = threading.RLock()
+
+    @classmethod
+    def begin(cls):
+        cls._snapshot.values = None
+        cls._snapshot.active = True
+
+    @classmethod
+    def end(cls):
+        cls._snapshot.values = None
+        cls._snapshot.active = False
+
+    @classmethod
+    def _read_version(cls):
+        for value in Parameter.objects.filter(name=cls.VERSION_PARAM).values_list('value', flat=True):
+            return value
+        return None
+
+    @classmethod
+    def check_version(cls):
+        if not getattr(cls._snapshot, 'active', False):
+            return None
+        if cls._snapshot.values is None:
+            version = cls._read_version()
+            cls._finlock.acquire()
+            try:
+                if version != cls._process_version:
+                    Params.clear()
+                    clear_system_account()
+                    cls._process_version = version
+            finally:
+                cls._finlock.release()
+            cls._snapshot.values = {}
+        return cls._snapshot.values
+
+    @classmethod
+    def get_version(cls):
+        if cls.check_version() is None:
+            return cls._read_version()
+        return cls._process_version
+
+    @classmethod
+    def getvalue(cls, name):
+        values = cls.check_version()
+        if values is None:
+            return Params.getvalue(name)
+        if name not in values.keys():
+            values[name] = Params.getvalue(name)
+        return values[name]
+
+    @classmethod
+    def increase_version(cls, params):
+        if len(set(params) & set(cls.PARAM_NAMES)) > 0:
+            version = uuid4().hex
+            Parameter.objects.filter(name=cls.VERSION_PARAM).update(value=version)
+            cls._finlock.acquire()
+            try:
+                Params.clear()
+                clear_system_account()
+                cls._process_version = version
+            finally:
+                cls._finlock.release()
+            if getattr(cls._snapshot, 'active', False):
+                cls._snapshot.values = None
+
+
+def begin_financial_params(sender, **kwargs):
+    FinancialParams.begin()
+
+
+def end_financial_params(sender, **kwargs):
+    FinancialParams.end()
+
+
+request_started.connect(begin_financial_params)
+request_finished.connect(end_financial_params)
+
+
 def current_system_account():
     import sys
+    FinancialParams.check_version()
     current_module = sys.modules[__name__]
     if not hasattr(current_module, 'SYSTEM_ACCOUNT_CACHE'):
-        setattr(current_module, 'SYSTEM_ACCOUNT_CACHE', get_accounting_system(Params.getvalue("accounting-system")))
+        setattr(current_module, 'SYSTEM_ACCOUNT_CACHE', get_accounting_system(FinancialParams.getvalue("accounting-system")))
     return current_module.SYSTEM_ACCOUNT_CACHE
 
 
@@ -47,6 +147,117 @@ def clear_system_account():
         del current_module.SYSTEM_ACCOUNT_CACHE
 
 
+CODE_CLASS_MASKS = (('is_cash_code', 'get_cash_mask'), ('is_third_code', 'get_third_mask'), ('is_customer_code', 'get_customer_mask'),
+                    ('is_revenue_code', 'get_revenue_mask'), ('is_expense_code', 'get_expence_mask'), ('is_annexe_code', 'get_annexe_mask'))
+
+
+def get_code_classes(code, fields):
+    system_account = current_system_account()
+    code_classes = {}
+    for field_name, mask_name in CODE_CLASS_MASKS:
+        if field_name in fields:
+            code_classes[field_name] = system_account.match_mask(getattr(system_account, mask_name)(), code)
+    return code_classes
+
+
+def refresh_code_classes(model, fields):
+    codes_by_classes = {}
+    for code in model.objects.order_by('code').values_list('code', flat=True).distinct():
+        code_classes = tuple(sorted(get_code_classes(code, fields).items()))
+        if code_classes not in codes_by_classes.keys():
+            codes_by_classes[code_classes] = []
+        codes_by_classes[code_classes].append(code)
+    for code_classes, codes in codes_by_classes.items():
+        for code_idx in range(0, len(codes), 500):
+            model.objects.filter(code__in=codes[code_idx:code_idx + 500]).update(**dict(code_classes))
+
+
+LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def convert_to_letter(index):
+    res = ''
+    while index >= 26:
+        div, mod = divmod(index, 26)
+        res = LETTERS[mod] + res
+        index = int(div) - 1
+    return LETTERS[index] + res
+
+
+def convert_from_letter(letter):
+    index = -1
+    for char in letter:
+        index = (index + 1) * 26 + LETTERS.index(char)
+    return index
+
+
+def get_next_letter(query, nb_previous):
+    last_letter = query.exclude(letter='').order_by(Length('letter').desc(), '-letter').values_list('letter', flat=True).first()
+    if last_letter is not None:
+        nb_previous = max(nb_previous, convert_from_letter(last_letter) + 1)
+    return convert_to_letter(nb_previous)
+
+
+def _update_letters(model, letters):
+    items = list(letters.items())
+    for item_idx in range(0, len(items), 250):
+        sub_items = items[item_idx:item_idx + 250]
+        model.objects.filter(id__in=[item_id for item_id, _letter in sub_items]).update(letter=Case(*[When(id=item_id, then=Value(letter)) for item_id, letter in sub_items],
+                                                                                                     output_field=CharField()))
+
+
+def refresh_link_letters(link_model, entry_model):
+    letters = {}
+    nb_previous = {}
+    for link_id, year_id in entry_model.objects.filter(link__isnull=False).order_by('link_id').values_list('link_id', 'year_id'):
+        if link_id not in letters.keys():
+            letters[link_id] = convert_to_letter(nb_previous.get(year_id, 0))
+        nb_previous[year_id] = nb_previous.get(year_id, 0) + 1
+    _update_letters(link_model, letters)
+
+
+def xml_file_validator(xml_path, xsd_file):
+    try:
+        schema = etree.XMLSchema(file=xsd_file)
+        for _event, element in etree.iterparse(xml_path, events=('end',), schema=schema):
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+        return None
+    except etree.XMLSyntaxError as xml_error:
+        return six.text_type(xml_error)
+
+
+SEARCH_FTS_TABLE = 'accounting_entrylinesearch_fts'
+
+
+def has_search_fts(connection):
+    if getattr(connection, 'accounting_search_fts', None) is None:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name=%s", [SEARCH_FTS_TABLE])
+            connection.accounting_search_fts = cursor.fetchone() is not None
+        if not connection.accounting_search_fts:
+            logging.getLogger('diacamma.accounting').warning("table %s missing: entry lines are searched with a plain LIKE scan", SEARCH_FTS_TABLE)
+    return connection.accounting_search_fts
+
+
+class SearchContains(IContains):
+
+    def as_sqlite(self, compiler, connection):
+        search_text = six.text_type(self.rhs)
+        if (len(search_text) >= 3) and has_search_fts(connection):
+            return '%s."line_id" IN (SELECT rowid FROM %s WHERE %s MATCH %%s)' % (compiler.quote_name_unless_alias(self.lhs.alias), SEARCH_FTS_TABLE, SEARCH_FTS_TABLE), \
+                ['"%s"' % search_text.replace('"', '""')]
+        return self.as_sql(compiler, connection)
+
+
+class SearchTextField(models.TextField):
+    pass
+
+
+SearchTextField.register_lookup(SearchContains)
+
+
 def get_amount_sum(val):
     if val['amount__sum'] is None:
         return 0
@@ -55,7 +266,7 @@ def get_amount_sum(val):
 
 
 def currency_round(amount):
-    currency_decimal = Params.getvalue("accounting-devise-prec")
+    currency_decimal = FinancialParams.getvalue("accounting-devise-prec")
     try:
         return round(float(amount), currency_decimal)
     except:
@@ -64,7 +275,7 @@ def currency_round(amount):
 
 def correct_accounting_code(code):
     if current_system_account().has_minium_code_size():
-        code_size = Params.getvalue("accounting-sizecode")
+        code_size = FinancialParams.getvalue("accounting-sizecode")
         while len(code) > code_size and code[-1] == '0':
             code = code[:-1]
         while len(code) < code_size:
@@ -72,7 +283,7 @@ def correct_accounting_code(code):
     return code
 
 
-def format_devise(amount, mode):
+class DeviseFormatter(object):
 
     # mode 0 25.45 => 25,45€ / -25.45 =>
 
@@ -85,42 +296,62 @@ def format_devise(amount, mode):
     # mode 5 25.45 => 25,45€ / -25.45 => -25.45€
     # mode 6 25.45 => {[font color="green"]}25,45€{[/font]}     /
     # -25.45 => {[font color="blue"]}25,45€{[/font]}
-    from decimal import InvalidOperation
-    result = ''
-    currency_short = Params.getvalue("accounting-devise")
-    currency_decimal = Params.getvalue("accounting-devise-prec")
-    currency_format = "%%0.%df" % currency_decimal
-    currency_epsilon = pow(10, -1 * currency_decimal - 1)
-    try:
-        if (amount is None) or (abs(amount) < currency_epsilon):
-            amount = 0
-    except InvalidOperation:
-        return "???"
-    if (abs(amount) >= currency_epsilon) or (mode in (1, 2, 6)):
-        if amount >= 0:
-            if mode in (2, 6):
-                result = '{[font color="green"]}'
-            if (mode == 1) or (mode == 2):
-                result = '%s%s: ' % (result, _('Credit'))
+
+    def __init__(self, mode, currency_decimal, currency_short):
+        self.mode = mode
+        self.currency_short = currency_short
+        self.currency_format = "%%0.%df" % currency_decimal
+        self.currency_epsilon = pow(10, -1 * currency_decimal - 1)
+        self.positif_prefix = ''
+        self.negatif_prefix = ''
+        self.suffix = ''
+        if mode in (2, 6):
+            self.positif_prefix = '{[font color="green"]}'
+            self.negatif_prefix = '{[font color="blue"]}'
+            self.suffix = '{[/font]}'
+        if mode in (1, 2):
+            self.positif_prefix = '%s%s: ' % (self.positif_prefix, _('Credit'))
+            self.negatif_prefix = '%s%s: ' % (self.negatif_prefix, _('Debit'))
+
+    def format(self, amount):
+        from decimal import InvalidOperation
+        try:
+            if (amount is None) or (abs(amount) < self.currency_epsilon):
+                amount = 0
+        except InvalidOperation:
+            return "???"
+        if self.mode == 3:
+            return self.currency_format % amount
+        if self.mode == 0:
+            if amount >= self.currency_epsilon:
+                return self.currency_format % abs(amount) + self.currency_short
+            return ''
+        if self.mode == 6:
+            if abs(amount) >= self.currency_epsilon:
+                amount_text = self.currency_format % abs(amount) + self.currency_short
+            else:
+                amount_text = ''
+        elif self.mode < 5:
+            amount_text = self.currency_format % abs(amount) + self.currency_short
         else:
-            if mode in (2, 6):
-                result = result + '{[font color="blue"]}'
-            if (mode == 1) or (mode == 2):
-                result = '%s%s: ' % (result, _('Debit'))
-    if mode == 3:
-        result = currency_format % amount
-    elif mode == 0:
-        if amount >= currency_epsilon:
-            result = currency_format % abs(amount) + currency_short
-    elif mode == 6:
-        if abs(amount) >= currency_epsilon:
-            result = result + currency_format % abs(amount) + currency_short
-    else:
-        if mode < 5:
-            amount_text = currency_format % abs(amount)
+            amount_text = self.currency_format % amount + self.currency_short
+        if amount >= 0:
+            return self.positif_prefix + amount_text + self.suffix
         else:
-            amount_text = currency_format % amount
-        result = result + amount_text + currency_short
-    if mode in (2, 6):
-        result = result + '{[/font]}'
-    return result
+            return self.negatif_prefix + amount_text + self.suffix
+
+
+DEVISE_FORMATTER_CACHE = {}
+
+
+def get_devise_formatter(mode):
+    currency_decimal = FinancialParams.getvalue("accounting-devise-prec")
+    currency_short = FinancialParams.getvalue("accounting-devise")
+    formatter_key = (mode, currency_decimal, currency_short, get_language())
+    if formatter_key not in DEVISE_FORMATTER_CACHE.keys():
+        DEVISE_FORMATTER_CACHE[formatter_key] = DeviseFormatter(mode, currency_decimal, currency_short)
+    return DEVISE_FORMATTER_CACHE[formatter_key]
+
+
+def format_devise(amount, mode):
+    return get_devise_formatter(mode).format(amount)
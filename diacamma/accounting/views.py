@@ -27,7 +27,7 @@ from datetime import timedelta, date
 
 from django.utils.translation import ugettext_lazy as _
 from django.db.models.query import QuerySet
-from django.db.models.functions import Concat
+from django.db.models.functions import Concat, Lower
 from django.db.models import Q, Value
 from django.utils import six
 
@@ -45,7 +45,7 @@ from lucterios.contacts.tools import ContactSelection
 from lucterios.contacts.models import AbstractContact
 
 from diacamma.accounting.models import Third, AccountThird, FiscalYear, \
-    EntryLineAccount, ModelLineEntry, EntryAccount, ChartsAccount
+    ModelLineEntry, EntryAccount, ChartsAccount
 from diacamma.accounting.views_admin import Configuration, add_year_info
 from diacamma.accounting.tools import correct_accounting_code,\
     current_system_account
@@ -62,6 +62,7 @@ class ThirdList(XferListEditor):
 
     def get_items_from_filter(self):
         items = self.model.objects.annotate(completename=Concat('contact__individual__lastname', Value(' '), 'contact__individual__firstname')).filter(self.filter)
+        items = items.annotate(sortname=Lower(Concat('contact__legalentity__name', 'completename')))
         sort_third = self.getparam('GRID_ORDER%third', '')
         sort_thirdbis = self.getparam('GRID_ORDER%third+', '')
         self.params['GRID_ORDER%third'] = ""
@@ -71,12 +72,14 @@ class ThirdList(XferListEditor):
             else:
                 sort_thirdbis = "-"
             self.params['GRID_ORDER%third+'] = sort_thirdbis
-        items = sorted(items, key=lambda t: six.text_type(t).lower(), reverse=sort_thirdbis.startswith('-'))
-        if self.getparam('show_filter', 0) == 2:
-            items = [item for item in items if abs(item.get_total()) > 0.0001]
-        res = QuerySet(model=Third)
-        res._result_cache = items
-        return res
+        if self.getparam('show_filter', 0) != 0:
+            items = items.annotate(balance_total=Third.get_total_expression())
+            if self.getparam('show_filter', 0) == 2:
+                items = items.filter(Q(balance_total__gt=0.0001) | Q(balance_total__lt=-0.0001))
+        if sort_thirdbis.startswith('-'):
+            return items.order_by('-sortname', '-id')
+        else:
+            return items.order_by('sortname', 'id')
 
     def fillresponse_header(self):
         contact_filter = self.getparam('filter', '')
@@ -114,13 +117,13 @@ class ThirdList(XferListEditor):
             q_individual = Q(completename__icontains=contact_filter)
             self.filter &= (q_legalentity | q_individual)
         if thirdtype == 1:
-            self.filter &= Q(accountthird__code__regex=current_system_account().get_customer_mask())
+            self.filter &= Q(id__in=AccountThird.objects.filter(code__regex=current_system_account().get_customer_mask()).values('third'))
         elif thirdtype == 2:
-            self.filter &= Q(accountthird__code__regex=current_system_account().get_provider_mask())
+            self.filter &= Q(id__in=AccountThird.objects.filter(code__regex=current_system_account().get_provider_mask()).values('third'))
         elif thirdtype == 3:
-            self.filter &= Q(accountthird__code__regex=current_system_account().get_societary_mask())
+            self.filter &= Q(id__in=AccountThird.objects.filter(code__regex=current_system_account().get_societary_mask()).values('third'))
         elif thirdtype == 4:
-            self.filter &= Q(accountthird__code__regex=current_system_account().get_employed_mask())
+            self.filter &= Q(id__in=AccountThird.objects.filter(code__regex=current_system_account().get_employed_mask()).values('third'))
 
 
 @ActionsManage.affect_list(_("Search"), "diacamma.accounting/images/thirds.png")
@@ -155,14 +158,15 @@ class ThirdSave(XferContainerAcknowledge):
         self.redirect_action(ThirdShow.get_action(), params={'third': self.item.id})
 
 
-@ActionsManage.affect_list(_('Disabled'), '')
-@MenuManage.describ('accounting.add_third')
-class ThirdDisable(XferContainerAcknowledge):
+class ThirdStatusChange(XferContainerAcknowledge):
     model = Third
     icon = "thirds.png"
-    caption = _("Disable third")
+    confirm_message = ''
 
-    def fillresponse(self, limit_date=''):
+    def get_thirds(self, limit_date):
+        return Third.objects.none()
+
+    def fillresponse(self, limit_date='', new_status=0):
         if limit_date == '':
             dlg = self.create_custom()
             img = XferCompImage('img')
@@ -178,12 +182,35 @@ class ThirdDisable(XferContainerAcknowledge):
             dlg.add_action(self.get_action(TITLE_OK, 'images/ok.png'), params={"SAVE": "YES"})
             dlg.add_action(WrapAction(TITLE_CANCEL, 'images/cancel.png'))
         else:
-            third_ids = [val_third['third'] for val_third in EntryLineAccount.objects.filter(
-                entry__date_value__gt=limit_date, third__gt=0).values('third')]
-            for third in Third.objects.filter(status=0):
-                if third.id not in third_ids:
-                    third.status = 1
-                    third.save()
+            thirds = self.get_thirds(limit_date)
+            if self.confirme(self.confirm_message % thirds.count()):
+                thirds.update(status=new_status)
+
+
+@ActionsManage.affect_list(_('Disabled'), '')
+@MenuManage.describ('accounting.add_third')
+class ThirdDisable(ThirdStatusChange):
+    caption = _("Disable third")
+    confirm_message = _('Do you want to disable %d thirds without activity after this date?')
+
+    def get_thirds(self, limit_date):
+        return Third.get_inactive_thirds(limit_date)
+
+    def fillresponse(self, limit_date=''):
+        ThirdStatusChange.fillresponse(self, limit_date, 1)
+
+
+@ActionsManage.affect_list(_('Enabled'), '')
+@MenuManage.describ('accounting.add_third')
+class ThirdEnable(ThirdStatusChange):
+    caption = _("Enable third")
+    confirm_message = _('Do you want to enable %d disabled thirds with activity after this date?')
+
+    def get_thirds(self, limit_date):
+        return Third.get_reactivated_thirds(limit_date)
+
+    def fillresponse(self, limit_date=''):
+        ThirdStatusChange.fillresponse(self, limit_date, 0)
 
 
 @ActionsManage.affect_grid(TITLE_ADD, "images/add.png", unique=SELECT_NONE)
@@ -243,7 +270,8 @@ class ThirdListing(XferPrintListing):
         items = sorted(items, key=lambda t: six.text_type(
             t))
         if (self.getparam('CRITERIA') is None) and (self.getparam('show_filter', 0) == 2):
-            items = [item for item in items if abs(item.get_total()) > 0.0001]
+            totals = Third.get_totals([item.id for item in items])
+            items = [item for item in items if abs(totals.get(item.id, 0)) > 0.0001]
         res = QuerySet(model=Third)
         res._result_cache = items
         return res
@@ -38,10 +38,11 @@ from lucterios.framework.xfercomponents import XferCompLabelForm, XferCompImage,
 from lucterios.framework.xfergraphic import XferContainerAcknowledge
 from lucterios.framework.signal_and_lock import Signal
 from lucterios.framework import signal_and_lock
+from lucterios.framework.error import LucteriosException
 from lucterios.CORE.xferprint import XferPrintListing
 from lucterios.CORE.views import ObjectMerge
 
-from diacamma.accounting.models import ChartsAccount, FiscalYear
+from diacamma.accounting.models import ChartsAccount, FiscalYear, ChartsAccountBalance
 from django.utils import six
 
 MenuManage.add_sub("bookkeeping", "financial", "diacamma.accounting/images/accounting.png", _("Bookkeeping"), _("Manage of Bookkeeping"), 30)
@@ -76,6 +77,9 @@ class ChartsAccountList(XferListEditor):
         if select_type != -1:
             self.filter &= Q(type_of_account=select_type)
 
+    def get_items_from_filter(self):
+        return XferListEditor.get_items_from_filter(self).prefetch_related('chartsaccountbalance_set')
+
     def fillresponse(self):
         XferListEditor.fillresponse(self)
         lbl = XferCompLabelForm("result")
@@ -174,6 +178,20 @@ class ChartsAccountInitial(XferContainerAcknowledge):
             ChartsAccount.import_initial(FiscalYear.get_current(self.getparam('year')), account_list)
 
 
+@ActionsManage.affect_grid(_("recalculate"), '', unique=SELECT_NONE)
+@MenuManage.describ('accounting.add_chartsaccount')
+class ChartsAccountRecalculate(XferContainerAcknowledge):
+    icon = "account.png"
+    model = ChartsAccount
+    field_id = 'chartsaccount'
+    caption = _("Recalculate totals of charts accounts")
+
+    def fillresponse(self):
+        year = FiscalYear.get_current(self.getparam('year'))
+        if self.confirme(_("Do you want to recalculate totals of charts accounts?")):
+            ChartsAccountBalance.rebuild(year)
+
+
 @ActionsManage.affect_list(TITLE_LISTING, "images/print.png")
 @MenuManage.describ('accounting.change_chartsaccount')
 class ChartsAccountListing(XferPrintListing):
@@ -259,4 +277,11 @@ class FiscalYearClose(XferContainerAcknowledge):
             dlg.add_action(WrapAction(TITLE_CANCEL, 'images/cancel.png'))
         else:
             signal_and_lock.Signal.call_signal("finalize_year", self)
-            current_year.closed()
+            closing_steps = []
+            try:
+                current_year.closed(progress=lambda step, nb, text: closing_steps.append((step, nb, text)))
+            except LucteriosException as error:
+                if len(closing_steps) == 0:
+                    raise
+                raise LucteriosException(error.code, _("Closing failed at step %(step)d/%(nb)d - %(text)s: %(error)s") % {'step': closing_steps[-1][0], 'nb': closing_steps[-1][1],
+                                                                                                                         'text': closing_steps[-1][2], 'error': six.text_type(error)})
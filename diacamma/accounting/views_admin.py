@@ -24,12 +24,16 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import unicode_literals
 
 from django.utils.translation import ugettext_lazy as _
+from django.db.models import Q
+from io import TextIOWrapper
 
-from lucterios.framework.xferadvance import XferListEditor, XferDelete, TITLE_ADD, TITLE_MODIFY, TITLE_DELETE
+from lucterios.framework.xferadvance import XferListEditor, XferDelete, TITLE_ADD, TITLE_MODIFY, TITLE_DELETE, TITLE_OK, TITLE_CANCEL
 from lucterios.framework.xferadvance import XferAddEditor
-from lucterios.framework.tools import FORMTYPE_MODAL, ActionsManage, MenuManage, SELECT_SINGLE, CLOSE_NO, SELECT_MULTI
+from lucterios.framework.tools import FORMTYPE_MODAL, ActionsManage, MenuManage, SELECT_SINGLE, CLOSE_NO, SELECT_MULTI,\
+    FORMTYPE_REFRESH, CLOSE_YES, WrapAction
 from lucterios.framework.xfergraphic import XferContainerAcknowledge, XferContainerCustom
-from lucterios.framework.xfercomponents import XferCompButton, XferCompLabelForm, XferCompSelect, XferCompImage, XferCompDownLoad
+from lucterios.framework.xfercomponents import XferCompButton, XferCompLabelForm, XferCompSelect, XferCompImage, XferCompDownLoad,\
+    XferCompUpLoad, XferCompEdit
 from lucterios.framework.error import LucteriosException, IMPORTANT
 from lucterios.framework import signal_and_lock
 from lucterios.CORE.parameters import Params
@@ -37,10 +41,10 @@ from lucterios.CORE.views import ParamEdit
 from lucterios.CORE.models import Parameter
 
 from diacamma.accounting.models import FiscalYear, Journal, AccountThird, ChartsAccount, ModelLineEntry,\
-    Third
+    Third, Budget
 from diacamma.accounting.system import accounting_system_list, accounting_system_name
 from diacamma.accounting.tools import clear_system_account, correct_accounting_code,\
-    current_system_account
+    current_system_account, refresh_code_classes, FinancialParams
 from django.utils import six
 from lucterios.contacts.models import CustomField
 
@@ -170,7 +174,8 @@ class FiscalYearExport(XferContainerCustom):
     def fillresponse(self):
         if self.getparam("year") is None:
             self.item = FiscalYear.get_current()
-        destination_file = self.item.get_xml_export()
+        export_progress = []
+        destination_file = self.item.get_xml_export(progress=lambda nb_entries, nb_total: export_progress.append((nb_entries, nb_total)))
         img = XferCompImage('img')
         img.set_value(self.icon_path())
         img.set_location(0, 0, 1, 6)
@@ -186,6 +191,89 @@ class FiscalYearExport(XferContainerCustom):
         down.set_download(destination_file)
         down.set_location(1, 1)
         self.add_component(down)
+        lbl = XferCompLabelForm('nb_entries')
+        lbl.set_value(_('%(nb)d/%(total)d entries exported') % {'nb': export_progress[-1][0], 'total': export_progress[-1][1]})
+        lbl.set_location(1, 2)
+        self.add_component(lbl)
+
+
+def add_exchange_format(xfer, exchange_format):
+    sel = XferCompSelect('exchange_format')
+    sel.set_select([('fec', _('FEC (Fichier des Ecritures Comptables)')), ('csv', _('CSV'))])
+    sel.set_value(exchange_format)
+    sel.description = _('format')
+    xfer.add_component(sel)
+    return sel
+
+
+@ActionsManage.affect_grid(_("Export entries"), "diacamma.accounting/images/entry.png", unique=SELECT_SINGLE)
+@MenuManage.describ('accounting.change_fiscalyear')
+class FiscalYearExportEntries(XferContainerCustom):
+    icon = "entry.png"
+    model = FiscalYear
+    field_id = 'fiscalyear'
+    caption = _("Export entries")
+
+    def fillresponse(self, exchange_format='fec'):
+        img = XferCompImage('img')
+        img.set_value(self.icon_path())
+        img.set_location(0, 0, 1, 6)
+        self.add_component(img)
+        lbl = XferCompLabelForm('title')
+        lbl.set_value_as_title(_('Export entries of fiscal year'))
+        lbl.set_location(1, 0)
+        self.add_component(lbl)
+        sel = add_exchange_format(self, exchange_format)
+        sel.set_action(self.request, self.get_action(), modal=FORMTYPE_REFRESH, close=CLOSE_NO)
+        sel.set_location(1, 1)
+        down = XferCompDownLoad('filename')
+        down.compress = True
+        down.set_value('entries_%s_%s.%s' % (self.item.begin.isoformat(), self.item.end.isoformat(), 'txt' if exchange_format == 'fec' else 'csv'))
+        down.set_download(self.item.get_entries_export(exchange_format))
+        down.set_location(1, 2)
+        self.add_component(down)
+
+
+@ActionsManage.affect_grid(_("Import entries"), "images/up.png", unique=SELECT_SINGLE)
+@MenuManage.describ('accounting.add_fiscalyear')
+class FiscalYearImportEntries(XferContainerAcknowledge):
+    icon = "entry.png"
+    model = FiscalYear
+    field_id = 'fiscalyear'
+    caption = _("Import entries")
+
+    def fillresponse(self, exchange_format='fec', encoding='utf-8'):
+        if 'importcontent' not in self.request.FILES.keys():
+            dlg = self.create_custom()
+            img = XferCompImage('img')
+            img.set_value(self.icon_path())
+            img.set_location(0, 0, 1, 4)
+            dlg.add_component(img)
+            lbl = XferCompLabelForm('title')
+            lbl.set_value_as_title(self.caption)
+            lbl.set_location(1, 0, 2)
+            dlg.add_component(lbl)
+            sel = add_exchange_format(dlg, exchange_format)
+            sel.set_location(1, 1, 2)
+            upld = XferCompUpLoad('importcontent')
+            upld.http_file = True
+            upld.maxsize = 256 * 1024 * 1024
+            upld.add_filter(".txt")
+            upld.add_filter(".csv")
+            upld.set_location(1, 2, 2)
+            upld.description = _('file')
+            dlg.add_component(upld)
+            edt = XferCompEdit('encoding')
+            edt.set_value(encoding)
+            edt.set_location(1, 3)
+            edt.description = _('encoding')
+            dlg.add_component(edt)
+            dlg.add_action(self.get_action(TITLE_OK, "images/ok.png"), close=CLOSE_YES)
+            dlg.add_action(WrapAction(TITLE_CANCEL, 'images/cancel.png'))
+        else:
+            importfile = TextIOWrapper(self.request.FILES['importcontent'].file, encoding=encoding, errors='replace')
+            nb_entries = self.item.import_entries(importfile, exchange_format)
+            self.message(_('%d entries imported') % nb_entries)
 
 
 @ActionsManage.affect_grid(TITLE_ADD, "images/add.png")
@@ -237,6 +325,11 @@ class JournalDel(XferDelete):
 
 @signal_and_lock.Signal.decorate('param_change')
 def paramchange_accounting(params):
+    FinancialParams.increase_version(params)
+    if 'accounting-system' in params:
+        refresh_code_classes(ChartsAccount, ChartsAccount.code_class_fields)
+        refresh_code_classes(Budget, Budget.code_class_fields)
+        FiscalYear.increase_write_version(Q())
     if 'accounting-sizecode' in params:
         for account in AccountThird.objects.all():
             if account.code != correct_accounting_code(account.code):
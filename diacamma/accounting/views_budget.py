@@ -17,8 +17,8 @@ from lucterios.framework.tools import SELECT_SINGLE
 from lucterios.framework.signal_and_lock import Signal
 from lucterios.CORE.xferprint import XferPrintAction
 
-from diacamma.accounting.tools import current_system_account, format_devise
-from diacamma.accounting.models import Budget, CostAccounting, FiscalYear, ChartsAccount, EntryLineAccount
+from diacamma.accounting.tools import format_devise
+from diacamma.accounting.models import Budget, CostAccounting, FiscalYear, ChartsAccount
 from django.db.models.aggregates import Sum
 
 
@@ -59,21 +59,13 @@ class BudgetList(XferListEditor):
             grid = self.get_components(field_id)
             grid.record_ids = []
             grid.records = {}
-            last_code = ''
-            value = 0
+            values = {}
             for current_budget in items:
-                if last_code != current_budget.code:
-                    if last_code != '':
-                        chart = ChartsAccount.get_chart_account(last_code)
-                        grid.set_value('C' + last_code, 'budget', six.text_type(chart))
-                        grid.set_value('C' + last_code, 'montant', format_devise(value, 2))
-                        value = 0
-                    last_code = current_budget.code
-                value += current_budget.credit_debit_way() * current_budget.amount
-            if last_code != '':
-                chart = ChartsAccount.get_chart_account(last_code)
-                grid.set_value('C' + last_code, 'budget', six.text_type(chart))
-                grid.set_value('C' + last_code, 'montant', format_devise(value, 2))
+                values[current_budget.code] = values.get(current_budget.code, 0) + current_budget.credit_debit_way() * current_budget.amount
+            charts = ChartsAccount.get_chart_accounts(values.keys())
+            for code in sorted(values.keys()):
+                grid.set_value('C' + code, 'budget', six.text_type(charts[code]))
+                grid.set_value('C' + code, 'montant', format_devise(values[code], 2))
             grid.nb_lines = len(grid.records)
             grid.order_list = None
             grid.page_max = 1
@@ -92,10 +84,10 @@ class BudgetList(XferListEditor):
         self.add_component(lbl)
 
         row_id = self.get_max_row()
-        revenue_filter = Q(code__regex=current_system_account().get_revenue_mask()) | (Q(code__regex=current_system_account().get_annexe_mask()) & Q(amount__gte=0))
+        revenue_filter = Q(is_revenue_code=True) | (Q(is_annexe_code=True) & Q(amount__gte=0))
         self.fill_grid(row_id, self.model, 'budget_revenue', self.model.objects.filter(self.filter & revenue_filter))
         self.move_components('budget_revenue', 2, 0)
-        expense_filter = Q(code__regex=current_system_account().get_expence_mask()) | (Q(code__regex=current_system_account().get_annexe_mask()) & Q(amount__lt=0))
+        expense_filter = Q(is_expense_code=True) | (Q(is_annexe_code=True) & Q(amount__lt=0))
         self.fill_grid(row_id, self.model, 'budget_expense', self.model.objects.filter(self.filter & expense_filter))
         self.remove_component('nb_budget_expense')
         self.remove_component('nb_budget_revenue')
@@ -264,33 +256,10 @@ class BudgetImport(XferContainerAcknowledge):
             dlg.add_action(self.get_action(TITLE_OK, "images/ok.png"), close=CLOSE_YES, params={'CONFIRME': 'YES'})
             dlg.add_action(WrapAction(TITLE_CANCEL, 'images/cancel.png'))
         else:
-            currentyear = self.getparam('currentyear', 0)
-            costaccounting = self.getparam('costaccounting', 0)
             if cost_accounting == 0:
-                budget_filter = Q(year_id=year)
+                Budget.import_from_year(year, self.getparam('currentyear', 0))
             else:
-                budget_filter = Q(cost_accounting_id=cost_accounting)
-            for budget_line in Budget.objects.filter(budget_filter):
-                if (cost_accounting != 0) or (budget_line.cost_accounting_id is None):
-                    budget_line.delete()
-            if cost_accounting == 0:
-                for chart in ChartsAccount.objects.filter(Q(year_id=currentyear) & Q(type_of_account__in=(3, 4))):
-                    value = chart.get_current_total()
-                    for current_budget in Budget.objects.filter(year_id=year, code=chart.code):
-                        value -= current_budget.amount
-                    if abs(value) > 0.001:
-                        Budget.objects.create(code=chart.code, amount=value, year_id=year)
-            else:
-                if year == 0:
-                    year = None
-                values = {}
-                for line in EntryLineAccount.objects.filter(account__type_of_account__in=(3, 4), entry__costaccounting_id=costaccounting):
-                    if line.account.code not in values.keys():
-                        values[line.account.code] = 0.0
-                    values[line.account.code] += line.amount
-                for code, value in values.items():
-                    if abs(value) > 0.001:
-                        Budget.objects.create(code=code, amount=value, year_id=year, cost_accounting_id=cost_accounting)
+                Budget.import_from_costaccounting(cost_accounting, self.getparam('costaccounting', 0))
 
 
 @ActionsManage.affect_list(_("Budget"), "account.png")
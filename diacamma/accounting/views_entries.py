@@ -30,7 +30,7 @@ from django.db.models import Q
 from lucterios.framework.xferadvance import XferShowEditor, XferDelete, XferSave, TITLE_LISTING, TITLE_DELETE, TITLE_OK, TITLE_CANCEL, TITLE_CLOSE, TITLE_MODIFY,\
     TITLE_EDIT, TITLE_ADD
 from lucterios.framework.tools import FORMTYPE_NOMODAL, CLOSE_NO, FORMTYPE_REFRESH, SELECT_SINGLE, SELECT_MULTI, SELECT_NONE, CLOSE_YES
-from lucterios.framework.tools import ActionsManage, MenuManage, WrapAction
+from lucterios.framework.tools import ActionsManage, MenuManage, WrapAction, ifplural
 from lucterios.framework.xferadvance import XferListEditor, XferAddEditor
 from lucterios.framework.xfergraphic import XferContainerAcknowledge, XferContainerCustom
 from lucterios.framework.xfercomponents import XferCompSelect, XferCompLabelForm, XferCompImage, XferCompFloat
@@ -91,6 +91,9 @@ class EntryAccountList(XferListEditor):
         self._filter_by_journal()
         self._filter_by_nature()
 
+    def get_items_from_filter(self):
+        return EntryAccount.prefetch_description(XferListEditor.get_items_from_filter(self))
+
     def fillresponse(self):
         XferListEditor.fillresponse(self)
         lbl = XferCompLabelForm("result")
@@ -153,6 +156,13 @@ class EntryAccountDel(XferDelete):
     field_id = 'entryaccount'
     caption = _("Delete accounting entry")
 
+    def fillresponse(self):
+        if self.items.filter(close=True).exists():
+            raise LucteriosException(IMPORTANT, _('entry of account closed!'))
+        if self.confirme(ifplural(len(self.items), _("Do you want delete this %(name)s ?") % {'name': self.model._meta.verbose_name},
+                                  _("Do you want delete those %(nb)s %(name)s ?") % {'nb': len(self.items), 'name': self.model._meta.verbose_name_plural})):
+            EntryAccount.delete_entries(self.items)
+
 
 @ActionsManage.affect_grid(_("Closed"), "images/ok.png", unique=SELECT_MULTI, condition=lambda xfer, gridname='': not hasattr(xfer.item, 'year') or ((xfer.item.year.status in [0, 1]) and (xfer.getparam('filter', 0) != 2)))
 @MenuManage.describ('accounting.add_entryaccount')
@@ -164,8 +174,7 @@ class EntryAccountClose(XferContainerAcknowledge):
 
     def fillresponse(self):
         if (len(self.items) > 0) and self.confirme(_("Do you want to close this entry?")):
-            for item in self.items:
-                item.closed()
+            EntryAccount.close_entries(self.items)
         if (len(self.items) == 1) and (self.getparam('REOPEN') == 'YES'):
             self.redirect_action(EntryAccountOpenFromLine.get_action())
 
@@ -229,10 +238,7 @@ class EntryAccountCostAccounting(XferContainerAcknowledge):
                 new_cost = None
             else:
                 new_cost = CostAccounting.objects.get(id=cost_accounting_id)
-            for item in self.items:
-                if (item.costaccounting is None) or (item.costaccounting.status == 0):
-                    item.costaccounting = new_cost
-                    item.save()
+            EntryAccount.set_costaccounting(self.items, new_cost)
 
 
 @ActionsManage.affect_grid(TITLE_EDIT, 'images/edit.png', unique=SELECT_SINGLE)
@@ -25,55 +25,111 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import unicode_literals
 import sys
 from datetime import date
+from hashlib import md5
 
-from django.utils.translation import ugettext_lazy as _
-from django.db.models import Q
-from django.db.models.aggregates import Sum
+from django.utils.translation import ugettext_lazy as _, get_language
+from django.db.models import Q, F, Value, Case, When, FloatField, IntegerField
+from django.db.models.aggregates import Sum, Count
+from django.db.models.functions import Coalesce
 from django.utils import six, formats
+from django.core.cache import cache
 
 from lucterios.framework.tools import MenuManage, FORMTYPE_NOMODAL, CLOSE_NO, FORMTYPE_REFRESH, \
     WrapAction, convert_date, ActionsManage, SELECT_MULTI
 from lucterios.framework.xfergraphic import XferContainerCustom
 from lucterios.framework.xfercomponents import XferCompImage, XferCompSelect, XferCompLabelForm, XferCompGrid, \
-    XferCompEdit, XferCompCheck
+    XferCompEdit, XferCompCheck, GRID_PAGE
 from lucterios.contacts.models import LegalEntity
 from lucterios.CORE.xferprint import XferPrintAction
 
-from diacamma.accounting.models import FiscalYear, format_devise, EntryLineAccount, \
-    ChartsAccount, CostAccounting, Budget, Third
+from diacamma.accounting.models import FiscalYear, EntryLineAccount, \
+    ChartsAccount, CostAccounting, Budget, Third, ChartsAccountMonthBalance
 from diacamma.accounting.tools import correct_accounting_code,\
-    current_system_account
+    current_system_account, get_devise_formatter, FinancialParams
 from lucterios.framework.xferadvance import TITLE_PRINT, TITLE_CLOSE
 
+CLOSED_REPORT_TIMEOUT = 7 * 24 * 3600
+
 
 def get_spaces(size):
     return ''.ljust(size, '-').replace('-', '&#160;')
 
 
+class ReportPeriod(object):
+
+    def __init__(self, year, begin=None, end=None, query=None):
+        self.year = year
+        self.begin = begin
+        self.end = end
+        self.query = query if query is not None else Q()
+
+    def __and__(self, other):
+        return ReportPeriod(self.year, self.begin, self.end, self.query & other)
+
+    def get_sums(self, fields):
+        return ChartsAccountMonthBalance.get_sums(self.year, self.begin, self.end, self.query, fields)
+
+
+def get_amount_sums(query, fields):
+    if isinstance(query, ReportPeriod):
+        return query.get_sums(fields)
+    else:
+        return list(EntryLineAccount.objects.filter(query).values(*fields).annotate(data_sum=Sum('amount')))
+
+
+def load_accounts_and_thirds(data_lines):
+    account_ids = set()
+    third_ids = set()
+    for data_line in data_lines:
+        if 'account' in data_line.keys():
+            account_ids.add(data_line['account'])
+        if ('third' in data_line.keys()) and (data_line['third'] is not None):
+            third_ids.add(data_line['third'])
+    accounts = {}
+    if len(account_ids) > 0:
+        for account in ChartsAccount.objects.filter(id__in=account_ids):
+            accounts[account.id] = account
+    thirds = {}
+    if len(third_ids) > 0:
+        for third in Third.objects.filter(id__in=third_ids).select_related('contact', 'contact__individual', 'contact__legalentity'):
+            thirds[third.id] = six.text_type(third)
+    return accounts, thirds
+
+
 def convert_query_to_account(query1, query2=None, query_budget=None, sign_value=None, with_third=False):
+    def get_code(code):
+        if code not in codes.keys():
+            codes[code] = correct_accounting_code(code)
+        return codes[code]
+
+    def get_chart_account(code):
+        if len(charts) == 0:
+            charts[None] = FiscalYear.get_current()
+            for chart in charts[None].chartsaccount_set.all():
+                charts[chart.code] = chart
+        if code not in charts.keys():
+            descript, typeaccount = current_system_account().new_charts_account(code)
+            charts[code] = ChartsAccount(year=charts[None], code=code, name=descript, type_of_account=typeaccount)
+        return charts[code]
+
     def credit_debit_way(data_line):
         if 'account' in data_line.keys():
-            account = ChartsAccount.objects.get(id=data_line['account'])
-            return account.credit_debit_way()
+            return accounts[data_line['account']].credit_debit_way()
         elif 'code' in data_line.keys():
-            account_code = correct_accounting_code(data_line['code'])
-            account = ChartsAccount.get_chart_account(account_code)
-            return account.credit_debit_way()
+            return get_chart_account(get_code(data_line['code'])).credit_debit_way()
         return 0
 
     def check_account(data_line):
         if 'account' in data_line.keys():
-            account = ChartsAccount.objects.get(id=data_line['account'])
-            account_code = correct_accounting_code(account.code)
+            account_code = get_code(accounts[data_line['account']].code)
         elif 'code' in data_line.keys():
-            account_code = correct_accounting_code(data_line['code'])
+            account_code = get_code(data_line['code'])
         if ('third' in data_line.keys()) and (data_line['third'] is not None):
             account_code = "%s#%s" % (account_code, data_line['third'])
         if account_code not in dict_account.keys():
-            account = ChartsAccount.get_chart_account(account_code.split('#')[0])
+            account = get_chart_account(account_code.split('#')[0])
             if ('third' in data_line.keys()) and (data_line['third'] is not None):
-                third = Third.objects.get(id=data_line['third'])
-                account_title = "[%s %s]" % (account.code, six.text_type(third))
+                account_title = "[%s %s]" % (account.code, thirds[data_line['third']])
             else:
                 account_title = account.get_name()
             dict_account[account_code] = [account_title, None, None]
@@ -83,82 +139,59 @@ def convert_query_to_account(query1, query2=None, query_budget=None, sign_value=
             else:
                 dict_account[account_code].append(None)
         return account_code
-    total1 = 0
-    total2 = None
-    total3 = None
-    dict_account = {}
     if with_third:
         fields = ['account', 'third']
     else:
         fields = ['account']
-    for data_line in EntryLineAccount.objects.filter(query1).values(*fields).annotate(data_sum=Sum('amount')):
-        if abs(data_line['data_sum']) > 0.001:
-            if sign_value is None:
-                account_code = check_account(data_line)
-                dict_account[account_code][1] = format_devise(data_line['data_sum'], 5)
-                total1 += data_line['data_sum']
-            elif isinstance(sign_value, bool):
-                spec_sign = 1 if sign_value else -1
-                account_code = check_account(data_line)
-                dict_account[account_code][1] = format_devise(spec_sign * credit_debit_way(data_line) * data_line['data_sum'], 5)
-                total1 += spec_sign * credit_debit_way(data_line) * data_line['data_sum']
-            elif (sign_value * credit_debit_way(data_line) * data_line['data_sum'] > 0):
-                account_code = check_account(data_line)
-                dict_account[account_code][1] = format_devise(abs(data_line['data_sum']), 5)
-                total1 += abs(data_line['data_sum'])
-    if query2 is not None:
-        total2 = 0
-        for data_line in EntryLineAccount.objects.filter(query2).values(*fields).annotate(data_sum=Sum('amount')):
-            if abs(data_line['data_sum']) > 0.001:
-                if sign_value is None:
-                    account_code = check_account(data_line)
-                    dict_account[account_code][2] = format_devise(data_line['data_sum'], 5)
-                    total2 += data_line['data_sum']
-                elif isinstance(sign_value, bool):
-                    spec_sign = 1 if sign_value else -1
-                    account_code = check_account(data_line)
-                    dict_account[account_code][2] = format_devise(spec_sign * credit_debit_way(data_line) * data_line['data_sum'], 5)
-                    total2 += spec_sign * credit_debit_way(data_line) * data_line['data_sum']
-                elif (sign_value * credit_debit_way(data_line) * data_line['data_sum'] > 0):
-                    account_code = check_account(data_line)
-                    dict_account[account_code][2] = format_devise(abs(data_line['data_sum']), 5)
-                    total2 += abs(data_line['data_sum'])
     if isinstance(query_budget, list):
         query_budget_list = query_budget
     else:
         query_budget_list = [query_budget]
-    total_b = []
-    id_dict = 3
+    data_columns = [get_amount_sums(query1, fields)]
+    if query2 is not None:
+        data_columns.append(get_amount_sums(query2, fields))
+    else:
+        data_columns.append(None)
     for query_budget_item in query_budget_list:
-        total3 = 0
         if query_budget_item is not None:
-            for data_line in Budget.objects.filter(query_budget_item).values('code').annotate(data_sum=Sum('amount')):
-                if abs(data_line['data_sum']) > 0.001:
-                    if sign_value is None:
-                        account_code = check_account(data_line)
-                        dict_account[account_code][id_dict] = format_devise(data_line['data_sum'], 5)
-                        total3 += data_line['data_sum']
-                    elif isinstance(sign_value, bool):
-                        spec_sign = 1 if sign_value else -1
-                        account_code = check_account(data_line)
-                        dict_account[account_code][id_dict] = format_devise(spec_sign * credit_debit_way(data_line) * data_line['data_sum'], 5)
-                        total3 += spec_sign * credit_debit_way(data_line) * data_line['data_sum']
-                    elif (sign_value * credit_debit_way(data_line) * data_line['data_sum'] > 0):
-                        account_code = check_account(data_line)
-                        dict_account[account_code][id_dict] = format_devise(abs(data_line['data_sum']), 5)
-                        total3 += abs(data_line['data_sum'])
-        id_dict += 1
-        total_b.append(total3)
+            data_columns.append(list(Budget.objects.filter(query_budget_item).values('code').annotate(data_sum=Sum('amount'))))
+        else:
+            data_columns.append([])
+    accounts, thirds = load_accounts_and_thirds([data_line for data_column in data_columns if data_column is not None for data_line in data_column])
+    codes = {}
+    charts = {}
+    dict_account = {}
+    totals = []
+    formatter = get_devise_formatter(5)
+    for id_dict, data_column in enumerate(data_columns, 1):
+        if data_column is None:
+            totals.append(None)
+            continue
+        total = 0
+        for data_line in data_column:
+            if abs(data_line['data_sum']) > 0.001:
+                value = None
+                if sign_value is None:
+                    value = data_line['data_sum']
+                elif isinstance(sign_value, bool):
+                    spec_sign = 1 if sign_value else -1
+                    value = spec_sign * credit_debit_way(data_line) * data_line['data_sum']
+                elif (sign_value * credit_debit_way(data_line) * data_line['data_sum'] > 0):
+                    value = abs(data_line['data_sum'])
+                if value is not None:
+                    dict_account[check_account(data_line)][id_dict] = formatter.format(value)
+                    total += value
+        totals.append(total)
     if isinstance(query_budget, list):
-        total3 = total_b
+        total3 = totals[2:]
     else:
-        total3 = total_b[0]
+        total3 = totals[2]
     res = []
     keys = list(dict_account.keys())
     keys.sort()
     for key in keys:
         res.append(dict_account[key])
-    return res, total1, total2, total3
+    return res, totals[0], totals[1], total3
 
 
 class FiscalYearReport(XferContainerCustom):
@@ -170,6 +203,7 @@ class FiscalYearReport(XferContainerCustom):
     def __init__(self, **kwargs):
         XferContainerCustom.__init__(self, **kwargs)
         self.filter = None
+        self.report_filter = None
         self.lastfilter = None
         self.budgetfilter_left = None
         self.budgetfilter_right = None
@@ -177,13 +211,37 @@ class FiscalYearReport(XferContainerCustom):
 
     def fillresponse(self):
         self.fill_header()
-        self.calcul_table()
+        self.fill_table()
         self.fill_body()
         self.fill_buttons()
 
     def define_gridheader(self):
         pass
 
+    def get_item_cache_params(self):
+        return [self.item.begin, self.item.end]
+
+    def get_cache_params(self):
+        return self.get_item_cache_params() + [self.getparam('filtercode', ''), self.getparam('with_third', False), self.getparam('with_opening', False)]
+
+    def fill_table(self):
+        if isinstance(self.item, FiscalYear) and (self.item.status == 2):
+            write_versions = None
+        else:
+            write_versions = FiscalYear.get_write_versions()
+        cache_key = 'diacamma.accounting.report_%s' % md5(six.text_type([self.__class__.__name__, self.model.__name__, self.item.id, get_language(),
+                                                                          FinancialParams.get_version(), write_versions, self.get_cache_params()]).encode()).hexdigest()
+        grid_values = cache.get(cache_key)
+        if grid_values is None:
+            self.calcul_table()
+            grid_values = (self.grid.record_ids, self.grid.records, self.grid.page_max, self.grid.page_num)
+            if write_versions is None:
+                cache.set(cache_key, grid_values, CLOSED_REPORT_TIMEOUT)
+            else:
+                cache.set(cache_key, grid_values)
+        else:
+            self.grid.record_ids, self.grid.records, self.grid.page_max, self.grid.page_num = grid_values
+
     def fill_filterheader(self):
         pass
 
@@ -198,6 +256,7 @@ class FiscalYearReport(XferContainerCustom):
             self.add_component(edt)
             if filtercode != '':
                 self.filter &= Q(account__code__startswith=filtercode)
+                self.report_filter &= Q(account__code__startswith=filtercode)
 
     def fill_header(self):
         self.item = FiscalYear.get_current(self.getparam("year"))
@@ -228,6 +287,9 @@ class FiscalYearReport(XferContainerCustom):
             end_filter.set_action(self.request, self.__class__.get_action(), close=CLOSE_NO, modal=FORMTYPE_REFRESH)
             self.filter &= Q(entry__date_value__gte=self.item.begin)
             self.filter &= Q(entry__date_value__lte=self.item.end)
+            self.report_filter = ReportPeriod(self.item, self.item.begin, self.item.end)
+        else:
+            self.report_filter = ReportPeriod(self.item)
         self.fill_filterCode()
         lbl = XferCompLabelForm("result")
         lbl.set_value_center(self.item.total_result_text)
@@ -249,6 +311,7 @@ class FiscalYearReport(XferContainerCustom):
         return line_idx
 
     def add_total_in_grid(self, total_in_left, total1_left, total2_left, totalb_left, total1_right, total2_right, totalb_right, line_idx):
+        formatter = get_devise_formatter(5)
         if (total2_left is None) or (total2_right is None):
             self.total_summary = (max(total1_left, total1_right), None, max(totalb_left, totalb_right))
         else:
@@ -307,13 +370,13 @@ class FiscalYearReport(XferContainerCustom):
                     pos_b = 'right_b'
                 else:
                     pos_b = 'left_b'
-            self.grid.set_value(line_idx, pos_n, format_devise(abs(result_n), 5))
+            self.grid.set_value(line_idx, pos_n, formatter.format(abs(result_n)))
             if (totalb_left is not None) and (abs(result_b) > 0.0001):
-                self.grid.set_value(line_idx, pos_b, format_devise(abs(result_b), 5))
+                self.grid.set_value(line_idx, pos_b, formatter.format(abs(result_b)))
             else:
                 pos_b = ""
             if (self.lastfilter is not None) and (abs(result_n_1) > 0.0001):
-                self.grid.set_value(line_idx, pos_n_1, format_devise(abs(result_n_1), 5))
+                self.grid.set_value(line_idx, pos_n_1, formatter.format(abs(result_n_1)))
             else:
                 pos_n_1 = ""
             if (pos_n != 'left_n') and (pos_n_1 != 'left_n_1') and (pos_b != 'left_b'):
@@ -322,24 +385,24 @@ class FiscalYearReport(XferContainerCustom):
                 self.grid.set_value(line_idx, 'right', '')
             line_idx += 1
         self.grid.set_value(line_idx, 'left', get_spaces(10) + "{[u]}{[b]}%s{[/b]}{[/u]}" % _('total'))
-        self.grid.set_value(line_idx, 'left_n', "{[u]}{[b]}%s{[/b]}{[/u]}" % format_devise(max(total1_left, total1_right), 5))
+        self.grid.set_value(line_idx, 'left_n', "{[u]}{[b]}%s{[/b]}{[/u]}" % formatter.format(max(total1_left, total1_right)))
         if self.lastfilter is not None:
-            self.grid.set_value(line_idx, 'left_n_1', "{[u]}{[b]}%s{[/b]}{[/u]}" % format_devise(max(total2_left, total2_right), 5))
+            self.grid.set_value(line_idx, 'left_n_1', "{[u]}{[b]}%s{[/b]}{[/u]}" % formatter.format(max(total2_left, total2_right)))
         if self.budgetfilter_left is not None:
-            self.grid.set_value(line_idx, 'left_b', "{[u]}{[b]}%s{[/b]}{[/u]}" % format_devise(max(totalb_left, totalb_right), 5))
+            self.grid.set_value(line_idx, 'left_b', "{[u]}{[b]}%s{[/b]}{[/u]}" % formatter.format(max(totalb_left, totalb_right)))
         self.grid.set_value(line_idx, 'right', get_spaces(10) + "{[u]}{[b]}%s{[/b]}{[/u]}" % _('total'))
-        self.grid.set_value(line_idx, 'right_n', "{[u]}{[b]}%s{[/b]}{[/u]}" % format_devise(max(total1_left, total1_right), 5))
+        self.grid.set_value(line_idx, 'right_n', "{[u]}{[b]}%s{[/b]}{[/u]}" % formatter.format(max(total1_left, total1_right)))
         if self.lastfilter is not None:
-            self.grid.set_value(line_idx, 'right_n_1', "{[u]}{[b]}%s{[/b]}{[/u]}" % format_devise(max(total2_left, total2_right), 5))
+            self.grid.set_value(line_idx, 'right_n_1', "{[u]}{[b]}%s{[/b]}{[/u]}" % formatter.format(max(total2_left, total2_right)))
         if self.budgetfilter_right is not None:
-            self.grid.set_value(line_idx, 'right_b', "{[u]}{[b]}%s{[/b]}{[/u]}" % format_devise(max(totalb_left, totalb_right), 5))
+            self.grid.set_value(line_idx, 'right_b', "{[u]}{[b]}%s{[/b]}{[/u]}" % formatter.format(max(totalb_left, totalb_right)))
         return line_idx
 
     def _add_left_right_accounting(self, left_filter, rigth_filter, total_in_left):
         data_line_left, total1_left, total2_left, totalb_left = convert_query_to_account(
-            self.filter & left_filter, self.lastfilter & left_filter if self.lastfilter is not None else None, self.budgetfilter_left)
+            self.report_filter & left_filter, self.lastfilter & left_filter if self.lastfilter is not None else None, self.budgetfilter_left)
         data_line_right, total1_right, total2_right, totalb_right = convert_query_to_account(
-            self.filter & rigth_filter, self.lastfilter & rigth_filter if self.lastfilter is not None else None, self.budgetfilter_right)
+            self.report_filter & rigth_filter, self.lastfilter & rigth_filter if self.lastfilter is not None else None, self.budgetfilter_right)
         line_idx = 0
         for line_idx in range(max(len(data_line_left), len(data_line_right))):
             if line_idx < len(data_line_left):
@@ -385,7 +448,7 @@ class FiscalYearBalanceSheet(FiscalYearReport):
 
     def fill_filterheader(self):
         if self.item.last_fiscalyear is not None:
-            self.lastfilter = Q(entry__year=self.item.last_fiscalyear)
+            self.lastfilter = ReportPeriod(self.item.last_fiscalyear)
             lbl = XferCompLabelForm('sep_last')
             lbl.set_value("{[br/]}{[br/]}")
             lbl.set_location(2, 11, 3)
@@ -418,14 +481,14 @@ class FiscalYearBalanceSheet(FiscalYearReport):
                 'right_n_1', self.item.last_fiscalyear.get_identify())
 
     def calcul_table(self):
-        cash_filter = Q(account__code__regex=current_system_account().get_cash_mask())
-        data_line_left, total1_lefta, total2_lefta, _b_left = convert_query_to_account(self.filter & cash_filter,
+        cash_filter = Q(account__is_cash_code=True)
+        data_line_left, total1_lefta, total2_lefta, _b_left = convert_query_to_account(self.report_filter & cash_filter,
                                                                                        self.lastfilter & cash_filter if self.lastfilter is not None else None,
                                                                                        None)
         left_line_idx = self.fill_grid(0, 'left', data_line_left)
 
         other_filter = Q(account__type_of_account__in=(0, 1, 2)) & ~cash_filter
-        data_line_left, total1_leftb, total2_leftb, _b_left = convert_query_to_account(self.filter & other_filter,
+        data_line_left, total1_leftb, total2_leftb, _b_left = convert_query_to_account(self.report_filter & other_filter,
                                                                                        self.lastfilter & other_filter if self.lastfilter is not None else None,
                                                                                        None, sign_value=-1)
         left_line_idx = self.fill_grid(left_line_idx, 'left', data_line_left)
@@ -434,7 +497,7 @@ class FiscalYearBalanceSheet(FiscalYearReport):
             total2_left = total2_lefta + total2_leftb
         else:
             total2_left = None
-        data_line_right, total1_right, total2_right, _b_right = convert_query_to_account(self.filter & other_filter,
+        data_line_right, total1_right, total2_right, _b_right = convert_query_to_account(self.report_filter & other_filter,
                                                                                          self.lastfilter & other_filter if self.lastfilter is not None else None,
                                                                                          None, sign_value=1)
         right_line_idx = self.fill_grid(0, 'right', data_line_right)
@@ -461,7 +524,7 @@ class FiscalYearIncomeStatement(FiscalYearReport):
 
     def fill_filterheader(self):
         if self.item.last_fiscalyear is not None:
-            self.lastfilter = Q(entry__year=self.item.last_fiscalyear)
+            self.lastfilter = ReportPeriod(self.item.last_fiscalyear)
             lbl = XferCompLabelForm('sep_last')
             lbl.set_value("{[br/]}{[br/]}")
             lbl.set_location(2, 11, 3)
@@ -480,15 +543,16 @@ class FiscalYearIncomeStatement(FiscalYearReport):
             self.add_component(lbl)
 
     def show_annexe(self, line_idx, budgetfilter):
+        formatter = get_devise_formatter(5)
         self.grid.set_value(line_idx + 1, 'left', '')
-        other_filter = Q(account__code__regex=current_system_account().get_annexe_mask())
-        budget_other = Q(code__regex=current_system_account().get_annexe_mask())
-        data_line_left, anx_total1_left, anx_total2_left, anx_totalb_left = convert_query_to_account(self.filter & other_filter,
+        other_filter = Q(account__is_annexe_code=True)
+        budget_other = Q(is_annexe_code=True)
+        data_line_left, anx_total1_left, anx_total2_left, anx_totalb_left = convert_query_to_account(self.report_filter & other_filter,
                                                                                                      self.lastfilter & other_filter if self.lastfilter is not None else None,
                                                                                                      budgetfilter & budget_other,
                                                                                                      sign_value=-1)
         left_line_idx = self.fill_grid(line_idx + 2, 'left', data_line_left)
-        data_line_right, anx_total1_right, anx_total2_right, anx_totalb_right = convert_query_to_account(self.filter & other_filter,
+        data_line_right, anx_total1_right, anx_total2_right, anx_totalb_right = convert_query_to_account(self.report_filter & other_filter,
                                                                                                          self.lastfilter & other_filter if self.lastfilter is not None else None,
                                                                                                          budgetfilter & budget_other,
                                                                                                          sign_value=1)
@@ -501,26 +565,26 @@ class FiscalYearIncomeStatement(FiscalYearReport):
             total1_right, total2_right, totalb_right = self.total_summary
             self.grid.set_value(left_line_idx, 'left', get_spaces(10) + "{[u]}{[b]}%s{[/b]}{[/u]}" % _('total with annexe'))
             total1_left += anx_total1_left
-            self.grid.set_value(left_line_idx, 'left_n', "{[u]}{[b]}%s{[/b]}{[/u]}" % format_devise(max(total1_left, total1_right), 5))
+            self.grid.set_value(left_line_idx, 'left_n', "{[u]}{[b]}%s{[/b]}{[/u]}" % formatter.format(max(total1_left, total1_right)))
             if self.lastfilter is not None:
                 total2_left += anx_total2_left
-                self.grid.set_value(left_line_idx, 'left_n_1', "{[u]}{[b]}%s{[/b]}{[/u]}" % format_devise(max(total2_left, total2_right), 5))
+                self.grid.set_value(left_line_idx, 'left_n_1', "{[u]}{[b]}%s{[/b]}{[/u]}" % formatter.format(max(total2_left, total2_right)))
             if self.budgetfilter_left is not None:
                 totalb_left += anx_totalb_left
-                self.grid.set_value(left_line_idx, 'left_b', "{[u]}{[b]}%s{[/b]}{[/u]}" % format_devise(max(totalb_left, totalb_right), 5))
+                self.grid.set_value(left_line_idx, 'left_b', "{[u]}{[b]}%s{[/b]}{[/u]}" % formatter.format(max(totalb_left, totalb_right)))
             self.grid.set_value(left_line_idx, 'right', get_spaces(10) + "{[u]}{[b]}%s{[/b]}{[/u]}" % _('total with annexe'))
             total1_right += anx_total1_right
-            self.grid.set_value(left_line_idx, 'right_n', "{[u]}{[b]}%s{[/b]}{[/u]}" % format_devise(max(total1_left, total1_right), 5))
+            self.grid.set_value(left_line_idx, 'right_n', "{[u]}{[b]}%s{[/b]}{[/u]}" % formatter.format(max(total1_left, total1_right)))
             if self.lastfilter is not None:
                 total2_right += anx_total2_right
-                self.grid.set_value(left_line_idx, 'right_n_1', "{[u]}{[b]}%s{[/b]}{[/u]}" % format_devise(max(total2_left, total2_right), 5))
+                self.grid.set_value(left_line_idx, 'right_n_1', "{[u]}{[b]}%s{[/b]}{[/u]}" % formatter.format(max(total2_left, total2_right)))
             if self.budgetfilter_right is not None:
                 totalb_right += anx_totalb_right
-                self.grid.set_value(left_line_idx, 'right_b', "{[u]}{[b]}%s{[/b]}{[/u]}" % format_devise(max(totalb_left, totalb_right), 5))
+                self.grid.set_value(left_line_idx, 'right_b', "{[u]}{[b]}%s{[/b]}{[/u]}" % formatter.format(max(totalb_left, totalb_right)))
 
     def calcul_table(self):
-        self.budgetfilter_right = Q(year=self.item) & Q(code__regex=current_system_account().get_revenue_mask())
-        self.budgetfilter_left = Q(year=self.item) & Q(code__regex=current_system_account().get_expence_mask())
+        self.budgetfilter_right = Q(year=self.item) & Q(is_revenue_code=True)
+        self.budgetfilter_left = Q(year=self.item) & Q(is_expense_code=True)
         line_idx = self._add_left_right_accounting(Q(account__type_of_account=4), Q(account__type_of_account=3), True)
         self.show_annexe(line_idx, Q(year=self.item))
 
@@ -529,6 +593,7 @@ class FiscalYearIncomeStatement(FiscalYearReport):
 class FiscalYearLedger(FiscalYearReport):
     caption = _("Ledger")
     add_filtering = True
+    lines_by_page = 1000
 
     def __init__(self, **kwargs):
         FiscalYearReport.__init__(self, **kwargs)
@@ -536,6 +601,7 @@ class FiscalYearLedger(FiscalYearReport):
         self.last_third = None
         self.last_total = 0
         self.line_idx = 1
+        self.account_continued = False
 
     def define_gridheader(self):
         self.grid = XferCompGrid('report_%d' % self.item.id)
@@ -547,25 +613,66 @@ class FiscalYearLedger(FiscalYearReport):
         self.grid.add_header('credit', _('credit'))
 
     def _add_total_account(self):
+        formatter = get_devise_formatter(0)
         if self.last_account is not None:
             self.grid.set_value(self.line_idx, 'entry.designation', get_spaces(30) + "{[i]}%s{[/i]}" % _('total'))
-            self.grid.set_value(self.line_idx, 'debit', "{[i]}%s{[/i]}" % format_devise(max((0, -1 * self.last_account.credit_debit_way() * self.last_total)), 0))
-            self.grid.set_value(self.line_idx, 'credit', "{[i]}%s{[/i]}" % format_devise(max((0, self.last_account.credit_debit_way() * self.last_total)), 0))
+            self.grid.set_value(self.line_idx, 'debit', "{[i]}%s{[/i]}" % formatter.format(max((0, -1 * self.last_account.credit_debit_way() * self.last_total))))
+            self.grid.set_value(self.line_idx, 'credit', "{[i]}%s{[/i]}" % formatter.format(max((0, self.last_account.credit_debit_way() * self.last_total))))
             self.line_idx += 1
             self.grid.set_value(self.line_idx, 'entry.designation', '{[br/]}')
             self.line_idx += 1
             self.last_total = 0
 
+    def get_cache_params(self):
+        return FiscalYearReport.get_cache_params(self) + [self.getparam('PRINTING', False), self.getparam(GRID_PAGE + self.grid.name, 0)]
+
+    def _get_ledger_lines(self, code_sizes):
+        self.account_continued = False
+        lines = EntryLineAccount.objects.filter(self.filter).select_related('entry', 'account', 'third', 'third__contact', 'third__contact__individual',
+                                                                             'third__contact__legalentity').order_by('account__code', 'entry__date_value', Coalesce('third', Value(0), output_field=IntegerField()), 'id')
+        nb_lines = sum([code_size[1] for code_size in code_sizes])
+        if self.getparam('PRINTING', False) or (nb_lines <= self.lines_by_page):
+            return lines.iterator()
+        self.grid.page_max = int((nb_lines - 1) / self.lines_by_page) + 1
+        self.grid.page_num = self.getparam(GRID_PAGE + self.grid.name, 0)
+        if self.grid.page_num >= self.grid.page_max:
+            self.grid.page_num = 0
+        line_offset = self.grid.page_num * self.lines_by_page
+        for account_code, nb_account_lines in code_sizes:
+            if line_offset < nb_account_lines:
+                break
+            line_offset -= nb_account_lines
+        first_date, first_third, first_id = lines.filter(account__code=account_code).values_list('entry__date_value', 'third', 'id')[line_offset]
+        if first_third is None:
+            third_filter = Q(third__isnull=False) | Q(third__isnull=True, id__gte=first_id)
+        else:
+            third_filter = Q(third__gt=first_third) | Q(third=first_third, id__gte=first_id)
+        lines = list(lines.filter(Q(account__code__gt=account_code) | Q(account__code=account_code, entry__date_value__gt=first_date) |
+                                  (Q(account__code=account_code, entry__date_value=first_date) & third_filter))[:self.lines_by_page + 1])
+        if len(lines) > self.lines_by_page:
+            self.account_continued = (lines[-1].account_id == lines[-2].account_id)
+            del lines[-1]
+        return lines
+
     def calcul_table(self):
         self.line_idx = 1
         self.last_account = None
         self.last_third = None
         self.last_total = 0
-        for line in EntryLineAccount.objects.filter(self.filter).order_by('account__code', 'entry__date_value', 'third'):
+        account_totals = {}
+        code_sizes = []
+        for data_item in EntryLineAccount.objects.filter(self.filter).order_by('account__code').values('account', 'account__code').annotate(data_count=Count('id'), data_sum=Sum('amount')):
+            account_totals[data_item['account']] = data_item['data_sum']
+            if (len(code_sizes) > 0) and (code_sizes[-1][0] == data_item['account__code']):
+                code_sizes[-1][1] += data_item['data_count']
+            else:
+                code_sizes.append([data_item['account__code'], data_item['data_count']])
+        for line in self._get_ledger_lines(code_sizes):
             if self.last_account != line.account:
                 self._add_total_account()
                 self.last_account = line.account
                 self.last_third = None
+                self.last_total = account_totals[line.account_id]
                 self.grid.set_value(self.line_idx, 'entry.designation', get_spaces(15) + "{[u]}{[b]}%s{[/b]}{[/u]}" % six.text_type(self.last_account))
                 self.line_idx += 1
             if self.last_third != line.third:
@@ -574,9 +681,9 @@ class FiscalYearLedger(FiscalYearReport):
             self.last_third = line.third
             for header in self.grid.headers:
                 self.grid.set_value(self.line_idx, header.name, line.evaluate('#' + header.name))
-            self.last_total += line.amount
             self.line_idx += 1
-        self._add_total_account()
+        if not self.account_continued:
+            self._add_total_account()
 
 
 @MenuManage.describ('accounting.change_fiscalyear', FORMTYPE_NOMODAL, 'bookkeeping', _('Show trial balance for current fiscal year'))
@@ -594,10 +701,19 @@ class FiscalYearTrialBalance(FiscalYearReport):
         edt.description = _("Detail by third")
         edt.set_action(self.request, self.__class__.get_action(), close=CLOSE_NO, modal=FORMTYPE_REFRESH)
         self.add_component(edt)
+        self.with_opening = self.getparam('with_opening', False)
+        edt = XferCompCheck('with_opening')
+        edt.set_value(self.with_opening)
+        edt.set_location(2, row + 1, 2)
+        edt.description = _("Show opening balance")
+        edt.set_action(self.request, self.__class__.get_action(), close=CLOSE_NO, modal=FORMTYPE_REFRESH)
+        self.add_component(edt)
 
     def define_gridheader(self):
         self.grid = XferCompGrid('report_%d' % self.item.id)
         self.grid.add_header('designation', _('name'))
+        if self.with_opening:
+            self.grid.add_header('opening', _('opening balance'))
         self.grid.add_header('total_debit', _('debit sum'))
         self.grid.add_header('total_credit', _('credit sum'))
         self.grid.add_header('solde_debit', _('debit'))
@@ -609,25 +725,30 @@ class FiscalYearTrialBalance(FiscalYearReport):
             fields = ['account', 'third']
         else:
             fields = ['account']
-        data_line_positifs = list(EntryLineAccount.objects.filter(self.filter & Q(amount__gt=0)).values(*fields).annotate(data_sum=Sum('amount')))
-        data_line_negatifs = list(EntryLineAccount.objects.filter(self.filter & Q(amount__lt=0)).values(*fields).annotate(data_sum=Sum('amount')))
-        for data_line in data_line_positifs + data_line_negatifs:
-            if abs(data_line['data_sum']) > 0.0001:
-                account = ChartsAccount.objects.get(id=data_line['account'])
+        if self.with_opening:
+            period_filter = ~Q(entry__journal=1)
+        else:
+            period_filter = Q()
+        data_lines = list(EntryLineAccount.objects.filter(self.filter).values(*fields).annotate(
+            data_positif=Sum(Case(When(period_filter & Q(amount__gt=0), then=F('amount')), default=Value(0), output_field=FloatField())),
+            data_negatif=Sum(Case(When(period_filter & Q(amount__lt=0), then=F('amount')), default=Value(0), output_field=FloatField())),
+            data_opening=Sum(Case(When(entry__journal=1, then=F('amount')), default=Value(0), output_field=FloatField()))))
+        accounts, thirds = load_accounts_and_thirds(data_lines)
+        for data_line in data_lines:
+            if not self.with_opening:
+                data_line['data_opening'] = 0
+            if (abs(data_line['data_positif']) > 0.0001) or (abs(data_line['data_negatif']) > 0.0001) or (abs(data_line['data_opening']) > 0.0001):
+                account = accounts[data_line['account']]
                 account_code = correct_accounting_code(account.code)
                 if ('third' in data_line.keys()) and (data_line['third'] is not None):
                     account_code = "%s#%s" % (account_code, data_line['third'])
-                if account_code not in balance_values.keys():
-                    if ('third' in data_line.keys()) and (data_line['third'] is not None):
-                        third = Third.objects.get(id=data_line['third'])
-                        account_title = "[%s %s]" % (account.code, six.text_type(third))
-                    else:
-                        account_title = account.get_name()
-                    balance_values[account_code] = [account_title, 0, 0]
-                if (account.credit_debit_way() * data_line['data_sum']) > 0.0001:
-                    balance_values[account_code][2] = account.credit_debit_way() * data_line['data_sum']
+                    account_title = "[%s %s]" % (account.code, thirds[data_line['third']])
+                else:
+                    account_title = account.get_name()
+                if account.credit_debit_way() > 0:
+                    balance_values[account_code] = [account_title, -1 * data_line['data_negatif'], data_line['data_positif'], data_line['data_opening']]
                 else:
-                    balance_values[account_code][1] = -1 * account.credit_debit_way() * data_line['data_sum']
+                    balance_values[account_code] = [account_title, data_line['data_positif'], -1 * data_line['data_negatif'], -1 * data_line['data_opening']]
         return balance_values
 
     def calcul_table(self):
@@ -635,16 +756,21 @@ class FiscalYearTrialBalance(FiscalYearReport):
         balance_values = self._get_balance_values()
         keys = list(balance_values.keys())
         keys.sort()
+        opening_formatter = get_devise_formatter(2)
+        total_formatter = get_devise_formatter(5)
+        solde_formatter = get_devise_formatter(0)
         for key in keys:
             self.grid.set_value(line_idx, 'designation', balance_values[key][0])
-            self.grid.set_value(line_idx, 'total_debit', format_devise(balance_values[key][1], 5))
-            self.grid.set_value(line_idx, 'total_credit', format_devise(balance_values[key][2], 5))
-            diff = balance_values[key][1] - balance_values[key][2]
-            self.grid.set_value(line_idx, 'solde_debit', format_devise(max(0, diff), 0))
+            if self.with_opening:
+                self.grid.set_value(line_idx, 'opening', opening_formatter.format(balance_values[key][3]))
+            self.grid.set_value(line_idx, 'total_debit', total_formatter.format(balance_values[key][1]))
+            self.grid.set_value(line_idx, 'total_credit', total_formatter.format(balance_values[key][2]))
+            diff = balance_values[key][1] - balance_values[key][2] - balance_values[key][3]
+            self.grid.set_value(line_idx, 'solde_debit', solde_formatter.format(max(0, diff)))
             if abs(diff) < 0.0001:
-                self.grid.set_value(line_idx, 'solde_credit', format_devise(0, 5))
+                self.grid.set_value(line_idx, 'solde_credit', total_formatter.format(0))
             else:
-                self.grid.set_value(line_idx, 'solde_credit', format_devise(max(0, -1 * diff), 0))
+                self.grid.set_value(line_idx, 'solde_credit', solde_formatter.format(max(0, -1 * diff)))
             line_idx += 1
 
 
@@ -707,7 +833,7 @@ class CostAccountingReport(FiscalYearReport):
         for self.item in self.items:
             self.new_tab(six.text_type(self.item))
             self.fill_header()
-            self.calcul_table()
+            self.fill_table()
             self.fill_body()
         self.fill_buttons()
 
@@ -741,10 +867,14 @@ class CostAccountingReport(FiscalYearReport):
         self.filltab_from_model(1, 6, True, [(
             (_('total revenue'), 'total_revenue'), (_('total expense'), 'total_expense'))])
         self.filter = Q(entry__costaccounting=self.item)
+        self.report_filter = self.filter
         self.fill_filterCode()
         self.fill_filterheader()
         self.define_gridheader()
 
+    def get_item_cache_params(self):
+        return [self.item.year_id, self.item.last_costaccounting_id]
+
     def fill_buttons(self):
         self.add_action(CostAccountingReportPrint.get_action(TITLE_PRINT, "images/print.png"),
                         close=CLOSE_NO, params={'classname': self.__class__.__name__})
@@ -784,8 +914,8 @@ class CostAccountingIncomeStatement(CostAccountingReport, FiscalYearIncomeStatem
                 self.item = old_accounting
 
     def calcul_table(self):
-        self.budgetfilter_right = Q(cost_accounting=self.item) & Q(code__regex=current_system_account().get_revenue_mask())
-        self.budgetfilter_left = Q(cost_accounting=self.item) & Q(code__regex=current_system_account().get_expence_mask())
+        self.budgetfilter_right = Q(cost_accounting=self.item) & Q(is_revenue_code=True)
+        self.budgetfilter_left = Q(cost_accounting=self.item) & Q(is_expense_code=True)
         line_idx = self._add_left_right_accounting(Q(account__type_of_account=4), Q(account__type_of_account=3), True)
         self.show_annexe(line_idx, Q(cost_accounting=self.item))
 
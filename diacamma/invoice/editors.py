@@ -36,7 +36,7 @@ from lucterios.framework.tools import CLOSE_NO, FORMTYPE_REFRESH, ActionsManage,
 from lucterios.framework.models import get_value_if_choices
 from lucterios.CORE.parameters import Params
 
-from diacamma.accounting.tools import current_system_account, format_devise
+from diacamma.accounting.tools import format_devise, FinancialParams
 from diacamma.accounting.models import CostAccounting, FiscalYear, Third
 from diacamma.payoff.editors import SupportingEditor
 from django.utils import six
@@ -47,7 +47,7 @@ from datetime import date
 class ArticleEditor(LucteriosEditor):
 
     def edit(self, xfer):
-        currency_decimal = Params.getvalue("accounting-devise-prec")
+        currency_decimal = FinancialParams.getvalue("accounting-devise-prec")
         xfer.get_components('price').prec = currency_decimal
         old_account = xfer.get_components("sell_account")
         xfer.tab = old_account.tab
@@ -55,7 +55,7 @@ class ArticleEditor(LucteriosEditor):
         sel_code = XferCompSelect("sell_account")
         sel_code.description = old_account.description
         sel_code.set_location(old_account.col, old_account.row, old_account.colspan + 1, old_account.rowspan)
-        for item in FiscalYear.get_current().chartsaccount_set.all().filter(code__regex=current_system_account().get_revenue_mask()).order_by('code'):
+        for item in FiscalYear.get_current().chartsaccount_set.all().filter(is_revenue_code=True).order_by('code'):
             sel_code.select_list.append((item.code, six.text_type(item)))
         sel_code.set_value(self.item.sell_account)
         xfer.add_component(sel_code)
@@ -128,13 +128,13 @@ class BillEditor(SupportingEditor):
             self.item.bill_type, self.item.get_field_by_name('bill_type')))
         xfer.add_component(lbl)
         details = xfer.get_components('detail')
-        if Params.getvalue("invoice-vat-mode") != 0:
-            if Params.getvalue("invoice-vat-mode") == 1:
+        if FinancialParams.getvalue("invoice-vat-mode") != 0:
+            if FinancialParams.getvalue("invoice-vat-mode") == 1:
                 details.headers[2] = XferCompHeader(details.headers[2].name, _('price excl. taxes'),
                                                     details.headers[2].type, details.headers[2].orderable)
                 details.headers[7] = XferCompHeader(details.headers[7].name, _('total excl. taxes'),
                                                     details.headers[7].type, details.headers[7].orderable)
-            elif Params.getvalue("invoice-vat-mode") == 2:
+            elif FinancialParams.getvalue("invoice-vat-mode") == 2:
                 details.headers[2] = XferCompHeader(details.headers[2].name, _('price incl. taxes'),
                                                     details.headers[2].type, details.headers[2].orderable)
                 details.headers[7] = XferCompHeader(details.headers[7].name, _('total incl. taxes'),
@@ -217,14 +217,14 @@ class DetailEditor(LucteriosEditor, DetailFilter):
 
     def before_save(self, xfer):
         self.item.vta_rate = 0
-        if (Params.getvalue("invoice-vat-mode") != 0) and (self.item.article is not None) and (self.item.article.vat is not None):
+        if (FinancialParams.getvalue("invoice-vat-mode") != 0) and (self.item.article is not None) and (self.item.article.vat is not None):
             self.item.vta_rate = float(self.item.article.vat.rate / 100)
-        if Params.getvalue("invoice-vat-mode") == 2:
+        if FinancialParams.getvalue("invoice-vat-mode") == 2:
             self.item.vta_rate = -1 * self.item.vta_rate
         return
 
     def edit(self, xfer):
-        currency_decimal = Params.getvalue("accounting-devise-prec")
+        currency_decimal = FinancialParams.getvalue("accounting-devise-prec")
         xfer.get_components('price').prec = currency_decimal
         xfer.get_components('reduce').prec = currency_decimal
         xfer.get_components('designation').with_hypertext = True
@@ -23,7 +23,6 @@ along with Lucterios.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 from __future__ import unicode_literals
-from re import match
 from datetime import date
 
 from django.db import models
@@ -46,7 +45,7 @@ from lucterios.CORE.parameters import Params
 from diacamma.accounting.models import FiscalYear, Third, EntryAccount, \
     CostAccounting, Journal, EntryLineAccount, ChartsAccount, AccountThird
 from diacamma.accounting.tools import current_system_account, format_devise, \
-    currency_round, correct_accounting_code
+    currency_round, correct_accounting_code, FinancialParams
 from diacamma.payoff.models import Supporting
 import logging
 from lucterios.contacts.models import CustomField, CustomizeObject
@@ -428,7 +427,7 @@ class Bill(Supporting):
 
     @property
     def total(self):
-        if Params.getvalue("invoice-vat-mode") == 2:
+        if FinancialParams.getvalue("invoice-vat-mode") == 2:
             return self.total_incltax
         else:
             return self.total_excltax
@@ -533,7 +532,7 @@ class Bill(Supporting):
                 else:
                     detail_code = Params.getvalue("invoice-default-sell-account")
                 detail_account = None
-                if match(current_system_account().get_revenue_mask(), detail_code) is not None:
+                if current_system_account().match_mask(current_system_account().get_revenue_mask(), detail_code):
                     try:
                         detail_account = ChartsAccount.get_account(
                             detail_code, FiscalYear.get_current())
@@ -857,16 +856,16 @@ class Detail(LucteriosModel):
         return newdetail
 
     def get_price(self):
-        if (Params.getvalue("invoice-vat-mode") == 2) and (self.vta_rate > 0.001):
+        if (FinancialParams.getvalue("invoice-vat-mode") == 2) and (self.vta_rate > 0.001):
             return currency_round(self.price * self.vta_rate)
-        if (Params.getvalue("invoice-vat-mode") == 1) and (self.vta_rate < -0.001):
+        if (FinancialParams.getvalue("invoice-vat-mode") == 1) and (self.vta_rate < -0.001):
             return currency_round(self.price * -1 * self.vta_rate / (1 - self.vta_rate))
         return float(self.price)
 
     def get_reduce(self):
-        if (Params.getvalue("invoice-vat-mode") == 2) and (self.vta_rate > 0.001):
+        if (FinancialParams.getvalue("invoice-vat-mode") == 2) and (self.vta_rate > 0.001):
             return currency_round(self.reduce * self.vta_rate)
-        if (Params.getvalue("invoice-vat-mode") == 1) and (self.vta_rate < -0.001):
+        if (FinancialParams.getvalue("invoice-vat-mode") == 1) and (self.vta_rate < -0.001):
             return currency_round(self.reduce * -1 * self.vta_rate / (1 - self.vta_rate))
         return float(self.reduce)
 
@@ -883,9 +882,9 @@ class Detail(LucteriosModel):
 
     @property
     def total(self):
-        if Params.getvalue("invoice-vat-mode") == 2:
+        if FinancialParams.getvalue("invoice-vat-mode") == 2:
             return self.total_incltax
-        elif Params.getvalue("invoice-vat-mode") == 1:
+        elif FinancialParams.getvalue("invoice-vat-mode") == 1:
             return self.total_excltax
         else:
             return format_devise(self.get_total(), 5)
@@ -42,13 +42,13 @@ from lucterios.framework.error import LucteriosException, IMPORTANT
 from lucterios.framework import signal_and_lock
 
 from lucterios.CORE.xferprint import XferPrintAction, XferPrintReporting
-from lucterios.CORE.parameters import Params
 from lucterios.CORE.editors import XferSavedCriteriaSearchEditor
 
 from lucterios.contacts.models import Individual, LegalEntity
 
 from diacamma.invoice.models import Article, Bill, Detail, Category, Provider
 from diacamma.accounting.models import FiscalYear, Third
+from diacamma.accounting.tools import FinancialParams
 from diacamma.payoff.views import PayoffAddModify
 from diacamma.payoff.models import Payoff
 from django.db.models.query import QuerySet
@@ -126,10 +126,10 @@ class BillList(XferListEditor):
         XferListEditor.fillresponse(self)
         grid = self.get_components(self.field_id)
         grid.colspan = 3
-        if Params.getvalue("invoice-vat-mode") == 1:
+        if FinancialParams.getvalue("invoice-vat-mode") == 1:
             grid.headers[5] = XferCompHeader(grid.headers[5].name, _('total excl. taxes'),
                                              grid.headers[5].type, grid.headers[5].orderable)
-        elif Params.getvalue("invoice-vat-mode") == 2:
+        elif FinancialParams.getvalue("invoice-vat-mode") == 2:
             grid.headers[5] = XferCompHeader(grid.headers[5].name, _('total incl. taxes'),
                                              grid.headers[5].type, grid.headers[5].orderable)
 
@@ -36,7 +36,7 @@ from lucterios.CORE.parameters import Params
 from lucterios.CORE.views import ParamEdit, ObjectImport
 from lucterios.CORE.models import Parameter
 
-from diacamma.accounting.tools import correct_accounting_code
+from diacamma.accounting.tools import correct_accounting_code, FinancialParams
 from diacamma.invoice.models import Vat, Article, Category, StorageArea
 from diacamma.accounting.system import accounting_system_ident
 from lucterios.contacts.models import CustomField
@@ -184,6 +184,7 @@ def comptenofound_invoice(known_codes, accompt_returned):
 
 @signal_and_lock.Signal.decorate('param_change')
 def paramchange_invoice(params):
+    FinancialParams.increase_version(params)
     invoice_params = ['invoice-default-sell-account', 'invoice-vatsell-account',
                       'invoice-reduce-account', 'invoice-account-third']
     if 'accounting-sizecode' in params:
@@ -37,7 +37,7 @@ from lucterios.contacts.models import LegalEntity
 
 from diacamma.payoff.models import Supporting
 from diacamma.accounting.models import FiscalYear
-from diacamma.accounting.tools import current_system_account
+from diacamma.accounting.tools import FinancialParams
 
 
 class SupportingEditor(LucteriosEditor):
@@ -99,7 +99,7 @@ class BankAccountEditor(LucteriosEditor):
         sel_code = XferCompSelect("account_code")
         sel_code.description = old_account.description
         sel_code.set_location(old_account.col, old_account.row, old_account.colspan + 1, old_account.rowspan)
-        for item in FiscalYear.get_current().chartsaccount_set.all().filter(code__regex=current_system_account().get_cash_mask()).order_by('code'):
+        for item in FiscalYear.get_current().chartsaccount_set.all().filter(is_cash_code=True).order_by('code'):
             sel_code.select_list.append((item.code, six.text_type(item)))
         sel_code.set_value(self.item.account_code)
         xfer.add_component(sel_code)
@@ -116,7 +116,7 @@ class PayoffEditor(LucteriosEditor):
         return
 
     def edit(self, xfer):
-        currency_decimal = Params.getvalue("accounting-devise-prec")
+        currency_decimal = FinancialParams.getvalue("accounting-devise-prec")
         fee_code = Params.getvalue("payoff-bankcharges-account")
         supportings = xfer.getparam('supportings', ())
         if len(supportings) > 0:
@@ -46,7 +46,7 @@ from lucterios.contacts.models import LegalEntity, Individual
 
 from diacamma.accounting.models import EntryAccount, FiscalYear, Third, Journal, \
     ChartsAccount, EntryLineAccount, AccountLink
-from diacamma.accounting.tools import format_devise, currency_round, correct_accounting_code
+from diacamma.accounting.tools import format_devise, currency_round, correct_accounting_code, get_devise_formatter
 from django.core.exceptions import ObjectDoesNotExist
 
 
@@ -581,6 +581,7 @@ class DepositDetail(LucteriosModel):
                 reference__icontains=reference)
         if order_list is not None:
             entity_unknown = entity_unknown.order_by(*order_list)
+        formatter = get_devise_formatter(5)
         for values in entity_unknown:
             payoff = {}
             payoff['id'] = values['entry_id']
@@ -589,7 +590,7 @@ class DepositDetail(LucteriosModel):
                 bills.append(six.text_type(supporting.get_final_child()))
             payoff['bill'] = '{[br/]}'.join(bills)
             payoff['payer'] = values['payer']
-            payoff['amount'] = format_devise(values['amount'], 5)
+            payoff['amount'] = formatter.format(values['amount'])
             payoff['date'] = values['date']
             payoff['reference'] = values['reference']
             payoff_nodeposit.append(payoff)
@@ -15,7 +15,7 @@ from lucterios.CORE.views import ParamEdit
 from lucterios.framework import signal_and_lock
 from lucterios.CORE.models import Parameter
 
-from diacamma.accounting.tools import correct_accounting_code
+from diacamma.accounting.tools import correct_accounting_code, FinancialParams
 from diacamma.payoff.models import BankAccount, PaymentMethod
 from diacamma.accounting.system import accounting_system_ident
 
@@ -107,6 +107,7 @@ def comptenofound_payoff(known_codes, accompt_returned):
 
 @signal_and_lock.Signal.decorate('param_change')
 def paramchange_payoff(params):
+    FinancialParams.increase_version(params)
     if 'accounting-sizecode' in params:
         for bank in BankAccount.objects.all():
             if bank.account_code != correct_accounting_code(bank.account_code):